@@ -0,0 +1,484 @@
+"""
+Checks the content of the annotations before they are converted, and finds near-duplicate images.
+
+Every annotation/image pair is scanned in a process pool: the boxes are read from the xml as written, before any
+conversion, and checked against the image size read from the JPEG header, so no image is fully decoded. Each image is
+also hashed with a 64 bit difference hash, decoded at 1/8 of its size, and the hashes go into a HashIndex that finds
+the pairs within a few bits of each other without comparing every pair.
+
+The report lists the flagged boxes and samples, and the groups of near-duplicates. Its exclusions, see exclusions(),
+are what createSFrame leaves out, or what filterSFrame drops from an SFrame already written:
+
+	python annotationQuality.py annotations/ images/ --report quality_report.json
+"""
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+import numpy as np
+import cv2
+import turicreate as tc
+
+import instrument
+from fileIndex import FileIndex
+from imageCache import jpeg_size
+from xmlToSFrame import BOUNDING_TAGS, TCHandler
+from annotationStore import AnnotationStore
+
+try:
+	import xml.etree.cElementTree as et
+except ImportError:
+	import xml.etree.ElementTree as et
+
+# Box issues that make a box unusable, the box is dropped
+BOX_ERRORS = ('inverted', 'zero_area', 'out_of_bounds')
+# Box issues worth a look that are kept
+BOX_WARNINGS = ('tiny', 'extreme_aspect')
+# Sample issues, the whole sample is dropped
+SAMPLE_ERRORS = ('malformed_xml', 'unreadable_image', 'no_boxes')
+
+HASH_BITS = 64
+
+
+def dhash(path):
+	"""
+	Computes the 64 bit difference hash of an image: whether each pixel of a 9x8 grayscale thumbnail is brighter than
+	its left neighbour. JPEGs are decoded at 1/8 of their size, which is plenty for a 9x8 thumbnail.
+
+	Returns
+	-------
+	int or None
+		The hash, or None if the image can't be read.
+	"""
+	img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+	if img is None:
+		img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+	if img is None:
+		return None
+	small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+	bits = (small[:, 1:] > small[:, :-1]).ravel()
+	return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming(a, b):
+	return bin(a ^ b).count('1')
+
+
+def read_boxes(xml_file):
+	"""
+	Reads the boxes of an annotation file as written, without the checks and conversion of ImageHandler.
+
+	Returns
+	-------
+	numpy.ndarray
+		(N, 4) xyxy boxes.
+
+	Raises
+	------
+	ValueError
+		If a coordinate isn't a number or a box misses one of its coordinates.
+	"""
+	coordinates = dict((key, []) for key in BOUNDING_TAGS.values())
+	for _, elem in et.iterparse(xml_file):
+		if elem.tag in BOUNDING_TAGS:
+			coordinates[BOUNDING_TAGS[elem.tag]].append(float(elem.text))
+		elem.clear()
+	if len(set(len(values) for values in coordinates.values())) != 1:
+		raise ValueError("Boxes with missing coordinates")
+	return np.asarray([coordinates['xMin'], coordinates['yMin'], coordinates['xMax'], coordinates['yMax']],
+					  dtype=np.float64).reshape(4, -1).T
+
+
+def check_boxes(xyxy, width, height, tolerance=1, min_area_fraction=0.0005, max_aspect=20.0):
+	"""
+	Flags the boxes of one image.
+
+	Parameters
+	----------
+	xyxy : numpy.ndarray
+		(N, 4) boxes as written in the annotation file.
+	width : int
+		Width of the image.
+	height : int
+		Height of the image.
+	tolerance : int, optional
+		Pixels a box may reach past the image border, ImageNet boxes are sometimes 1 based.
+	min_area_fraction : float, optional
+		Boxes covering less of the image than this are flagged 'tiny'.
+	max_aspect : float, optional
+		Boxes longer than this many times their width, or the other way around, are flagged 'extreme_aspect'.
+
+	Returns
+	-------
+	dict
+		Issue name -> (N,) boolean mask, for the BOX_ERRORS and BOX_WARNINGS.
+	"""
+	x_min, y_min, x_max, y_max = xyxy.T
+	box_w = x_max - x_min
+	box_h = y_max - y_min
+	valid = (box_w > 0) & (box_h > 0)
+	short = np.where(valid, np.minimum(box_w, box_h), 1)
+	return {
+		'inverted': (box_w < 0) | (box_h < 0),
+		'zero_area': (box_w == 0) | (box_h == 0),
+		'out_of_bounds': (x_min < -tolerance) | (y_min < -tolerance) | (x_max > width + tolerance) |
+						 (y_max > height + tolerance),
+		'tiny': valid & (box_w * box_h < min_area_fraction * width * height),
+		'extreme_aspect': valid & (np.maximum(box_w, box_h) > max_aspect * short),
+	}
+
+
+def _scan_sample(job):
+	"""
+	Scans one annotation/image pair. Used as the process pool entry point, so it has to live at module level.
+
+	Parameters
+	----------
+	job : tuple
+		(label, stem, xml file, image file, check_boxes keyword arguments).
+
+	Returns
+	-------
+	dict
+		The sample, its image size, the issues of the sample, the issues of each flagged box and the image hash.
+	"""
+	label, stem, xml_file, image_file, options = job
+	result = {
+		'label': label,
+		'stem': stem,
+		'xml': xml_file,
+		'image': image_file,
+		'size': None,
+		'boxes': 0,
+		'issues': [],
+		'box_issues': {},
+		'hash': None,
+	}
+
+	size = jpeg_size(image_file)
+	if size is None:
+		# Not a JPEG, or a damaged header: the full decode is the only way to tell its size
+		img = cv2.imread(image_file)
+		size = (img.shape[1], img.shape[0]) if img is not None else None
+	if size is None:
+		result['issues'].append('unreadable_image')
+	else:
+		result['size'] = list(size)
+		result['hash'] = dhash(image_file)
+
+	try:
+		xyxy = read_boxes(xml_file)
+	except (ValueError, TypeError, et.ParseError):
+		result['issues'].append('malformed_xml')
+		return result
+
+	result['boxes'] = len(xyxy)
+	if not len(xyxy):
+		result['issues'].append('no_boxes')
+	if size is None or not len(xyxy):
+		return result
+
+	flags = check_boxes(xyxy, size[0], size[1], **options)
+	for i in np.flatnonzero(np.any([flags[issue] for issue in BOX_ERRORS + BOX_WARNINGS], axis=0)):
+		result['box_issues'][str(i)] = [issue for issue in BOX_ERRORS + BOX_WARNINGS if flags[issue][i]]
+	return result
+
+
+class HashIndex(object):
+	def __init__(self, max_distance=4, bits=HASH_BITS):
+		"""
+		Index of image hashes answering which hashes are within max_distance bits of a new one.
+
+		The hash is cut into max_distance + 1 bands, and each band is a dict of its value -> hash ids. Two hashes at most
+		max_distance bits apart agree on at least one band, so only the ids sharing a band with the query are compared.
+
+		Parameters
+		----------
+		max_distance : int, optional
+			Largest Hamming distance between near-duplicates.
+		bits : int, optional
+			Length of the hashes.
+		"""
+		self.max_distance = max_distance
+		num_bands = max_distance + 1
+		edges = [bits * i // num_bands for i in range(num_bands + 1)]
+		# (shift, mask) of each band
+		self.bands = [(start, (1 << (end - start)) - 1) for start, end in zip(edges[:-1], edges[1:])]
+		self.buckets = [{} for _ in self.bands]
+		self.hashes = []
+
+	def __len__(self):
+		return len(self.hashes)
+
+	def add(self, value):
+		"""
+		Adds a hash and returns its id.
+		"""
+		hash_id = len(self.hashes)
+		self.hashes.append(value)
+		for (shift, mask), buckets in zip(self.bands, self.buckets):
+			buckets.setdefault((value >> shift) & mask, []).append(hash_id)
+		return hash_id
+
+	def query(self, value):
+		"""
+		Returns the (id, distance) of every indexed hash within max_distance bits of value.
+		"""
+		candidates = set()
+		for (shift, mask), buckets in zip(self.bands, self.buckets):
+			candidates.update(buckets.get((value >> shift) & mask, ()))
+		matches = []
+		for hash_id in sorted(candidates):
+			distance = hamming(value, self.hashes[hash_id])
+			if distance <= self.max_distance:
+				matches.append((hash_id, distance))
+		return matches
+
+
+def find_duplicates(keys, hashes, max_distance=4):
+	"""
+	Groups near-duplicate images.
+
+	Parameters
+	----------
+	keys : list
+		A key per image, for e.g. its stem.
+	hashes : list of int
+		The dhash of each image, None for images that couldn't be hashed.
+	max_distance : int, optional
+		Largest Hamming distance between near-duplicates.
+
+	Returns
+	-------
+	list of list
+		The keys of each group of two or more near-duplicates, in the order of keys.
+	"""
+	index = HashIndex(max_distance)
+	parents = []
+	owners = []
+
+	def root(i):
+		while parents[i] != i:
+			parents[i] = parents[parents[i]]
+			i = parents[i]
+		return i
+
+	for i, value in enumerate(hashes):
+		parents.append(i)
+		if value is None:
+			continue
+		for hash_id, _ in index.query(value):
+			a, b = root(owners[hash_id]), root(i)
+			parents[max(a, b)] = min(a, b)
+		index.add(value)
+		owners.append(i)
+
+	groups = {}
+	for i in range(len(keys)):
+		groups.setdefault(root(i), []).append(keys[i])
+	return [group for _, group in sorted(groups.items()) if len(group) > 1]
+
+
+@instrument.timed('scan', unit='images')
+def scanAnnotations(annotatations_dir=None, image_dir=None, index=None, num_workers=1, chunk_size=64, tolerance=1,
+					min_area_fraction=0.0005, max_aspect=20.0, max_distance=4, report_path=None):
+	"""
+	Scans every annotation/image pair for bad boxes and near-duplicate images, without converting anything.
+
+	Parameters
+	----------
+	annotatations_dir : str, optional
+		Directory holding a folder of xml files per label.
+	image_dir : str, optional
+		Directory holding a folder of images per label.
+	index : FileIndex, optional
+		Index of both directories built earlier in the run. If not given, they are scanned here.
+	num_workers : int, optional
+		Number of processes scanning the samples. A value of 1 scans everything in the current process.
+	chunk_size : int, optional
+		Number of samples handed to a worker at a time.
+	tolerance, min_area_fraction, max_aspect : optional
+		See check_boxes.
+	max_distance : int, optional
+		Largest Hamming distance between the hashes of near-duplicate images, out of 64 bits. 0 only finds exact
+		duplicates of the thumbnail.
+	report_path : str, optional
+		If given, the report is also written there as json.
+
+	Returns
+	-------
+	dict
+		- 'images', 'boxes': number of samples and boxes scanned
+		- 'counts': issue -> number of boxes or samples flagged, and 'duplicate' -> images beyond the first of a group
+		- 'samples': stem -> scan result, for the flagged samples only
+		- 'duplicates': the stems of each group of near-duplicates
+	"""
+	if index is None:
+		index = FileIndex(annotatations_dir, image_dir)
+
+	options = {'tolerance': tolerance, 'min_area_fraction': min_area_fraction, 'max_aspect': max_aspect}
+	jobs = []
+	for label in index.labels():
+		for stem in sorted(index.stems(label, 'xml') & index.stems(label, 'image')):
+			jobs.append((label, stem, index.path(label, stem, 'xml'), index.path(label, stem, 'image'), options))
+	instrument.count(len(jobs))
+
+	pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+	try:
+		results = pool.map(_scan_sample, jobs, chunksize=chunk_size) if pool else [_scan_sample(job) for job in jobs]
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+
+	counts = dict((issue, 0) for issue in SAMPLE_ERRORS + BOX_ERRORS + BOX_WARNINGS)
+	samples = {}
+	for result in results:
+		for issue in result['issues']:
+			counts[issue] += 1
+		for issues in result['box_issues'].values():
+			for issue in issues:
+				counts[issue] += 1
+		if result['issues'] or result['box_issues']:
+			samples[result['stem']] = result
+
+	duplicates = find_duplicates([result['stem'] for result in results], [result['hash'] for result in results],
+								 max_distance)
+	counts['duplicate'] = sum(len(group) - 1 for group in duplicates)
+
+	report = {
+		'images': len(results),
+		'boxes': sum(result['boxes'] for result in results),
+		'counts': counts,
+		'samples': samples,
+		'duplicates': duplicates,
+	}
+
+	print("\tScanned {0} images, {1} boxes".format(report['images'], report['boxes']))
+	for issue in SAMPLE_ERRORS + BOX_ERRORS + BOX_WARNINGS + ('duplicate',):
+		if counts[issue]:
+			print("\t\t{0}: {1}".format(issue, counts[issue]))
+
+	if report_path:
+		write_report(report, report_path)
+		print("\tQuality report written to " + report_path)
+	return report
+
+
+def write_report(report, report_path):
+	tmp_path = report_path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(report, f, indent=1, sort_keys=True)
+	os.rename(tmp_path, report_path)
+
+
+def load_report(report_path):
+	with open(report_path, 'r') as f:
+		return json.load(f)
+
+
+def exclusions(report, drop_duplicates=True):
+	"""
+	Works out what a report leaves out of the dataset.
+
+	Samples with a SAMPLE_ERRORS issue, or with no box left, are dropped whole, as are the near-duplicates of the first
+	image of each group. Otherwise only the boxes with a BOX_ERRORS issue are dropped.
+
+	Returns
+	-------
+	dict
+		stem -> None to leave the sample out, or the sorted indices of its boxes to drop.
+	"""
+	excluded = {}
+	for stem, result in report['samples'].items():
+		if result['issues']:
+			excluded[stem] = None
+			continue
+		dropped = sorted(int(i) for i, issues in result['box_issues'].items()
+						 if any(issue in BOX_ERRORS for issue in issues))
+		if len(dropped) >= result['boxes']:
+			excluded[stem] = None
+		elif dropped:
+			excluded[stem] = dropped
+
+	if drop_duplicates:
+		for group in report['duplicates']:
+			for stem in group[1:]:
+				excluded[stem] = None
+	return excluded
+
+
+def filterSFrame(sf, excluded, store=None):
+	"""
+	Applies exclusions to an SFrame already converted, keyed by the image file name of its rows.
+
+	The boxes and images are dropped from the columnar AnnotationStore of the SFrame with masks, and the annotations
+	column is rebuilt from it, instead of filtering the annotation lists row by row.
+
+	Parameters
+	----------
+	sf : SFrame
+		The dataset to filter.
+	excluded : dict
+		Stem -> None to drop a sample, or the indices of its boxes to drop, see exclusions.
+	store : AnnotationStore, optional
+		The annotations of sf, row for row, for e.g. the <name>.annotations written next to it by createSFrame. Built
+		from the path and annotations columns if not given.
+
+	Returns
+	-------
+	SFrame
+		The rows that are kept, with the dropped boxes removed from their annotations.
+	"""
+	if store is None:
+		store = AnnotationStore.from_sframe(sf[['path', 'annotations']])
+	if len(store) != len(sf):
+		raise ValueError("The store holds {0} images, the SFrame {1} rows".format(len(store), len(sf)))
+
+	image_mask = np.ones(len(store), dtype=bool)
+	box_mask = np.ones(len(store.label_ids), dtype=bool)
+	for i, path in enumerate(store.paths):
+		stem = os.path.splitext(os.path.basename(path))[0]
+		if stem not in excluded:
+			continue
+		if excluded[stem] is None:
+			image_mask[i] = False
+		else:
+			dropped = np.asarray(excluded[stem], dtype=np.int64)
+			box_mask[store.offsets[i] + dropped[dropped < store.offsets[i + 1] - store.offsets[i]]] = False
+
+	sf = sf[tc.SArray(image_mask.astype(np.int64).tolist(), dtype=int)]
+	if not box_mask.all():
+		sf['annotations'] = store.filter_boxes(box_mask).filter_images(image_mask).to_sarray()
+	return sf
+
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description="Scans annotations for bad boxes and near-duplicate images.")
+	parser.add_argument('annotations', help="Folder of xml files per label.")
+	parser.add_argument('images', help="Folder of images per label.")
+	parser.add_argument('--report', default='quality_report.json', help="Where the json report is written.")
+	parser.add_argument('--workers', type=int, default=4, help="Processes scanning the samples.")
+	parser.add_argument('--tolerance', type=int, default=1, help="Pixels a box may reach past the image border.")
+	parser.add_argument('--max-distance', type=int, default=4, help="Bits between near-duplicate image hashes.")
+	parser.add_argument('--filter', nargs=2, default=None, metavar=('SFRAME', 'OUTPUT'),
+						help="Also writes a copy of SFRAME without the excluded samples and boxes to OUTPUT.")
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+	args = parse_args(argv)
+	report = scanAnnotations(args.annotations, args.images, num_workers=args.workers, tolerance=args.tolerance,
+							 max_distance=args.max_distance, report_path=args.report)
+	if args.filter:
+		source, output = args.filter
+		store_dir = os.path.splitext(os.path.normpath(source))[0] + '.annotations'
+		store = AnnotationStore.load(store_dir) if os.path.isdir(store_dir) else None
+		sf = filterSFrame(TCHandler.load_dataset(source), exclusions(report), store)
+		sf.save(output)
+		print("\t{0} rows written to {1}".format(len(sf), output))
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,182 @@
+import os
+import json
+import numpy as np
+import turicreate as tc
+
+import boxes
+
+
+class AnnotationStore(object):
+	def __init__(self, paths, box_array, offsets, label_ids, label_names):
+		"""
+		Flat, columnar storage of the bounding boxes of a dataset.
+
+		Instead of a list of nested dicts per image, every box of the dataset sits in one (M, 4) array. The boxes of
+		image i are the rows offsets[i]:offsets[i + 1], so selecting an image is a slice (a view, nothing is copied).
+		Labels are stored as integer ids into label_names.
+
+		Parameters
+		----------
+		paths : list of str
+			The image path of each of the N images.
+		box_array : numpy.ndarray
+			(M, 4) float64 boxes in cxcywh layout, see boxes.py.
+		offsets : numpy.ndarray
+			(N + 1,) int64 offsets of the boxes of each image.
+		label_ids : numpy.ndarray
+			(M,) int32 index of the label of each box in label_names.
+		label_names : list of str
+			The label dictionary.
+		"""
+		self.paths = list(paths)
+		self.boxes = box_array
+		self.offsets = offsets
+		self.label_ids = label_ids
+		self.label_names = list(label_names)
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	@staticmethod
+	def from_annotations(paths, annotation_lists):
+		"""
+		Builds a store from Turi Create annotations.
+
+		Parameters
+		----------
+		paths : iterable of str
+			The image path of each image.
+		annotation_lists : iterable of list of dict
+			The annotations of each image.
+
+		Returns
+		-------
+		AnnotationStore
+		"""
+		box_array, offsets, labels = boxes.annotations_to_arrays(annotation_lists)
+		label_names, label_ids = np.unique(np.asarray(labels, dtype=object).astype(str), return_inverse=True)
+		return AnnotationStore(paths, box_array, offsets, label_ids.astype(np.int32), label_names.tolist())
+
+	@staticmethod
+	def from_sframe(sf, annotations='annotations'):
+		"""
+		Builds a store from the path and annotations columns of an SFrame, without touching its images.
+		"""
+		return AnnotationStore.from_annotations(sf['path'], sf[annotations])
+
+	def to_annotations(self):
+		"""
+		Converts the store back into one Turi Create annotation list per image.
+		"""
+		labels = [self.label_names[i] for i in self.label_ids.tolist()]
+		return boxes.arrays_to_annotations(self.boxes, self.offsets, labels)
+
+	def to_sarray(self):
+		"""
+		Converts the store into an SArray of Turi Create annotations, in the order of the images.
+
+		The per-box dicts Turi Create expects for training are only created here.
+		"""
+		return tc.SArray(self.to_annotations(), dtype=list)
+
+	def image_boxes(self, i, layout='cxcywh'):
+		"""
+		Returns the boxes of image i as a view into the store, or as a new xyxy array for layout='xyxy'.
+		"""
+		image_boxes = self.boxes[self.offsets[i]:self.offsets[i + 1]]
+		return boxes.cxcywh_to_xyxy(image_boxes) if layout == 'xyxy' else image_boxes
+
+	def image_labels(self, i):
+		"""
+		Returns the label names of the boxes of image i.
+		"""
+		return [self.label_names[j] for j in self.label_ids[self.offsets[i]:self.offsets[i + 1]].tolist()]
+
+	def image_index(self):
+		"""
+		Returns the (M,) index of the image each box belongs to.
+		"""
+		return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+	def stats(self):
+		"""
+		Summarizes the boxes of the dataset.
+
+		Returns
+		-------
+		dict
+			Number of images and boxes, box count per label, and the mean boxes per image and box area.
+		"""
+		counts = np.bincount(self.label_ids, minlength=len(self.label_names))
+		box_areas = self.boxes[:, 2] * self.boxes[:, 3]
+		return {
+			'images': len(self),
+			'boxes': len(self.boxes),
+			'boxes_per_label': dict(zip(self.label_names, counts.tolist())),
+			'mean_boxes_per_image': float(np.diff(self.offsets).mean()) if len(self) else 0.0,
+			'empty_images': int(np.sum(np.diff(self.offsets) == 0)),
+			'mean_box_area': float(box_areas.mean()) if len(box_areas) else 0.0,
+		}
+
+	def filter_boxes(self, mask):
+		"""
+		Keeps the boxes flagged in the (M,) boolean mask, for e.g. boxes.valid_mask(store.boxes_xyxy()).
+
+		Images keep their position, even when all of their boxes are dropped.
+
+		Returns
+		-------
+		AnnotationStore
+		"""
+		mask = np.asarray(mask, dtype=bool)
+		kept_per_image = np.bincount(self.image_index()[mask], minlength=len(self))
+		offsets = np.concatenate([[0], np.cumsum(kept_per_image)]).astype(np.int64)
+		return AnnotationStore(self.paths, self.boxes[mask], offsets, self.label_ids[mask], self.label_names)
+
+	def filter_images(self, mask):
+		"""
+		Keeps the images flagged in the (N,) boolean mask along with their boxes.
+
+		Returns
+		-------
+		AnnotationStore
+		"""
+		mask = np.asarray(mask, dtype=bool)
+		box_mask = np.repeat(mask, np.diff(self.offsets))
+		counts = np.diff(self.offsets)[mask]
+		offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+		paths = [path for path, keep in zip(self.paths, mask.tolist()) if keep]
+		return AnnotationStore(paths, self.boxes[box_mask], offsets, self.label_ids[box_mask], self.label_names)
+
+	def boxes_xyxy(self):
+		"""
+		Returns every box of the dataset in xyxy layout.
+		"""
+		return boxes.cxcywh_to_xyxy(self.boxes)
+
+	def save(self, store_dir):
+		"""
+		Writes the store as a directory of .npy arrays plus a json file with the paths and label dictionary.
+		"""
+		if not os.path.isdir(store_dir):
+			os.makedirs(store_dir)
+		np.save(os.path.join(store_dir, 'boxes.npy'), self.boxes)
+		np.save(os.path.join(store_dir, 'offsets.npy'), self.offsets)
+		np.save(os.path.join(store_dir, 'label_ids.npy'), self.label_ids)
+		with open(os.path.join(store_dir, 'index.json'), 'w') as f:
+			json.dump({'paths': self.paths, 'label_names': self.label_names}, f)
+
+	@staticmethod
+	def load(store_dir, mmap_mode='r'):
+		"""
+		Reads a store written by save. The arrays are memory-mapped by default, so nothing is copied until used.
+		"""
+		with open(os.path.join(store_dir, 'index.json'), 'r') as f:
+			index = json.load(f)
+		return AnnotationStore(
+			index['paths'],
+			np.load(os.path.join(store_dir, 'boxes.npy'), mmap_mode=mmap_mode),
+			np.load(os.path.join(store_dir, 'offsets.npy'), mmap_mode=mmap_mode),
+			np.load(os.path.join(store_dir, 'label_ids.npy'), mmap_mode=mmap_mode),
+			index['label_names']
+		)
@@ -0,0 +1,289 @@
+"""
+Benchmarks the stages of the pipeline on synthetic ImageNet style data.
+
+A dataset of labels x images x boxes per image is generated once, with a few orphan annotations and images so the
+cleaning has work to do. Every stage is then run on a fresh copy of it in serial mode (one worker) and in parallel mode,
+and the timings recorded by instrument.py are saved as json for regression comparison:
+
+	python benchmark.py --labels 4 --images 500 --boxes 3 --workers 4
+	python benchmark.py --labels 4 --images 500 --boxes 3 --workers 4 --compare benchmarks/<previous>.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import cv2
+
+import instrument
+from validateData import cleanData
+from xmlToSFrame import createSFrame, TCHandler
+from dataaug import DataAugHandler
+
+XML_TEMPLATE = """<annotation>
+	<folder>{synset}</folder>
+	<filename>{stem}</filename>
+	<source>
+		<database>ImageNet database</database>
+	</source>
+	<size>
+		<width>{width}</width>
+		<height>{height}</height>
+		<depth>3</depth>
+	</size>
+	<segmented>0</segmented>
+{objects}</annotation>
+"""
+
+OBJECT_TEMPLATE = """	<object>
+		<name>{synset}</name>
+		<pose>Unspecified</pose>
+		<truncated>0</truncated>
+		<difficult>0</difficult>
+		<bndbox>
+			<xmin>{0}</xmin>
+			<ymin>{1}</ymin>
+			<xmax>{2}</xmax>
+			<ymax>{3}</ymax>
+		</bndbox>
+	</object>
+"""
+
+
+def make_dataset(root_dir, labels=2, images=100, boxes_per_image=2, width=500, height=375, orphans=0.05, seed=0):
+	"""
+	Writes a synthetic dataset laid out like an ImageNet download.
+
+	Parameters
+	----------
+	root_dir : str
+		The directory to write the 'annotations' and 'images' folders in, one sub-folder per label.
+	labels : int, optional
+		Number of labels.
+	images : int, optional
+		Number of annotated images per label.
+	boxes_per_image : int, optional
+		Number of bounding boxes in each annotation.
+	width : int, optional
+		Width of the images.
+	height : int, optional
+		Height of the images.
+	orphans : float, optional
+		Fraction of extra annotations without image and images without annotation, per label.
+	seed : int, optional
+		Seed of the generated images and boxes.
+
+	Returns
+	-------
+	tuple
+		The annotations and images directories.
+	"""
+	rng = np.random.RandomState(seed)
+	annotatations_dir = os.path.join(root_dir, 'annotations')
+	image_dir = os.path.join(root_dir, 'images')
+	num_orphans = int(images * orphans)
+
+	for l in range(labels):
+		synset = 'n{0:08d}'.format(l)
+		label = 'label{0}'.format(l)
+		os.makedirs(os.path.join(annotatations_dir, label))
+		os.makedirs(os.path.join(image_dir, label))
+
+		for i in range(images + 2 * num_orphans):
+			stem = '{0}_{1}'.format(synset, i)
+			# The first orphans only get an annotation, the next ones only an image
+			if i < images + num_orphans:
+				x_min = rng.randint(0, width // 2, boxes_per_image)
+				y_min = rng.randint(0, height // 2, boxes_per_image)
+				x_max = x_min + rng.randint(16, width // 2, boxes_per_image)
+				y_max = y_min + rng.randint(16, height // 2, boxes_per_image)
+				objects = ''.join(OBJECT_TEMPLATE.format(*box, synset=synset)
+								  for box in zip(x_min, y_min, x_max, y_max))
+				with open(os.path.join(annotatations_dir, label, stem + '.xml'), 'w') as f:
+					f.write(XML_TEMPLATE.format(synset=synset, stem=stem, width=width, height=height, objects=objects))
+			if i < images or i >= images + num_orphans:
+				# Coarse blocks of noise compress like a photo rather than like a flat image
+				blocks = rng.randint(0, 256, (height // 8 + 1, width // 8 + 1, 3)).astype(np.uint8)
+				image = cv2.resize(blocks, (width, height), interpolation=cv2.INTER_LINEAR)
+				cv2.imwrite(os.path.join(image_dir, label, stem + '.JPEG'), image)
+
+	return annotatations_dir, image_dir
+
+
+def run_mode(dataset_dir, work_dir, num_workers, copy_strategy='copy'):
+	"""
+	Runs every stage once on a fresh copy of the dataset and returns the instrument records.
+
+	Parameters
+	----------
+	dataset_dir : str
+		The directory written by make_dataset. It is left untouched, cleaning works on a copy.
+	work_dir : str
+		The directory the copy and every stage output are written in. Emptied first.
+	num_workers : int
+		Number of processes parsing and augmenting, 1 for the serial mode.
+	copy_strategy : str, optional
+		How cleaned images are placed, see validateData.recursive_copy.
+
+	Returns
+	-------
+	list of dict
+		The records of instrument.Recorder, one per stage and nested stage.
+	"""
+	if os.path.isdir(work_dir):
+		shutil.rmtree(work_dir)
+	shutil.copytree(dataset_dir, os.path.join(work_dir, 'data'))
+	annotatations_dir = os.path.join(work_dir, 'data', 'annotations')
+	image_dir = os.path.join(work_dir, 'data', 'images')
+	allImages_dir = os.path.join(work_dir, 'allImages')
+	sframe_dir = os.path.join(work_dir, 'sframe')
+	augImages_dir = os.path.join(work_dir, 'allAugmentedImages')
+	for stage_dir in (allImages_dir, sframe_dir, augImages_dir):
+		os.makedirs(stage_dir)
+
+	instrument.recorder.reset()
+	cleanData(annotatations_dir, image_dir, allImages_dir, strategy=copy_strategy, num_threads=max(num_workers, 1))
+	createSFrame(annotatations_dir, allImages_dir, sframe_dir, num_workers=num_workers)
+
+	handler = DataAugHandler(sframe_dir)
+	with instrument.stage('getAugmentationsSFrame', unit='images') as stage:
+		augmented_sf = handler.getAugmentationsSFrame(augImages_dir, num_workers=num_workers)
+		stage.add(len(augmented_sf))
+	TCHandler.write(augmented_sf, sframe_dir, 'augmented')
+	return list(instrument.recorder.records)
+
+
+def summarize(records):
+	"""
+	Sums the seconds and items of the records per stage, for stages that ran more than once.
+	"""
+	stages = {}
+	for record in records:
+		stage = stages.setdefault(record['stage'], {'seconds': 0.0, 'items': 0, 'unit': record['unit']})
+		stage['seconds'] += record['seconds']
+		stage['items'] += record['items']
+	for stage in stages.values():
+		stage['items_per_s'] = stage['items'] / stage['seconds'] if stage['seconds'] else 0.0
+	return stages
+
+
+def compare(results, baseline, tolerance=0.1):
+	"""
+	Prints the time of every stage against a previous result and returns the stages that got slower.
+
+	Parameters
+	----------
+	results : dict
+		The result of this run, as written by main.
+	baseline : dict
+		A previous result.
+	tolerance : float, optional
+		Relative slowdown tolerated before a stage counts as a regression.
+
+	Returns
+	-------
+	list of str
+		'<mode>/<stage>' of every regression.
+	"""
+	if results['params'] != baseline['params']:
+		print("Warning: the baseline was run with other parameters: {0}".format(baseline['params']))
+
+	regressions = []
+	for mode in sorted(results['modes']):
+		for stage, summary in sorted(results['modes'][mode]['stages'].items()):
+			previous = baseline['modes'].get(mode, {}).get('stages', {}).get(stage)
+			if not previous or not previous['seconds']:
+				continue
+			ratio = summary['seconds'] / previous['seconds']
+			flag = ''
+			if ratio > 1 + tolerance:
+				flag = '  REGRESSION'
+				regressions.append('{0}/{1}'.format(mode, stage))
+			print("\t{0:>8} {1:<24} {2:8.2f}s vs {3:8.2f}s  x{4:.2f}{5}".format(
+				mode, stage, summary['seconds'], previous['seconds'], ratio, flag))
+	return regressions
+
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmarks the pipeline stages on a synthetic dataset.")
+	parser.add_argument('--labels', type=int, default=2, help="Number of labels.")
+	parser.add_argument('--images', type=int, default=100, help="Number of annotated images per label.")
+	parser.add_argument('--boxes', type=int, default=2, help="Number of bounding boxes per image.")
+	parser.add_argument('--width', type=int, default=500, help="Width of the images.")
+	parser.add_argument('--height', type=int, default=375, help="Height of the images.")
+	parser.add_argument('--workers', type=int, default=4, help="Number of processes in parallel mode.")
+	parser.add_argument('--modes', nargs='+', default=['serial', 'parallel'], choices=['serial', 'parallel'])
+	parser.add_argument('--copy-strategy', default='copy', help="How cleaned images are placed.")
+	parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic dataset.")
+	parser.add_argument('--work-dir', default=None, help="Where the dataset and outputs go, a temporary folder if unset.")
+	parser.add_argument('--output-dir', default='benchmarks', help="Where the results are saved.")
+	parser.add_argument('--compare', default=None, help="A previous result to compare with.")
+	parser.add_argument('--tolerance', type=float, default=0.1, help="Relative slowdown counted as a regression.")
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+	args = parse_args(argv)
+	work_dir = args.work_dir or tempfile.mkdtemp(prefix='tc_benchmark_')
+	dataset_dir = os.path.join(work_dir, 'dataset')
+	params = {
+		'labels': args.labels,
+		'images': args.images,
+		'boxes': args.boxes,
+		'width': args.width,
+		'height': args.height,
+		'workers': args.workers,
+		'copy_strategy': args.copy_strategy,
+		'seed': args.seed,
+	}
+
+	try:
+		print("\nGENERATING DATASET...\n")
+		if os.path.isdir(dataset_dir):
+			shutil.rmtree(dataset_dir)
+		start = time.time()
+		make_dataset(dataset_dir, args.labels, args.images, args.boxes, args.width, args.height, seed=args.seed)
+		print("\t{0} labels x {1} images in {2:.2f}s".format(args.labels, args.images, time.time() - start))
+
+		modes = {}
+		for mode in args.modes:
+			num_workers = 1 if mode == 'serial' else args.workers
+			print("\nRUNNING {0} ({1} workers)...\n".format(mode.upper(), num_workers))
+			records = run_mode(dataset_dir, os.path.join(work_dir, mode), num_workers, args.copy_strategy)
+			instrument.recorder.summary()
+			modes[mode] = {'num_workers': num_workers, 'records': records, 'stages': summarize(records)}
+	finally:
+		if not args.work_dir:
+			shutil.rmtree(work_dir)
+
+	results = {
+		'params': params,
+		'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+		'platform': platform.platform(),
+		'python': platform.python_version(),
+		'cpus': os.cpu_count() if hasattr(os, 'cpu_count') else None,
+		'modes': modes,
+	}
+	if not os.path.isdir(args.output_dir):
+		os.makedirs(args.output_dir)
+	results_path = os.path.join(args.output_dir, time.strftime('benchmark_%Y%m%d_%H%M%S.json'))
+	with open(results_path, 'w') as f:
+		json.dump(results, f, indent=2)
+	print("\nResults saved to {0}".format(results_path))
+
+	if args.compare:
+		print("\nCOMPARING WITH {0}\n".format(args.compare))
+		with open(args.compare, 'r') as f:
+			regressions = compare(results, json.load(f), args.tolerance)
+		if regressions:
+			print("\n{0} regressions: {1}".format(len(regressions), ", ".join(regressions)))
+			return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
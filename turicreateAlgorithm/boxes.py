@@ -0,0 +1,251 @@
+"""
+Vectorized bounding box helpers working on (N, 4) arrays.
+
+Two layouts are used: 'xyxy' is (x_min, y_min, x_max, y_max) as found in the ImageNet xml files and imgaug, 'cxcywh'
+is (center x, center y, width, height) as expected by Turi Create.
+
+Float policy: every coordinate is converted to float64 before any arithmetic, so centers are never truncated (integer
+division floors them on Python 2). Annotations handed to Turi Create hold plain Python floats.
+"""
+import numpy as np
+
+DTYPE = np.float64
+
+
+def as_boxes(boxes):
+	"""
+	Returns the boxes as a float64 (N, 4) array, also for an empty list.
+	"""
+	return np.asarray(boxes, dtype=DTYPE).reshape(-1, 4)
+
+
+def xyxy_to_cxcywh(boxes):
+	"""
+	Converts (x_min, y_min, x_max, y_max) boxes to (center x, center y, width, height).
+
+	Parameters
+	----------
+	boxes : array_like
+		Boxes of shape (N, 4) in xyxy layout.
+
+	Returns
+	-------
+	numpy.ndarray
+		Boxes of shape (N, 4) in cxcywh layout.
+	"""
+	boxes = as_boxes(boxes)
+	out = np.empty_like(boxes)
+	out[:, 2] = boxes[:, 2] - boxes[:, 0]
+	out[:, 3] = boxes[:, 3] - boxes[:, 1]
+	out[:, 0] = boxes[:, 0] + out[:, 2] / 2
+	out[:, 1] = boxes[:, 1] + out[:, 3] / 2
+	return out
+
+
+def cxcywh_to_xyxy(boxes):
+	"""
+	Converts (center x, center y, width, height) boxes to (x_min, y_min, x_max, y_max).
+
+	Parameters
+	----------
+	boxes : array_like
+		Boxes of shape (N, 4) in cxcywh layout.
+
+	Returns
+	-------
+	numpy.ndarray
+		Boxes of shape (N, 4) in xyxy layout.
+	"""
+	boxes = as_boxes(boxes)
+	out = np.empty_like(boxes)
+	out[:, 0] = boxes[:, 0] - boxes[:, 2] / 2
+	out[:, 1] = boxes[:, 1] - boxes[:, 3] / 2
+	out[:, 2] = boxes[:, 0] + boxes[:, 2] / 2
+	out[:, 3] = boxes[:, 1] + boxes[:, 3] / 2
+	return out
+
+
+def clip(boxes, width, height):
+	"""
+	Clips xyxy boxes to the image area.
+
+	Parameters
+	----------
+	boxes : array_like
+		Boxes of shape (N, 4) in xyxy layout.
+	width : int
+		Width of the image.
+	height : int
+		Height of the image.
+
+	Returns
+	-------
+	numpy.ndarray
+		The clipped boxes.
+	"""
+	boxes = as_boxes(boxes).copy()
+	boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+	boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+	return boxes
+
+
+def scale(boxes, sx, sy):
+	"""
+	Scales boxes of either layout, for e.g. to match an image decoded at a lower resolution.
+
+	Parameters
+	----------
+	boxes : array_like
+		Boxes of shape (N, 4) in xyxy or cxcywh layout.
+	sx : float
+		Horizontal scale.
+	sy : float
+		Vertical scale.
+
+	Returns
+	-------
+	numpy.ndarray
+		The scaled boxes.
+	"""
+	return as_boxes(boxes) * np.array([sx, sy, sx, sy], dtype=DTYPE)
+
+
+def scale_annotations(annotations, sx, sy):
+	"""
+	Scales Turi Create annotations, see scale.
+	"""
+	if sx == 1.0 and sy == 1.0:
+		return annotations
+	cxcywh, labels = from_annotations(annotations)
+	return to_annotations(scale(cxcywh, sx, sy), labels)
+
+
+def areas(boxes):
+	"""
+	Returns the area of each xyxy box, zero for inverted boxes.
+	"""
+	boxes = as_boxes(boxes)
+	return np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+
+
+def iou(boxes_a, boxes_b):
+	"""
+	Computes the intersection over union of every pair of xyxy boxes.
+
+	Parameters
+	----------
+	boxes_a : array_like
+		Boxes of shape (N, 4) in xyxy layout.
+	boxes_b : array_like
+		Boxes of shape (M, 4) in xyxy layout.
+
+	Returns
+	-------
+	numpy.ndarray
+		(N, M) matrix of IoU values, 0 for pairs that don't overlap.
+	"""
+	boxes_a = as_boxes(boxes_a)
+	boxes_b = as_boxes(boxes_b)
+	top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+	bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+	intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+	union = areas(boxes_a)[:, None] + areas(boxes_b)[None, :] - intersection
+	return np.where(union > 0, intersection / np.where(union > 0, union, 1), 0.0)
+
+
+def valid_mask(boxes, min_size=0):
+	"""
+	Flags the xyxy boxes whose width and height are both larger than min_size.
+
+	Parameters
+	----------
+	boxes : array_like
+		Boxes of shape (N, 4) in xyxy layout.
+	min_size : float, optional
+		Smallest side length kept.
+
+	Returns
+	-------
+	numpy.ndarray
+		Boolean mask of shape (N,).
+	"""
+	boxes = as_boxes(boxes)
+	return ((boxes[:, 2] - boxes[:, 0]) > min_size) & ((boxes[:, 3] - boxes[:, 1]) > min_size)
+
+
+def to_annotations(boxes, labels):
+	"""
+	Converts cxcywh boxes into Turi Create annotations.
+
+	Parameters
+	----------
+	boxes : array_like
+		Boxes of shape (N, 4) in cxcywh layout.
+	labels : str or list of str
+		One label for all the boxes, or one per box.
+
+	Returns
+	-------
+	list of dict
+		[{'coordinates': {'x', 'y', 'width', 'height'}, 'label'}] with float coordinates.
+	"""
+	boxes = as_boxes(boxes).tolist()
+	if not isinstance(labels, (list, tuple)):
+		labels = [labels] * len(boxes)
+
+	return [
+		{
+			'coordinates': {'x': x, 'y': y, 'width': width, 'height': height},
+			'label': label
+		}
+		for (x, y, width, height), label in zip(boxes, labels)
+	]
+
+
+def from_annotations(annotations):
+	"""
+	Converts Turi Create annotations into cxcywh boxes.
+
+	Returns
+	-------
+	tuple
+		The (N, 4) cxcywh boxes and the list of their labels.
+	"""
+	boxes = as_boxes([(a['coordinates']['x'], a['coordinates']['y'], a['coordinates']['width'],
+					   a['coordinates']['height']) for a in annotations])
+	return boxes, [a['label'] for a in annotations]
+
+
+def annotations_to_arrays(annotation_lists):
+	"""
+	Converts the annotations of a whole dataset into a single array.
+
+	Parameters
+	----------
+	annotation_lists : iterable of list of dict
+		The annotations of each image, for e.g. an SFrame 'annotations' column.
+
+	Returns
+	-------
+	tuple
+		(boxes, offsets, labels): the (M, 4) cxcywh boxes of every image back to back, the (N + 1,) offsets such that
+		the boxes of image i are boxes[offsets[i]:offsets[i + 1]], and the M labels.
+	"""
+	flat = []
+	labels = []
+	offsets = [0]
+	for annotations in annotation_lists:
+		for a in annotations or []:
+			c = a['coordinates']
+			flat.append((c['x'], c['y'], c['width'], c['height']))
+			labels.append(a['label'])
+		offsets.append(len(flat))
+	return as_boxes(flat), np.asarray(offsets, dtype=np.int64), labels
+
+
+def arrays_to_annotations(boxes, offsets, labels):
+	"""
+	Converts the output of annotations_to_arrays back into one annotation list per image.
+	"""
+	annotations = to_annotations(boxes, list(labels))
+	return [annotations[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import hashlib
+
+
+class CheckpointHandler(object):
+	def __init__(self, checkpoint_dir, stage):
+		"""
+		Records the progress of a pipeline stage so an interrupted run can pick up where it stopped.
+
+		The stage state lives in <checkpoint_dir>/<stage>/state.json, and the results of every completed shard in a
+		shard_<id>.json file next to it.
+
+		Parameters
+		----------
+		checkpoint_dir : str
+			The directory holding the checkpoints of every stage.
+		stage : str
+			The name of the stage, for e.g. 'augment'.
+		"""
+		self.stage = stage
+		self.stage_dir = os.path.join(checkpoint_dir, stage)
+		self.state_path = os.path.join(self.stage_dir, 'state.json')
+
+	def state(self):
+		"""
+		Returns the recorded state of the stage, or None if it never started.
+		"""
+		if not os.path.isfile(self.state_path):
+			return None
+		with open(self.state_path, 'r') as f:
+			return json.load(f)
+
+	def is_running(self):
+		"""
+		Returns true if the stage started and didn't finish.
+		"""
+		state = self.state()
+		return state is not None and state['status'] == 'running'
+
+	def start(self, params):
+		"""
+		Starts the stage, or resumes it if it was interrupted with the same parameters.
+
+		Parameters
+		----------
+		params : dict
+			Everything the shard layout depends on, for e.g. the number of rows and the shard size. Shards recorded
+			with other parameters are thrown away.
+
+		Returns
+		-------
+		set of int
+			The ids of the shards already completed.
+		"""
+		state = self.state()
+		if state is not None and state['status'] == 'running' and state['params'] == params:
+			return self.completed_shards()
+
+		self.clear()
+		os.makedirs(self.stage_dir)
+		self.write_state({'status': 'running', 'params': params})
+		return set()
+
+	def finish(self):
+		"""
+		Marks the stage as done and drops the shard results, which are now part of the stage output.
+		"""
+		self.clear()
+		os.makedirs(self.stage_dir)
+		self.write_state({'status': 'done'})
+
+	def progress(self):
+		"""
+		Returns the progress recorded by save_progress, or None.
+		"""
+		state = self.state()
+		return state.get('progress') if state is not None else None
+
+	def save_progress(self, progress):
+		"""
+		Records the progress of a running stage in its state, for stages that stream their output instead of
+		keeping per-shard results.
+		"""
+		state = self.state()
+		state['progress'] = progress
+		self.write_state(state)
+
+	def clear(self):
+		if os.path.isdir(self.stage_dir):
+			shutil.rmtree(self.stage_dir)
+
+	def completed_shards(self):
+		shards = set()
+		for file in os.listdir(self.stage_dir):
+			if file.startswith('shard_') and file.endswith('.json'):
+				shards.add(int(file[len('shard_'):-len('.json')]))
+		return shards
+
+	def save_shard(self, shard_id, results):
+		"""
+		Records the results of a completed shard. The file is renamed into place, so a crash never leaves half of one.
+		"""
+		self.write_json(self.shard_path(shard_id), results)
+
+	def load_shard(self, shard_id):
+		with open(self.shard_path(shard_id), 'r') as f:
+			return json.load(f)
+
+	def shard_path(self, shard_id):
+		return os.path.join(self.stage_dir, 'shard_{0:06d}.json'.format(shard_id))
+
+	def write_state(self, state):
+		self.write_json(self.state_path, state)
+
+	@staticmethod
+	def write_json(path, data):
+		tmp_path = path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(data, f)
+		os.rename(tmp_path, path)
+
+	@staticmethod
+	def digest(values):
+		"""
+		Hashes a collection of strings, to record a large parameter such as a set of stems compactly.
+		"""
+		sha1 = hashlib.sha1()
+		for value in sorted(values):
+			sha1.update(value.encode('utf-8'))
+			sha1.update(b'\0')
+		return sha1.hexdigest()
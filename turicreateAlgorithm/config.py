@@ -5,7 +5,69 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 playground_dir = os.path.join(dir_path, "Playground")
 annotatations_dir = os.path.join(dir_path, "annotations")
 image_dir = os.path.join(dir_path, "images")
-training_sFrame = os.path.join(dir_path, "Playground/sframe/final.sframe")
+training_sFrame = os.path.join(dir_path, "Playground/sframe/final.shards")
 train_test_split = 0.8
+# seed of the train/test split, stratified by label and grouped by source image
+split_seed = 0
 max_iterations = 10000
 model_name = "heavy_aug"
+
+# hyperparameter sweep, see sweep.py. 'dataset' may list other datasets to compare, for e.g. original.shards
+sweep_grid = {
+	'max_iterations': [max_iterations],
+	'batch_size': [16, 32],
+}
+sweep_workers = 2
+# threads per trial, None splits the CPUs evenly between the workers
+sweep_threads = None
+# successive halving rungs. Each rung retrains its trials from scratch with eta times more iterations, 1 disables it
+sweep_rungs = 3
+sweep_eta = 2
+
+# data cleaning, copy_strategy is one of 'copy', 'hardlink', 'reflink', 'symlink', 'manifest'. The others than 'copy'
+# avoid duplicating the images but share them with the source folders, so they are opt-in
+copy_strategy = 'copy'
+copy_threads = 8
+# orphan files are moved here instead of being deleted when set
+quarantine_dir = None
+# only plan the cleanup and write its report to playground/cleanup_report.json, without touching any file
+cleanup_dry_run = False
+
+# annotation quality scan, written to playground/quality_report.json. With quality_filter, the flagged samples and boxes
+# (and the near-duplicates of each image if quality_drop_duplicates) are left out of the SFrame
+quality_filter = False
+quality_drop_duplicates = True
+# pixels a box may reach past the image border, and bits between the hashes of near-duplicate images
+quality_tolerance = 1
+quality_max_distance = 4
+
+# xml parsing
+num_workers = 4
+chunk_size = 64
+streaming = False
+batch_size = 10000
+
+# images stored in the SFrame are resized to this (width, height) when set, letterboxed to keep their aspect ratio
+resize_to = None
+letterbox = True
+
+# augmentation
+aug_workers = 4
+aug_shard_size = 64
+aug_seed = 1
+# images per call to the sequence, None augments one image at a time
+aug_batch_size = None
+# augmentations per image, generated in memory and cached in allAugmentedImages if aug_in_memory is set
+aug_per_image = 1
+aug_in_memory = False
+
+# decoded image cache, shared by the stages of a run, and on disk by later runs when decode_cache_dir is set, up to
+# decode_cache_disk_bytes. decode_max_side decodes (and rescales the boxes of) every image at most that large, None
+# keeps full resolution
+decode_cache_bytes = 256 << 20
+decode_cache_dir = None
+decode_cache_disk_bytes = 8 << 30
+decode_max_side = None
+# decode every original image once into a memory-mapped store, sframe/original.images, that the augmentation reads
+# instead of the JPEGs. The SFrames keep the encoded JPEGs
+image_store = False
@@ -1,12 +1,22 @@
 import imgaug as ia
 from imgaug import augmenters as iaa
-from imgaug.augmentables.bbs import BoundingBox, BoundingBoxesOnImage
+from imgaug.augmentables.bbs import BoundingBoxesOnImage
+from imgaug.augmentables.batches import UnnormalizedBatch
 import numpy as np
 import cv2
 import os
+import zlib
+import shutil
+import json
+import multiprocessing
 from xmlToSFrame import ImageHandler, TCHandler
 import turicreate as tc
 from utils import Utils
+from checkpoint import CheckpointHandler
+from fileIndex import FileIndex
+import boxes
+import instrument
+import imageCache
 
 
 class DataAugHandler(object):
@@ -43,100 +53,420 @@ class DataAugHandler(object):
 		)
 	], random_order=True)  # apply augmenters in random order
 
+	# Images are bucketed by size over a window of this many batches before being grouped
+	BUCKET_WINDOW = 8
+	# Height and width are rounded down to a multiple of this to pick the bucket
+	BUCKET_STEP = 64
+
 	def __init__(self, sframe_dir):
 		self.sframe_dir = sframe_dir
 		self.dataSframe = self.getSFrame()
 
 	def getSFrame(self):
+		original_path = TCHandler.dataset_path(self.sframe_dir, 'original')
+		if os.path.isdir(original_path):
+			self.originalSF = TCHandler.load_dataset(original_path)
+			return self.originalSF
+
 		for file in os.listdir(self.sframe_dir):
 			if file.endswith('.sframe'):
 				data = tc.SFrame(os.path.join(self.sframe_dir, file))
 				self.originalSF = data
 		return data
 
-	def createAugmentedandFinalSFrameFile(self, augImages_dir):
-		augmented_sf = self.getAugmentationsSFrame(augImages_dir)
-		# print(sf)
-		# TCHandler.write(sf, self.sframe_dir, 'igAug')
-		self.originalSF.append(augmented_sf)
-		TCHandler.write(augmented_sf, self.sframe_dir, 'augmented')
-		TCHandler.write(self.originalSF, self.sframe_dir, 'final')
+	def createAugmentedandFinalSFrameFile(self, augImages_dir, stems=None, num_workers=1, shard_size=64, seed=1,
+										  batch_size=None, checkpoint=None, identity=None):
+		"""
+		Augments the original SFrame and writes the augmented and final datasets.
+
+		The augmented dataset is sharded, an update only writes the new rows as a new shard and rewrites the shards
+		holding stale rows. The final dataset only indexes the original SFrame and the augmented shards, see
+		writeFinal.
+
+		Parameters
+		----------
+		augImages_dir : str
+			The directory to write the augmented images in.
+		stems : set of str, optional
+			If given, only the samples with these file names (without extension) are augmented again and merged into
+			the existing augmented SFrame. Augmentations of stems that no longer exist are removed.
+		num_workers : int, optional
+			Number of augmentation processes, see getAugmentationsSFrame.
+		shard_size : int, optional
+			Number of rows handed to a worker at a time.
+		seed : int, optional
+			Base seed of the augmentations.
+		batch_size : int, optional
+			If given, augments batches of this many images per call, see getAugmentationsSFrame.
+		checkpoint : CheckpointHandler, optional
+			Records completed shards so an interrupted augmentation resumes, see getAugmentationsSFrame.
+		identity : str, optional
+			Identifies the original SFrame, see getAugmentationsSFrame.
+		"""
+		if stems is not None:
+			# Changed samples are simply overwritten, only the augmentations of removed samples have to go
+			present = set(os.path.splitext(os.path.basename(path))[0] for path in self.dataSframe['path'])
+			# Augmentations keep the extension of their source, whatever its case, so they are looked up in an index
+			index = FileIndex()
+			if os.path.isdir(augImages_dir):
+				index.add_label('augmented', augImages_dir, 'image')
+			for stem in set(stems).difference(present):
+				aug_path = index.path('augmented', stem, 'image')
+				if aug_path:
+					os.remove(aug_path)
+
+		augmented_sf = self.getAugmentationsSFrame(augImages_dir, stems, num_workers, shard_size, seed, batch_size,
+												   checkpoint, identity)
+		TCHandler.update_shards(augmented_sf, self.sframe_dir, 'augmented', stems)
+		self.writeFinal()
+		if checkpoint is not None:
+			checkpoint.finish()
 
-	def getAugmentationsSFrame(self, augImages_dir):
+	def getAugmentationsSFrame(self, augImages_dir, stems=None, num_workers=1, shard_size=64, seed=1, batch_size=None,
+							   checkpoint=None, identity=None):
+		"""
+		Augments every image of the SFrame once and builds the SFrame of augmented images.
+
+		Parameters
+		----------
+		augImages_dir : str
+			The directory to write the augmented images in.
+		stems : set of str, optional
+			If given, only the samples with these file names (without extension) are augmented.
+		num_workers : int, optional
+			Number of processes augmenting shards of rows. A value of 1 augments everything in the current process.
+		shard_size : int, optional
+			Number of rows handed to a worker at a time.
+		seed : int, optional
+			Base seed. Each image is augmented with a seed derived from it and the image name, so the output is the
+			same whatever the number of workers.
+		batch_size : int, optional
+			If given, the images of each shard are grouped by size into batches of this many and each batch goes
+			through the sequence in a single call, see augmentShardBatches. Batches are seeded as a whole, so the
+			output depends on the shard and batch sizes, but not on the number of workers.
+		checkpoint : CheckpointHandler, optional
+			If given, the results of each shard are recorded as it completes and shards completed by an interrupted
+			run with the same parameters are skipped.
+		identity : str, optional
+			Identifies the original SFrame the rows come from. Recorded with the checkpoint, so shards completed before
+			the SFrame was converted again are not reused.
+
+		Returns
+		-------
+		SFrame
+			The augmented data. Includes three columns: path, annotations, image.
+		"""
 		data = {
 			'annotations': [],
 			'path': []
 		}
 
+		rows = self.dataSframe
+		if stems is not None:
+			rows = rows[rows['path'].apply(lambda path: os.path.splitext(os.path.basename(path))[0] in stems)]
+		# Workers only need the path and the boxes, not the decoded images
+		rows = rows[['path', 'annotations']]
+
+		# shard id -> [(path, annotations)], shards completed by an interrupted run are read back first
+		shard_results = {}
+		if checkpoint is not None:
+			params = {
+				'rows': len(rows),
+				'shard_size': shard_size,
+				'seed': seed,
+				'batch_size': batch_size,
+				'stems': None if stems is None else CheckpointHandler.digest(stems),
+				'identity': identity,
+			}
+			for shard_id in checkpoint.start(params):
+				shard_results[shard_id] = checkpoint.load_shard(shard_id)
+			if shard_results:
+				print("Resuming augmentation, {0} shards already done".format(len(shard_results)))
+
 		prefix = '{0}/{1} images augmented:'
-		Utils.showProgress(0, len(self.dataSframe), prefix=prefix.format(0, len(self.dataSframe)), length=50)
-		count = 0
+		count = sum(len(shard_result) for shard_result in shard_results.values())
+		Utils.showProgress(count, len(rows), prefix=prefix.format(count, len(rows)), length=50)
 
-		for row in self.dataSframe:
-			img = cv2.imread(row["path"])
-			bbs = self.getBoundingBoxesOnImage(row["annotations"], img)
-			image_points_aug, bbs_aug = self.seq(image=img, bounding_boxes=bbs)
-			cv2.imwrite(os.path.join(augImages_dir, '{0}.JPEG'.format(count)), image_points_aug)
+		pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+		shards = (shard for shard in DataAugHandler.iterShards(rows, augImages_dir, shard_size, seed, batch_size)
+				  if shard[0] not in shard_results)
 
-			data['path'].append(os.path.join(augImages_dir, '{0}.JPEG'.format(count)))
-			count += 1
-			Utils.showProgress(count, len(self.dataSframe), prefix=prefix.format(count, len(self.dataSframe)),
-							   length=50)
-
-			if len(bbs_aug.remove_out_of_image().clip_out_of_image().to_xyxy_array()) != 0:
-				bounding = {
-					'label': row["annotations"][0]['label'],
-					'xMin': [],
-					'xMax': [],
-					'yMin': [],
-					'yMax': [],
-				}
-
-				for bb in bbs_aug.remove_out_of_image().clip_out_of_image().to_xyxy_array():
-					# bb is (x1, y1, x2, y2)
-					# bounding['label'] = bb.label
-					bounding['xMin'].append(bb[0])
-					bounding['xMax'].append(bb[2])
-					bounding['yMin'].append(bb[1])
-					bounding['yMax'].append(bb[3])
-
-				data['annotations'].append(ImageHandler.transform_bounding(bounding))
+		try:
+			if pool:
+				# imap streams the shards back in order, so rows line up with the serial path
+				results = pool.imap(_augment_shard, shards)
 			else:
-				data['annotations'].append([])
+				results = (_augment_shard(shard) for shard in shards)
+
+			for shard_id, shard_result in results:
+				shard_results[shard_id] = shard_result
+				if checkpoint is not None:
+					checkpoint.save_shard(shard_id, shard_result)
+				count += len(shard_result)
+				instrument.count(len(shard_result))
+				Utils.showProgress(count, len(rows), prefix=prefix.format(count, len(rows)), length=50)
+		finally:
+			if pool:
+				pool.close()
+				pool.join()
+
+		for shard_id in sorted(shard_results):
+			for aug_path, annotations in shard_results[shard_id]:
+				data['path'].append(aug_path)
+				data['annotations'].append(annotations)
+
+		if not data['path']:
+			return tc.SFrame()
 
 		augSFrame = tc.SFrame(data)
-		sf_images = tc.image_analysis.load_images(augImages_dir, with_path=True)
-		return augSFrame.join(sf_images, on='path', how='left')
+		return TCHandler.attach_images(augSFrame)
+
+	@staticmethod
+	def iterShards(rows, augImages_dir, shard_size, seed, batch_size=None):
+		"""
+		Splits the rows into (shard id, rows, augImages_dir, seed, batch_size) jobs of at most shard_size rows.
+		"""
+		shard_id = 0
+		shard = []
+		for row in rows:
+			shard.append((row['path'], row['annotations']))
+			if len(shard) == shard_size:
+				yield shard_id, shard, augImages_dir, seed, batch_size
+				shard_id += 1
+				shard = []
+		if shard:
+			yield shard_id, shard, augImages_dir, seed, batch_size
+
+	@classmethod
+	def augmentRow(cls, path, annotations, augImages_dir, seed=None):
+		"""
+		Augments a single image and writes the result into augImages_dir.
+
+		Parameters
+		----------
+		path : str
+			Path of the image to augment.
+		annotations : list of dict
+			The bounding boxes of the image in Turi Create format.
+		augImages_dir : str
+			The directory to write the augmented image in.
+		seed : int, optional
+			If given, the random state is reseeded with a seed derived from it and the image name first.
+
+		Returns
+		-------
+		tuple
+			The path of the augmented image and its bounding boxes in Turi Create format.
+		"""
+		if seed is not None:
+			ia.seed(DataAugHandler.seedFor(path, seed))
+
+		img, (sx, sy) = imageCache.read(path)
+		annotations = boxes.scale_annotations(annotations, sx, sy)
+		bbs = cls.getBoundingBoxesOnImage(annotations, img)
+		image_points_aug, bbs_aug = cls.seq(image=img, bounding_boxes=bbs)
+		# Named after the source image so a sample can be re-augmented on its own
+		aug_path = os.path.join(augImages_dir, os.path.basename(path))
+		cv2.imwrite(aug_path, image_points_aug)
+
+		return aug_path, DataAugHandler.getAnnotationsFromBoxes(bbs_aug, annotations)
+
+	@staticmethod
+	def seedFor(path, seed, index=0):
+		"""
+		Derives the seed of one augmentation of an image from the base seed, the image name and the augmentation index.
+		"""
+		return (seed + zlib.crc32(os.path.basename(path).encode('utf-8')) + index) % (2 ** 32)
+
+	def getAugmentationSource(self, per_image=1, seed=1, cache_dir=None, stems=None):
+		"""
+		Returns a lazy source of per_image augmentations of every image of the SFrame, see AugmentationSource.
+		"""
+		rows = self.dataSframe
+		if stems is not None:
+			rows = rows[rows['path'].apply(lambda path: os.path.splitext(os.path.basename(path))[0] in stems)]
+		return AugmentationSource(rows, per_image, seed, cache_dir)
+
+	def createInMemoryAugmentedSFrameFile(self, per_image=1, seed=1, cache_dir=None, stems=None):
+		"""
+		Writes the augmented SFrame from in-memory augmentations, encoded as JPEG without going through a file.
+
+		Parameters
+		----------
+		per_image : int, optional
+			Number of augmentations generated for each image.
+		seed : int, optional
+			Base seed of the augmentations.
+		cache_dir : str, optional
+			If given, augmentations are cached there and reused by later runs.
+		stems : set of str, optional
+			Samples that changed since the last run. Only their augmentations are generated again and replaced in the
+			augmented dataset.
+		"""
+		# Only the changed samples are augmented again, the rows of the others stay in their shards
+		source = self.getAugmentationSource(per_image, seed, cache_dir, stems)
+		if stems is not None:
+			source.invalidate(stems)
+
+		augmented_sf = source.toSFrame()
+		instrument.count(len(augmented_sf))
+		samples = None if stems is None else set('{0}_{1}'.format(stem, i) for stem in stems for i in range(per_image))
+		TCHandler.update_shards(augmented_sf, self.sframe_dir, 'augmented', samples)
+		self.writeFinal()
+
+	def writeFinal(self):
+		"""
+		Writes the final dataset, the original SFrame followed by the augmented shards, as an index of their shards.
+
+		The rows aren't copied, so the final dataset costs nothing to update. Load it with TCHandler.load_dataset.
+		"""
+		TCHandler.link_shards(self.sframe_dir, 'final', ['original', 'augmented'])
+		# Full copy written by older runs
+		final_path = os.path.join(self.sframe_dir, 'final.sframe')
+		if os.path.isdir(final_path):
+			shutil.rmtree(final_path)
+
+	@classmethod
+	def augmentShardBatches(cls, rows, augImages_dir, batch_size, seed=1):
+		"""
+		Augments a shard batch by batch, calling the sequence once per batch of similarly sized images instead of once
+		per image.
+
+		Each batch is seeded from the base seed and the name of its first image, so the output doesn't depend on which
+		worker augments the shard. Only the decoded images of one shard are held at a time.
+
+		Parameters
+		----------
+		rows : list of tuple
+			The (path, annotations) rows of the shard.
+		augImages_dir : str
+			The directory to write the augmented images in.
+		batch_size : int
+			Number of images per batch.
+		seed : int, optional
+			Base seed of the augmentations.
+
+		Returns
+		-------
+		list of tuple
+			The (path, annotations) of each augmented image, in the order of the rows.
+		"""
+		results = {}
+		for batch in cls.iterBatches(rows, batch_size):
+			ia.seed(cls.seedFor(batch.data[0][0], seed))
+			for batch_aug in cls.seq.augment_batches([batch]):
+				for (path, _), result in zip(batch_aug.data, cls.writeBatch(batch_aug, augImages_dir)):
+					results[path] = result
+		return [results[path] for path, _ in rows]
+
+	@classmethod
+	def iterBatches(cls, rows, batch_size):
+		"""
+		Decodes the images and groups them into batches of similarly sized images.
+
+		Images are read over a window of BUCKET_WINDOW batches, sorted by their size bucket and cut into batches, so
+		only a bounded number of decoded images is held at once.
+
+		Yields
+		------
+		UnnormalizedBatch
+			The images and their bounding boxes, with the (path, annotations) of each image as data.
+		"""
+		window = []
+		for path, annotations in rows:
+			img, (sx, sy) = imageCache.read(path)
+			window.append((path, boxes.scale_annotations(annotations, sx, sy), img))
+			if len(window) == batch_size * cls.BUCKET_WINDOW:
+				for batch in cls.bucketBatches(window, batch_size):
+					yield batch
+				window = []
+
+		for batch in cls.bucketBatches(window, batch_size):
+			yield batch
+
+	@classmethod
+	def bucketBatches(cls, window, batch_size):
+		"""
+		Sorts a window of decoded images by size bucket and cuts it into UnnormalizedBatch objects.
+		"""
+		step = cls.BUCKET_STEP
+		window = sorted(window, key=lambda item: (item[2].shape[0] // step, item[2].shape[1] // step))
+
+		for start in range(0, len(window), batch_size):
+			items = window[start:start + batch_size]
+			yield UnnormalizedBatch(
+				images=[img for _, _, img in items],
+				bounding_boxes=[cls.getBoundingBoxesOnImage(annotations, img) for _, annotations, img in items],
+				data=[(path, annotations) for path, annotations, _ in items]
+			)
+
+	@staticmethod
+	def writeBatch(batch_aug, augImages_dir):
+		"""
+		Writes the images of an augmented batch and converts their bounding boxes.
+
+		Returns
+		-------
+		list of tuple
+			The (path, annotations) of each augmented image.
+		"""
+		results = []
+		for image_aug, bbs_aug, (path, annotations) in zip(batch_aug.images_aug, batch_aug.bounding_boxes_aug,
+															batch_aug.data):
+			aug_path = os.path.join(augImages_dir, os.path.basename(path))
+			cv2.imwrite(aug_path, image_aug)
+			results.append((aug_path, DataAugHandler.getAnnotationsFromBoxes(bbs_aug, annotations)))
+		return results
+
+	@staticmethod
+	def getAnnotationsFromBoxes(bbs_aug, annotations):
+		"""
+		Converts augmented bounding boxes back into Turi Create annotations, dropping boxes that left the image.
+
+		Parameters
+		----------
+		bbs_aug : BoundingBoxesOnImage
+			The augmented bounding boxes.
+		annotations : list of dict
+			The original annotations, used for the label.
+
+		Returns
+		-------
+		list of dict
+			Bounding boxes in Turi Create format.
+		"""
+		bbs_kept = bbs_aug.remove_out_of_image().clip_out_of_image()
+		xyxy = bbs_kept.to_xyxy_array()
+		labels = [bb.label or annotations[0]['label'] for bb in bbs_kept.bounding_boxes]
+
+		keep = boxes.valid_mask(xyxy)
+		return boxes.to_annotations(boxes.xyxy_to_cxcywh(xyxy[keep]), [label for label, k in zip(labels, keep) if k])
 
 	def visualizeOriginal(self, aug_dir):
 
 		count = 0
 		for row in self.dataSframe:
-			img = cv2.imread(row["path"])
-			bbs = self.getBoundingBoxesOnImage(row["annotations"], img)
+			img, (sx, sy) = imageCache.read(row["path"])
+			bbs = self.getBoundingBoxesOnImage(boxes.scale_annotations(row["annotations"], sx, sy), img)
 			image_after = self.draw_bbs(img, bbs, 100)
 			cv2.imwrite(os.path.join(aug_dir, '{0}.JPEG'.format(count)), image_after)
 			count += 1
 			print(count)
 
-	def getBoundingBoxesOnImage(self, annotations, img):
-		bbsList = []
-		for annotation in annotations:
-			bbsList.append(self.getBoundingBoxFromAnnotation(annotation))
-		return BoundingBoxesOnImage(bbsList, img.shape)
-
-	def getBoundingBoxFromAnnotation(self, annotation):
-
-		centerX = annotation['coordinates']['x']
-		centerY = annotation['coordinates']['y']
-		width = annotation['coordinates']['width']
-		height = annotation['coordinates']['height']
-		x1 = centerX - width / 2
-		x2 = centerX + width / 2
-		y1 = centerY - height / 2
-		y2 = centerY + height / 2
-		label = annotation['label']
-		return BoundingBox(x1, y1, x2, y2, label)
+	@staticmethod
+	def getBoundingBoxesOnImage(annotations, img):
+		cxcywh, labels = boxes.from_annotations(annotations)
+		return DataAugHandler.getBoundingBoxesFromArray(boxes.cxcywh_to_xyxy(cxcywh), labels, img)
+
+	@staticmethod
+	def getBoundingBoxesFromArray(xyxy, labels, img):
+		"""
+		Builds imgaug bounding boxes straight from an (N, 4) xyxy array, for e.g. AnnotationStore.image_boxes.
+		"""
+		bbs = BoundingBoxesOnImage.from_xyxy_array(xyxy, shape=img.shape)
+		for bb, label in zip(bbs.bounding_boxes, labels):
+			bb.label = label
+		return bbs
 
 	GREEN = [0, 255, 0]
 	ORANGE = [255, 140, 0]
@@ -172,6 +502,165 @@ class DataAugHandler(object):
 		return image_border
 
 
-def augmentData(sframe_dir, augImages_dir):
+class AugmentationSource(object):
+	def __init__(self, rows, per_image=1, seed=1, cache_dir=None):
+		"""
+		Lazily generates augmentations of the images of an SFrame in memory.
+
+		Iterating yields (image, annotations) pairs, per_image of them for each row, with the image as a BGR uint8
+		array. Each source image is decoded once for all of its augmentations. If a cache directory is given, every
+		augmentation is also written there as '<stem>_<i>.JPEG' with its annotations in '<stem>_<i>.json', and
+		reused instead of being generated again.
+
+		Parameters
+		----------
+		rows : SFrame
+			Rows with the columns path and annotations.
+		per_image : int, optional
+			Number of augmentations generated for each image.
+		seed : int, optional
+			Base seed. Each augmentation is seeded from it, the image name and its index, see DataAugHandler.seedFor.
+		cache_dir : str, optional
+			Directory to cache the augmentations in.
+		"""
+		self.rows = rows[['path', 'annotations']]
+		self.per_image = per_image
+		self.seed = seed
+		self.cache_dir = cache_dir
+
+	def __len__(self):
+		return len(self.rows) * self.per_image
+
+	def __iter__(self):
+		for path, image, annotations in self.iterSamples():
+			yield image, annotations
+
+	def iterSamples(self, decode=True):
+		"""
+		Yields (path, image, annotations) for every augmentation.
+
+		The path is the cached file, or a name derived from the source image if there is no cache. With decode=False,
+		cached augmentations are not read back and their image is None.
+		"""
+		for row in self.rows:
+			img = None
+			annotations = row['annotations']
+			for i in range(self.per_image):
+				name = self.sampleName(row['path'], i)
+				cached = self.readCache(name)
+				if cached is not None:
+					cache_path, cached_annotations = cached
+					yield cache_path, cv2.imread(cache_path) if decode else None, cached_annotations
+					continue
+
+				if img is None:
+					img, (sx, sy) = imageCache.read(row['path'])
+					annotations = boxes.scale_annotations(row['annotations'], sx, sy)
+				ia.seed(DataAugHandler.seedFor(row['path'], self.seed, i))
+				bbs = DataAugHandler.getBoundingBoxesOnImage(annotations, img)
+				image_aug, bbs_aug = DataAugHandler.seq(image=img, bounding_boxes=bbs)
+				aug_annotations = DataAugHandler.getAnnotationsFromBoxes(bbs_aug, annotations)
+
+				yield self.writeCache(name, image_aug, aug_annotations), image_aug, aug_annotations
+
+	def toSFrame(self, batch_size=1000):
+		"""
+		Builds an SFrame of the augmentations, flushing rows every batch_size augmentations.
+
+		The rows only hold encoded images. Cached augmentations are attached from their JPEG file as is, new ones are
+		encoded in memory and their path is the sample name if there is no cache directory.
+
+		Returns
+		-------
+		SFrame
+			Includes three columns: path, annotations, image.
+		"""
+		data = {
+			'path': [],
+			'annotations': [],
+			'image': []
+		}
+		sf = None
+		for path, image, annotations in self.iterSamples(decode=False):
+			data['path'].append(path)
+			data['annotations'].append(annotations)
+			# Only cached augmentations come back without their image
+			data['image'].append(tc.Image(path) if image is None else TCHandler.image_from_array(image))
+			if len(data['path']) >= batch_size:
+				sf = TCHandler.append_rows(sf, data)
+
+		if sf is None and not data['path']:
+			return tc.SFrame()
+		return TCHandler.append_rows(sf, data)
+
+	def sampleName(self, path, index):
+		stem, ext = os.path.splitext(os.path.basename(path))
+		return '{0}_{1}{2}'.format(stem, index, ext)
+
+	def readCache(self, name):
+		"""
+		Returns the (image path, annotations) of a cached augmentation, or None if it isn't cached.
+		"""
+		if not self.cache_dir:
+			return None
+		image_path = os.path.join(self.cache_dir, name)
+		annotations_path = os.path.splitext(image_path)[0] + '.json'
+		if not os.path.exists(image_path) or not os.path.exists(annotations_path):
+			return None
+		with open(annotations_path, 'r') as f:
+			return image_path, json.load(f)
+
+	def writeCache(self, name, image, annotations):
+		"""
+		Caches an augmentation if there is a cache directory.
+
+		Returns
+		-------
+		str
+			The path of the cached image, or just the sample name if nothing is cached.
+		"""
+		if not self.cache_dir:
+			return name
+		image_path = os.path.join(self.cache_dir, name)
+		cv2.imwrite(image_path, image)
+		# The annotations file is written last, so a half written sample is never read back
+		with open(os.path.splitext(image_path)[0] + '.json', 'w') as f:
+			json.dump(annotations, f, default=float)
+		return image_path
+
+	def invalidate(self, stems):
+		"""
+		Removes the cached augmentations of the given samples.
+		"""
+		if not self.cache_dir:
+			return
+		for file in os.listdir(self.cache_dir):
+			if file.rsplit('_', 1)[0] in stems:
+				os.remove(os.path.join(self.cache_dir, file))
+
+
+def _augment_shard(job):
+	"""
+	Augments a shard of (path, annotations) rows. Used as the process pool entry point, so it has to live at module level.
+	"""
+	shard_id, rows, augImages_dir, seed, batch_size = job
+	if batch_size:
+		return shard_id, DataAugHandler.augmentShardBatches(rows, augImages_dir, batch_size, seed)
+	return shard_id, [DataAugHandler.augmentRow(path, annotations, augImages_dir, seed) for path, annotations in rows]
+
+
+@instrument.timed('augment', unit='images')
+def augmentData(sframe_dir, augImages_dir, stems=None, num_workers=1, shard_size=64, seed=1, batch_size=None,
+				per_image=1, in_memory=False, checkpoint=None, identity=None):
 	handler = DataAugHandler(sframe_dir)
-	handler.createAugmentedandFinalSFrameFile(augImages_dir)
+	if in_memory:
+		# augImages_dir only serves as the cache of the in-memory augmentations, which already lets a rerun skip the
+		# samples an interrupted run got through, so the checkpoint only has to keep the cache from being wiped
+		if checkpoint is not None:
+			checkpoint.start({'in_memory': True, 'identity': identity})
+		handler.createInMemoryAugmentedSFrameFile(per_image, seed, augImages_dir, stems)
+		if checkpoint is not None:
+			checkpoint.finish()
+	else:
+		handler.createAugmentedandFinalSFrameFile(augImages_dir, stems, num_workers, shard_size, seed, batch_size,
+												  checkpoint, identity)
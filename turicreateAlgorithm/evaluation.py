@@ -0,0 +1,207 @@
+"""
+Object detection metrics computed from predictions that were already made, without running the model again.
+
+Ground truth and predictions are turned into flat box arrays (see boxes.annotations_to_arrays), and every image is
+matched once with an IoU matrix. Reports per-class average precision at IoU thresholds 0.5 to 0.95, precision-recall
+curves and a confusion matrix.
+"""
+import numpy as np
+
+import boxes
+
+# IoU thresholds of the COCO style mean average precision
+IOU_THRESHOLDS = tuple(np.round(np.arange(0.5, 0.96, 0.05), 2).tolist())
+
+BACKGROUND = '__background__'
+
+# Confidence threshold to predict with before evaluating, same as model.evaluate uses
+MIN_CONFIDENCE = 0.001
+
+
+def to_arrays(annotation_lists):
+	"""
+	Converts annotations or predictions into xyxy boxes, offsets, labels and scores.
+
+	Returns
+	-------
+	tuple
+		(boxes, offsets, labels, scores): the (M, 4) xyxy boxes, the (N + 1,) offsets of each image, the M labels and
+		the (M,) confidences, 1 for ground truth annotations.
+	"""
+	annotation_lists = [annotations or [] for annotations in annotation_lists]
+	cxcywh, offsets, labels = boxes.annotations_to_arrays(annotation_lists)
+	scores = np.asarray([a.get('confidence', 1.0) for annotations in annotation_lists for a in annotations],
+						dtype=boxes.DTYPE)
+	return boxes.cxcywh_to_xyxy(cxcywh), offsets, labels, scores
+
+
+def match_image(iou, pred_scores, thresholds):
+	"""
+	Greedily matches the predictions of one image to its ground truth boxes, most confident prediction first.
+
+	The ground truth boxes of each prediction are sorted by IoU once, and every threshold is matched in the same pass
+	over the predictions: a prediction takes, at each threshold, the best ground truth box not already taken there.
+
+	Parameters
+	----------
+	iou : numpy.ndarray
+		(P, G) IoU of each prediction with each ground truth box, negative for pairs that may not match (for e.g.
+		different labels).
+	pred_scores : numpy.ndarray
+		(P,) confidences.
+	thresholds : tuple of float
+		Smallest IoU of a match, one matching per threshold.
+
+	Returns
+	-------
+	numpy.ndarray
+		(P, T) index of the ground truth box each prediction matched at each threshold, -1 for false positives.
+	"""
+	num_preds, num_gt = iou.shape
+	matched = np.full((num_preds, len(thresholds)), -1, dtype=np.int64)
+	if not num_preds or not num_gt:
+		return matched
+
+	thresholds = np.asarray(thresholds, dtype=iou.dtype)
+	rows = np.arange(len(thresholds))
+	# Stable sorts, so ties go to the first ground truth box and the most confident prediction listed first
+	order = np.argsort(-pred_scores, kind='mergesort')
+	gt_order = np.argsort(-iou, axis=1, kind='mergesort')
+	sorted_iou = iou[np.arange(num_preds)[:, None], gt_order]
+
+	# (T, G) ground truth boxes taken at each threshold
+	taken = np.zeros((len(thresholds), num_gt), dtype=bool)
+	for p in order[sorted_iou[order, 0] >= thresholds.min()]:
+		free = ~taken[:, gt_order[p]]
+		first = free.argmax(axis=1)
+		hit = free[rows, first] & (sorted_iou[p, first] >= thresholds)
+		g = gt_order[p, first[hit]]
+		taken[rows[hit], g] = True
+		matched[p, hit] = g
+	return matched
+
+
+def average_precision(tp, scores, num_gt):
+	"""
+	Computes the area under the interpolated precision-recall curve of one class.
+
+	Parameters
+	----------
+	tp : numpy.ndarray
+		(P,) true positive flags of the predictions of the class.
+	scores : numpy.ndarray
+		(P,) their confidences.
+	num_gt : int
+		Number of ground truth boxes of the class.
+
+	Returns
+	-------
+	tuple
+		The average precision (nan without ground truth), and the precision and recall arrays of the curve.
+	"""
+	if not num_gt:
+		return float('nan'), np.zeros(0), np.zeros(0)
+	order = np.argsort(-scores, kind='mergesort')
+	tp_cum = np.cumsum(tp[order])
+	precision = tp_cum / np.arange(1, len(tp_cum) + 1, dtype=boxes.DTYPE)
+	recall = tp_cum / float(num_gt)
+
+	# Precision envelope: the best precision reachable at this recall or higher
+	envelope = np.maximum.accumulate(precision[::-1])[::-1]
+	recall_steps = np.diff(np.concatenate([[0.0], recall]))
+	return float(np.sum(recall_steps * envelope)), precision, recall
+
+
+def evaluate(ground_truth, predictions, iou_thresholds=IOU_THRESHOLDS, confusion_iou=0.5, confusion_confidence=0.25):
+	"""
+	Evaluates predictions against the ground truth annotations of the same images.
+
+	Parameters
+	----------
+	ground_truth : iterable of list of dict
+		The annotations of each image, for e.g. test_data['annotations'].
+	predictions : iterable of list of dict
+		The predictions of each image in the same order, as returned by model.predict.
+	iou_thresholds : tuple of float, optional
+		IoU thresholds the average precision is computed at.
+	confusion_iou : float, optional
+		IoU threshold of the confusion matrix.
+	confusion_confidence : float, optional
+		Predictions less confident than this are left out of the confusion matrix.
+
+	Returns
+	-------
+	dict
+		- 'average_precision': label -> {iou threshold -> AP}
+		- 'average_precision_50': label -> AP at IoU 0.5
+		- 'mean_average_precision_50': mean over labels of the AP at IoU 0.5
+		- 'mean_average_precision': mean over labels and thresholds
+		- 'pr_curves': label -> {'precision', 'recall'} lists at IoU 0.5
+		- 'confusion': {'labels', 'counts'}, with ground truth rows and predicted columns. The last label is the
+		  background: missed boxes in the last column, predictions matching nothing in the last row.
+	"""
+	gt_boxes, gt_offsets, gt_labels, _ = to_arrays(ground_truth)
+	pred_boxes, pred_offsets, pred_labels, pred_scores = to_arrays(predictions)
+	if len(gt_offsets) != len(pred_offsets):
+		raise ValueError("Got {0} images of ground truth and {1} of predictions".format(
+			len(gt_offsets) - 1, len(pred_offsets) - 1))
+
+	label_names = sorted(set(gt_labels) | set(pred_labels))
+	label_ids = dict((label, i) for i, label in enumerate(label_names))
+	gt_ids = np.asarray([label_ids[label] for label in gt_labels], dtype=np.int64)
+	pred_ids = np.asarray([label_ids[label] for label in pred_labels], dtype=np.int64)
+
+	thresholds = tuple(iou_thresholds)
+	tp = np.zeros((len(pred_ids), len(thresholds)), dtype=bool)
+	background = len(label_names)
+	confusion = np.zeros((background + 1, background + 1), dtype=np.int64)
+
+	for i in range(len(gt_offsets) - 1):
+		gt_slice = slice(gt_offsets[i], gt_offsets[i + 1])
+		pred_slice = slice(pred_offsets[i], pred_offsets[i + 1])
+		iou = boxes.iou(pred_boxes[pred_slice], gt_boxes[gt_slice])
+		same_label = pred_ids[pred_slice][:, None] == gt_ids[gt_slice][None, :]
+
+		tp[pred_slice] = match_image(np.where(same_label, iou, -1.0), pred_scores[pred_slice], thresholds) >= 0
+
+		# Confusion counts match across labels, so a box found with the wrong label shows up off the diagonal
+		confident = pred_scores[pred_slice] >= confusion_confidence
+		matched = match_image(iou[confident], pred_scores[pred_slice][confident], (confusion_iou,))[:, 0]
+		image_gt_ids = gt_ids[gt_slice]
+		hit = matched >= 0
+		rows = np.full(len(matched), background, dtype=np.int64)
+		rows[hit] = image_gt_ids[matched[hit]]
+		np.add.at(confusion, (rows, pred_ids[pred_slice][confident]), 1)
+		missed = np.ones(len(image_gt_ids), dtype=bool)
+		missed[matched[hit]] = False
+		np.add.at(confusion, (image_gt_ids[missed], background), 1)
+
+	results = {
+		'iou_thresholds': list(thresholds),
+		'average_precision': {},
+		'average_precision_50': {},
+		'pr_curves': {},
+	}
+	all_ap = []
+	for label, label_id in zip(label_names, range(len(label_names))):
+		in_class = pred_ids == label_id
+		num_gt = int(np.sum(gt_ids == label_id))
+		per_threshold = {}
+		for t, threshold in enumerate(thresholds):
+			ap, precision, recall = average_precision(tp[in_class, t], pred_scores[in_class], num_gt)
+			per_threshold[threshold] = ap
+			if threshold == 0.5:
+				results['pr_curves'][label] = {'precision': precision.tolist(), 'recall': recall.tolist()}
+		results['average_precision'][label] = per_threshold
+		results['average_precision_50'][label] = per_threshold.get(0.5, float('nan'))
+		if num_gt:
+			all_ap.append([per_threshold[threshold] for threshold in thresholds])
+
+	all_ap = np.asarray(all_ap, dtype=boxes.DTYPE).reshape(-1, len(thresholds))
+	if 0.5 in thresholds and len(all_ap):
+		results['mean_average_precision_50'] = float(all_ap[:, thresholds.index(0.5)].mean())
+	else:
+		results['mean_average_precision_50'] = float('nan')
+	results['mean_average_precision'] = float(all_ap.mean()) if all_ap.size else float('nan')
+	results['confusion'] = {'labels': label_names + [BACKGROUND], 'counts': confusion.tolist()}
+	return results
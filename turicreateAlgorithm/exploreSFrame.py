@@ -1,5 +1,6 @@
 import turicreate as tc
 import sys
+from xmlToSFrame import TCHandler
 
 def explore(sframe_dir=None, draw_bounding_boxes=True, range = (0,20)):
     """
@@ -8,14 +9,14 @@ def explore(sframe_dir=None, draw_bounding_boxes=True, range = (0,20)):
     Parameters
     ----------
     sframe_dir : str, optional
-        The path of the SFrame file.
+        The path of the SFrame file, or of a sharded dataset.
     draw_bounding_boxes : bool, optional
         Whether or not to display the images with the bounding boxes drawn (good for manual inspection).
     limit : int, optional
         How many entries to display in the Turi Create Visualizer.
     """
     sframe_dir = sframe_dir.strip()
-    sf = tc.SFrame(sframe_dir)
+    sf = TCHandler.load_dataset(sframe_dir)
     sf.dropna()
     print( sf[range[0]: range[1]])
     if draw_bounding_boxes:
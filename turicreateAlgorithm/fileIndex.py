@@ -0,0 +1,126 @@
+import os
+
+try:
+	from os import scandir
+except ImportError:
+	from scandir import scandir
+
+# Extensions are compared lower-cased, so .JPEG, .jpeg and .jpg all count as images
+ANNOTATION_EXTS = ('.xml',)
+IMAGE_EXTS = ('.jpeg', '.jpg')
+
+KIND_EXTS = {
+	'xml': ANNOTATION_EXTS,
+	'image': IMAGE_EXTS,
+}
+
+
+class FileIndex(object):
+	def __init__(self, annotatations_dir=None, image_dir=None):
+		"""
+		Indexes the annotation and image files of every label with a single scan of each directory.
+
+		Both directories are expected to hold one sub-directory per label, as downloaded from ImageNet. Files are keyed
+		by their name without the last extension, so stems containing dots are kept intact.
+
+		Parameters
+		----------
+		annotatations_dir : str, optional
+			Directory holding a folder of xml files per label.
+		image_dir : str, optional
+			Directory holding a folder of images per label.
+		"""
+		# label -> stem -> kind -> (path, size, mtime)
+		self.entries = {}
+		# label -> kind -> directory
+		self.label_dirs = {}
+
+		if annotatations_dir:
+			self.add_root(annotatations_dir, 'xml')
+		if image_dir:
+			self.add_root(image_dir, 'image')
+
+	def add_root(self, root_dir, kind):
+		"""
+		Indexes every label folder found in root_dir.
+		"""
+		for entry in scandir(root_dir):
+			if entry.is_dir():
+				self.add_label(entry.name, entry.path, kind)
+
+	def add_label(self, label, label_dir, kind):
+		"""
+		Indexes the files of one label folder.
+
+		Parameters
+		----------
+		label : str
+			The label of the annotated object, for e.g. 'barbell'.
+		label_dir : str
+			The folder holding the files.
+		kind : str
+			Either 'xml' or 'image'.
+		"""
+		exts = KIND_EXTS[kind]
+		self.label_dirs.setdefault(label, {})[kind] = label_dir
+		stems = self.entries.setdefault(label, {})
+
+		for entry in scandir(label_dir):
+			stem, ext = os.path.splitext(entry.name)
+			if ext.lower() in exts and entry.is_file():
+				stat = entry.stat()
+				stems.setdefault(stem, {})[kind] = (entry.path, stat.st_size, stat.st_mtime)
+
+	def labels(self, kinds=('xml', 'image')):
+		"""
+		Returns the sorted labels that have a folder for each of the kinds.
+		"""
+		return sorted(label for label, dirs in self.label_dirs.items() if all(kind in dirs for kind in kinds))
+
+	def label_dir(self, label, kind):
+		return self.label_dirs[label][kind]
+
+	def stems(self, label, kind):
+		"""
+		Returns the set of stems of a label that have a file of the given kind.
+		"""
+		return set(stem for stem, kinds in self.entries.get(label, {}).items() if kind in kinds)
+
+	def path(self, label, stem, kind):
+		"""
+		Returns the path of a file, or None if it isn't indexed.
+		"""
+		entry = self.entries.get(label, {}).get(stem, {}).get(kind)
+		return entry[0] if entry else None
+
+	def size(self, label, stem, kind):
+		"""
+		Returns the size of a file as it was indexed, or None if it isn't indexed.
+		"""
+		entry = self.entries.get(label, {}).get(stem, {}).get(kind)
+		return entry[1] if entry else None
+
+	def files(self, label, kind):
+		"""
+		Returns the sorted paths of every file of the given kind for a label.
+		"""
+		return sorted(kinds[kind][0] for kinds in self.entries.get(label, {}).values() if kind in kinds)
+
+	def stats(self, kinds=('xml', 'image')):
+		"""
+		Yields (path, size, mtime) for every indexed file of the given kinds.
+		"""
+		for stems in self.entries.values():
+			for files in stems.values():
+				for kind in kinds:
+					if kind in files:
+						yield files[kind]
+
+	def remove(self, label, stem, kind):
+		"""
+		Drops a file from the index once it has been deleted from disk.
+		"""
+		files = self.entries[label][stem]
+		del files[kind]
+		if not files:
+			del self.entries[label][stem]
@@ -0,0 +1,344 @@
+import os
+import struct
+import hashlib
+import collections
+import numpy as np
+import cv2
+
+# Start of frame markers, which hold the image size. 0xc4, 0xc8 and 0xcc are other segments in the same range.
+SOF_MARKERS = set(range(0xc0, 0xd0)) - set([0xc4, 0xc8, 0xcc])
+
+# Power of two reductions libjpeg can decode straight from the DCT coefficients, largest first
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def jpeg_size(path):
+	"""
+	Reads the size of a JPEG from its header, without decoding it.
+
+	Returns
+	-------
+	tuple or None
+		(width, height), or None if the file isn't a JPEG or has no frame header.
+	"""
+	with open(path, 'rb') as f:
+		frame = jpeg_frame(f)
+	return None if frame is None else frame[:2]
+
+
+def jpeg_frame(f):
+	"""
+	Reads the frame header of a JPEG from an open binary file, without decoding it.
+
+	Returns
+	-------
+	tuple or None
+		(width, height, channels), or None if the file isn't a JPEG or has no frame header.
+	"""
+	if f.read(2) != b'\xff\xd8':
+		return None
+	while True:
+		byte = f.read(1)
+		while byte and byte != b'\xff':
+			byte = f.read(1)
+		while byte == b'\xff':
+			byte = f.read(1)
+		if not byte:
+			return None
+
+		marker = ord(byte)
+		# Markers without a length field
+		if marker == 0x01 or 0xd0 <= marker <= 0xd9:
+			continue
+		header = f.read(2)
+		if len(header) < 2:
+			return None
+		length = struct.unpack('>H', header)[0]
+		if marker in SOF_MARKERS:
+			frame = f.read(6)
+			if len(frame) < 6:
+				return None
+			height, width, channels = struct.unpack('>xHHB', frame)
+			return width, height, channels
+		f.seek(length - 2, 1)
+
+
+def reduced_flag(size, min_width, min_height):
+	"""
+	Returns the cv2.imread flag decoding an image at the largest reduction that is still at least min_width x
+	min_height.
+
+	Parameters
+	----------
+	size : tuple or None
+		(width, height) of the image, see jpeg_size. None always decodes at full resolution.
+	min_width : int
+		Smallest width wanted.
+	min_height : int
+		Smallest height wanted.
+	"""
+	if size is not None:
+		for factor, flag in REDUCED_FLAGS:
+			if size[0] // factor >= min_width and size[1] // factor >= min_height:
+				return flag
+	return cv2.IMREAD_COLOR
+
+
+def decode(path, max_side=None):
+	"""
+	Decodes an image, downscaled so its longest side is at most max_side.
+
+	JPEGs are decoded at 1/2, 1/4 or 1/8 of their size when that is still at least max_side, which skips most of the
+	decoding work, and resized the rest of the way.
+
+	Parameters
+	----------
+	path : str
+		The image file.
+	max_side : int, optional
+		The longest side wanted, None decodes at full resolution.
+
+	Returns
+	-------
+	tuple
+		The BGR uint8 image (None if it can't be read) and its (x, y) scale relative to the file.
+	"""
+	if not max_side:
+		return cv2.imread(path), (1.0, 1.0)
+
+	size = jpeg_size(path)
+	flag = cv2.IMREAD_COLOR
+	if size is not None and max(size) > max_side:
+		ratio = max_side / float(max(size))
+		flag = reduced_flag(size, int(size[0] * ratio), int(size[1] * ratio))
+
+	img = cv2.imread(path, flag)
+	if img is None:
+		return None, (1.0, 1.0)
+	height, width = img.shape[:2]
+	if size is None:
+		size = (width, height)
+
+	if max(height, width) > max_side:
+		ratio = max_side / float(max(height, width))
+		img = cv2.resize(img, (max(int(round(width * ratio)), 1), max(int(round(height * ratio)), 1)),
+						 interpolation=cv2.INTER_AREA)
+	return img, (img.shape[1] / float(size[0]), img.shape[0] / float(size[1]))
+
+
+class ImageCache(object):
+	# Eviction frees the on-disk cache down to this fraction of its bound, so it doesn't run again on the next write
+	DISK_EVICT_TO = 0.9
+
+	def __init__(self, max_bytes=256 << 20, cache_dir=None, max_side=None, store_dir=None, max_disk_bytes=None):
+		"""
+		Decoded images shared by every stage of a process, so a JPEG is decoded once per run.
+
+		Images are kept in memory up to max_bytes, least recently used first out. If cache_dir is given, decoded
+		images are also written there as uint8 arrays, so later runs skip the decoding as well, up to max_disk_bytes,
+		least recently read first out. Entries are keyed by path, modification time, size and max_side, so a changed
+		file is decoded again.
+
+		If store_dir holds an ImageStore, see imageStore.py, images it has for the same file and max_side are returned
+		as views of its memory map, which never count against max_bytes.
+
+		The arrays returned are shared, callers must copy them before drawing on them in place.
+
+		Parameters
+		----------
+		max_bytes : int, optional
+			Memory bound of the decoded images held, 0 disables the memory cache.
+		cache_dir : str, optional
+			Directory of the on-disk cache.
+		max_side : int, optional
+			Default longest side images are decoded at, None for full resolution.
+		store_dir : str, optional
+			The <name>.images folder of an ImageStore, opened on first read, so each process maps it itself.
+		max_disk_bytes : int, optional
+			Size bound of the on-disk cache, None for no bound.
+		"""
+		self.max_bytes = max_bytes
+		self.max_disk_bytes = max_disk_bytes
+		self.disk_bytes = None
+		self.cache_dir = cache_dir
+		self.max_side = max_side
+		self.store_dir = store_dir
+		self.store = None
+		self.images = collections.OrderedDict()
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+
+		if cache_dir and not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+	def read(self, path, max_side=None):
+		"""
+		Returns a decoded image, from the cache if possible.
+
+		Parameters
+		----------
+		path : str
+			The image file.
+		max_side : int, optional
+			The longest side wanted, defaults to the max_side of the cache.
+
+		Returns
+		-------
+		tuple
+			The BGR uint8 image and its (x, y) scale relative to the file, see decode. Boxes read from the annotations
+			of the file have to be multiplied by the scale, see boxes.scale.
+		"""
+		max_side = max_side or self.max_side
+		stat = os.stat(path)
+		key = (path, stat.st_mtime, stat.st_size, max_side)
+
+		store = self.openStore()
+		if store is not None and store.max_side == max_side:
+			i = store.find(path, (stat.st_size, stat.st_mtime))
+			if i is not None:
+				self.hits += 1
+				return store.image(i), store.scale(i)
+
+		entry = self.images.get(key)
+		if entry is not None:
+			self.hits += 1
+			# Moved to the end, the most recently used side
+			del self.images[key]
+			self.images[key] = entry
+			return entry
+
+		self.misses += 1
+		entry = self.readDisk(key)
+		if entry is None:
+			entry = decode(path, max_side)
+			if entry[0] is not None:
+				self.writeDisk(key, entry)
+		self.remember(key, entry)
+		return entry
+
+	def remember(self, key, entry):
+		"""
+		Holds an entry in memory, evicting the least recently used ones over max_bytes.
+		"""
+		img = entry[0]
+		if img is None or img.nbytes > self.max_bytes:
+			return
+		self.images[key] = entry
+		self.nbytes += img.nbytes
+		while self.nbytes > self.max_bytes:
+			_, (evicted, _) = self.images.popitem(last=False)
+			self.nbytes -= evicted.nbytes
+
+	def diskPath(self, key):
+		return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.npz')
+
+	def readDisk(self, key):
+		if not self.cache_dir:
+			return None
+		disk_path = self.diskPath(key)
+		try:
+			with np.load(disk_path) as cached:
+				entry = cached['image'], tuple(cached['scale'].tolist())
+			# Touched, so eviction goes by the last read
+			os.utime(disk_path, None)
+		except (IOError, OSError):
+			# Not cached, or evicted by another process meanwhile
+			return None
+		return entry
+
+	def writeDisk(self, key, entry):
+		"""
+		Writes an entry to the on-disk cache. The file is renamed into place, so a crash never leaves half of one.
+		"""
+		if not self.cache_dir:
+			return
+		disk_path = self.diskPath(key)
+		tmp_path = disk_path[:-len('.npz')] + '.tmp.npz'
+		np.savez(tmp_path, image=entry[0], scale=np.asarray(entry[1]))
+		os.rename(tmp_path, disk_path)
+
+		if self.max_disk_bytes:
+			if self.disk_bytes is None:
+				self.evictDisk()
+			else:
+				self.disk_bytes += os.path.getsize(disk_path)
+				if self.disk_bytes > self.max_disk_bytes:
+					self.evictDisk()
+
+	def evictDisk(self):
+		"""
+		Deletes the least recently read files of the on-disk cache until it holds at most DISK_EVICT_TO of
+		max_disk_bytes, and measures what is left.
+
+		Processes sharing the directory each keep their own count of its size, measured again on every eviction, so the
+		bound is only exceeded by what they wrote since.
+		"""
+		files = []
+		for file_name in os.listdir(self.cache_dir):
+			if not file_name.endswith('.npz') or file_name.endswith('.tmp.npz'):
+				continue
+			path = os.path.join(self.cache_dir, file_name)
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			files.append((stat.st_mtime, stat.st_size, path))
+
+		self.disk_bytes = sum(size for _, size, _ in files)
+		if self.disk_bytes <= self.max_disk_bytes:
+			return
+		for _, size, path in sorted(files):
+			if self.disk_bytes <= self.max_disk_bytes * self.DISK_EVICT_TO:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			self.disk_bytes -= size
+
+	def openStore(self):
+		if self.store is None and self.store_dir and os.path.isfile(os.path.join(self.store_dir, 'index.json')):
+			from imageStore import ImageStore
+
+			self.store = ImageStore.load(self.store_dir)
+		return self.store
+
+	def closeStore(self):
+		"""
+		Drops the mapping of the store, for e.g. once it has been rebuilt. It is opened again on the next read.
+		"""
+		self.store = None
+
+	def clear(self):
+		self.images.clear()
+		self.nbytes = 0
+
+	def stats(self):
+		return {
+			'images': len(self.images),
+			'bytes': self.nbytes,
+			'disk_bytes': self.disk_bytes,
+			'hits': self.hits,
+			'misses': self.misses,
+		}
+
+
+# The cache of the process. Worker processes forked after configure start with the same settings.
+cache = ImageCache()
+
+
+def configure(max_bytes=256 << 20, cache_dir=None, max_side=None, store_dir=None, max_disk_bytes=None):
+	"""
+	Replaces the cache of the process, see ImageCache.
+	"""
+	global cache
+	cache = ImageCache(max_bytes, cache_dir, max_side, store_dir, max_disk_bytes)
+	return cache
+
+
+def read(path, max_side=None):
+	"""
+	Reads an image through the cache of the process, see ImageCache.read.
+	"""
+	return cache.read(path, max_side)
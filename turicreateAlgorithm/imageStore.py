@@ -0,0 +1,271 @@
+"""
+The decoded images of a dataset in one memory-mapped uint8 file.
+
+Every stage reads the same JPEGs again, and decoding them dominates repeated runs. An ImageStore decodes every image
+of a dataset once into a <name>.images folder:
+
+	pixels.bin     the BGR uint8 pixels of every image, back to back
+	offsets.npy    (N + 1,) int64 byte offset of each image in pixels.bin
+	shapes.npy     (N, 3) int32 height, width and channels of each image, zeros for unreadable images
+	scales.npy     (N, 2) float64 (x, y) scale of each image relative to its file, see imageCache.decode
+	files.npy      (N, 2) float64 size and modification time of each file when it was decoded
+	annotations/   the AnnotationStore of the boxes, in the coordinates of the stored images
+	index.json     the paths and the max_side the images were decoded at
+
+pixels.bin is opened with np.memmap, so an image is a read-only view of the mapping and reading it copies nothing.
+Worker processes mapping the same store share its pages through the page cache, instead of each decoding its own copy.
+"""
+import os
+import json
+import shutil
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+import boxes
+import instrument
+import imageCache
+from annotationStore import AnnotationStore
+
+
+class ImageStore(object):
+	def __init__(self, store_dir, paths, pixels, offsets, shapes, scales, files, annotations, max_side=None):
+		"""
+		Decoded images indexed by path. Use ImageStore.build to write one and ImageStore.load to open it.
+
+		Parameters
+		----------
+		store_dir : str
+			The <name>.images folder.
+		paths : list of str
+			The image path of each of the N images.
+		pixels : numpy.ndarray
+			The uint8 pixels of every image, flat.
+		offsets : numpy.ndarray
+			(N + 1,) int64 offsets of each image in pixels.
+		shapes : numpy.ndarray
+			(N, 3) int32 shape of each image.
+		scales : numpy.ndarray
+			(N, 2) float64 scale of each image relative to its file.
+		files : numpy.ndarray
+			(N, 2) float64 size and modification time of each file.
+		annotations : AnnotationStore
+			The boxes of each image, in stored image coordinates.
+		max_side : int, optional
+			The longest side the images were decoded at, None for full resolution.
+		"""
+		self.store_dir = store_dir
+		self.paths = list(paths)
+		self.pixels = pixels
+		self.offsets = offsets
+		self.shapes = shapes
+		self.scales = scales
+		self.files = files
+		self.annotations = annotations
+		self.max_side = max_side
+		self.positions = dict((path, i) for i, path in enumerate(self.paths))
+
+	def __len__(self):
+		return len(self.paths)
+
+	def find(self, path, file_stat=None):
+		"""
+		Returns the index of an image, or None if it isn't stored.
+
+		Parameters
+		----------
+		path : str
+			The image file.
+		file_stat : tuple, optional
+			(size, modification time) of the file. If given, an image decoded from an older version of the file isn't
+			returned.
+		"""
+		i = self.positions.get(path)
+		if i is None or file_stat is None:
+			return i
+		return i if tuple(self.files[i].tolist()) == (float(file_stat[0]), float(file_stat[1])) else None
+
+	def image(self, i):
+		"""
+		Returns image i as a read-only (height, width, channels) view of the store, or None if it was unreadable.
+		"""
+		if not self.shapes[i, 0]:
+			return None
+		return self.pixels[self.offsets[i]:self.offsets[i + 1]].reshape(tuple(self.shapes[i].tolist()))
+
+	def scale(self, i):
+		return tuple(self.scales[i].tolist())
+
+	def iterBatches(self, indices=None, batch_size=32):
+		"""
+		Feeds the images and boxes of the store in batches, without copying or decoding anything.
+
+		Parameters
+		----------
+		indices : iterable of int, optional
+			The images to feed, in order, for e.g. a shuffled permutation. Defaults to every image.
+		batch_size : int, optional
+			Images per batch.
+
+		Yields
+		------
+		tuple
+			(indices, images, xyxy boxes, labels) of a batch, with one view and one (N, 4) array per image.
+		"""
+		indices = range(len(self)) if indices is None else indices
+		batch = []
+		for i in indices:
+			if self.shapes[i, 0]:
+				batch.append(i)
+			if len(batch) >= batch_size:
+				yield self.batch(batch)
+				batch = []
+		if batch:
+			yield self.batch(batch)
+
+	def batch(self, indices):
+		return (indices, [self.image(i) for i in indices],
+				[self.annotations.image_boxes(i, layout='xyxy') for i in indices],
+				[self.annotations.image_labels(i) for i in indices])
+
+	def toSFrame(self, indices=None):
+		"""
+		Builds an SFrame of the store for Turi Create training.
+
+		The images are attached encoded from their files, a raw copy of the decoded pixels would make the SFrame many
+		times larger than the JPEGs.
+
+		Returns
+		-------
+		SFrame
+			The path, annotations and image columns of the readable images.
+		"""
+		import turicreate as tc
+
+		indices = [i for i in (range(len(self)) if indices is None else indices) if self.shapes[i, 0]]
+		annotations = self.annotations.to_annotations()
+		return tc.SFrame({
+			'path': [self.paths[i] for i in indices],
+			'annotations': tc.SArray([annotations[i] for i in indices], dtype=list),
+			'image': tc.SArray([tc.Image(self.paths[i]) for i in indices], dtype=tc.Image),
+		})
+
+	@staticmethod
+	@instrument.timed('image_store', unit='images')
+	def build(paths, annotation_lists, store_dir, max_side=None, num_threads=8, chunk_size=64):
+		"""
+		Decodes images into a store, which replaces any store already in store_dir once it is complete.
+
+		Images the existing store holds for the same file and max_side are copied over instead of decoded again, so
+		rebuilding after a few samples changed only decodes those. The rebuild still rewrites the whole pixels.bin,
+		copying every unchanged image from the old mapping, as the images are kept in the order of paths.
+
+		Parameters
+		----------
+		paths : iterable of str
+			The image files.
+		annotation_lists : iterable of list of dict
+			The Turi Create annotations of each image, in file coordinates.
+		store_dir : str
+			The <name>.images folder to write.
+		max_side : int, optional
+			If given, images are decoded downscaled to this longest side, and their boxes scaled to match.
+		num_threads : int, optional
+			Threads decoding the images, cv2 releases the GIL while decoding.
+		chunk_size : int, optional
+			Images decoded at a time, which bounds the memory used.
+
+		Returns
+		-------
+		ImageStore
+			The new store, opened.
+		"""
+		paths = list(paths)
+		annotation_lists = [annotations or [] for annotations in annotation_lists]
+		previous = ImageStore.load(store_dir) if os.path.isfile(os.path.join(store_dir, 'index.json')) else None
+		if previous is not None and previous.max_side != max_side:
+			previous = None
+
+		tmp_dir = store_dir + '.tmp'
+		if os.path.isdir(tmp_dir):
+			shutil.rmtree(tmp_dir)
+		os.makedirs(tmp_dir)
+
+		offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+		shapes = np.zeros((len(paths), 3), dtype=np.int32)
+		scales = np.ones((len(paths), 2), dtype=np.float64)
+		files = np.zeros((len(paths), 2), dtype=np.float64)
+		scaled_annotations = []
+
+		def load(path):
+			if not os.path.isfile(path):
+				return None, (1.0, 1.0), (0, 0)
+			stat = os.stat(path)
+			file_stat = (stat.st_size, stat.st_mtime)
+			j = previous.find(path, file_stat) if previous is not None else None
+			if j is not None:
+				return previous.image(j), previous.scale(j), file_stat
+			img, scale = imageCache.decode(path, max_side)
+			return img, scale, file_stat
+
+		pool = ThreadPool(num_threads)
+		try:
+			with open(os.path.join(tmp_dir, 'pixels.bin'), 'wb') as f:
+				for start in range(0, len(paths), chunk_size):
+					chunk = paths[start:start + chunk_size]
+					for i, (img, scale, file_stat) in enumerate(pool.map(load, chunk), start):
+						nbytes = 0
+						if img is not None:
+							if img.ndim == 2:
+								img = img[:, :, None]
+							img = np.ascontiguousarray(img)
+							img.tofile(f)
+							nbytes = img.nbytes
+							shapes[i] = img.shape
+						offsets[i + 1] = offsets[i] + nbytes
+						scales[i] = scale
+						files[i] = file_stat
+						scaled_annotations.append(boxes.scale_annotations(annotation_lists[i], *scale))
+		finally:
+			pool.close()
+			pool.join()
+
+		np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+		np.save(os.path.join(tmp_dir, 'shapes.npy'), shapes)
+		np.save(os.path.join(tmp_dir, 'scales.npy'), scales)
+		np.save(os.path.join(tmp_dir, 'files.npy'), files)
+		AnnotationStore.from_annotations(paths, scaled_annotations).save(os.path.join(tmp_dir, 'annotations'))
+		with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+			json.dump({'paths': paths, 'max_side': max_side}, f)
+		instrument.count(len(paths), int(offsets[-1]))
+
+		# The old mapping stays valid until it is dropped, even once its folder is gone
+		previous = None
+		if os.path.isdir(store_dir):
+			shutil.rmtree(store_dir)
+		os.rename(tmp_dir, store_dir)
+		return ImageStore.load(store_dir)
+
+	@staticmethod
+	def load(store_dir):
+		"""
+		Opens a store written by build. Every array is memory-mapped, so nothing is read until used.
+		"""
+		with open(os.path.join(store_dir, 'index.json'), 'r') as f:
+			index = json.load(f)
+		pixels_path = os.path.join(store_dir, 'pixels.bin')
+		# np.memmap can't map an empty file
+		if os.path.getsize(pixels_path):
+			pixels = np.memmap(pixels_path, dtype=np.uint8, mode='r')
+		else:
+			pixels = np.zeros(0, dtype=np.uint8)
+		return ImageStore(
+			store_dir,
+			index['paths'],
+			pixels,
+			np.load(os.path.join(store_dir, 'offsets.npy'), mmap_mode='r'),
+			np.load(os.path.join(store_dir, 'shapes.npy'), mmap_mode='r'),
+			np.load(os.path.join(store_dir, 'scales.npy'), mmap_mode='r'),
+			np.load(os.path.join(store_dir, 'files.npy'), mmap_mode='r'),
+			AnnotationStore.load(os.path.join(store_dir, 'annotations')),
+			index['max_side']
+		)
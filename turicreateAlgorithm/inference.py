@@ -0,0 +1,342 @@
+"""
+Serves the predictions of a trained object detector.
+
+The model is loaded once and requests are grouped into micro-batches, so model.predict runs on up to max_batch images
+at a time. Two front ends are available:
+
+	python inference.py Playground/model/heavy_aug.model --http 8080
+	python inference.py Playground/model/heavy_aug.model < paths.txt
+
+Over HTTP, POST /predict takes either {"paths": [...]} as json or the bytes of one image, and GET /stats returns the
+latency and throughput so far. On stdin, every line is an image path and every output line the json predictions.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import collections
+import numpy as np
+import cv2
+import turicreate as tc
+
+import imageCache
+from xmlToSFrame import TCHandler
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+try:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+	from socketserver import ThreadingMixIn
+except ImportError:
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+	from SocketServer import ThreadingMixIn
+
+
+class InferenceError(Exception):
+	pass
+
+
+class InferenceTimeout(InferenceError):
+	pass
+
+
+class PredictionRequest(object):
+	def __init__(self, image):
+		"""
+		One image waiting for its predictions.
+		"""
+		self.image = image
+		self.created = time.time()
+		self.done = threading.Event()
+		self.predictions = None
+		self.error = None
+
+	def wait(self, timeout=None):
+		if not self.done.wait(timeout):
+			raise InferenceTimeout("Timed out waiting for the predictions")
+		if self.error is not None:
+			raise InferenceError(self.error)
+		return self.predictions
+
+
+class InferenceHandler(object):
+	def __init__(self, model_path, max_batch=32, max_wait=0.01, confidence_threshold=0.25, latency_window=10000):
+		"""
+		Loads a model once and predicts on micro-batches of the images submitted from any thread.
+
+		A single worker thread takes the first waiting image and then up to max_batch - 1 more, waiting at most max_wait
+		seconds for them, before running model.predict on the batch.
+
+		Parameters
+		----------
+		model_path : str
+			The {model_name}.model folder written by ModelHandler.train.
+		max_batch : int, optional
+			Most images predicted at once.
+		max_wait : float, optional
+			Seconds the first image of a batch waits for others.
+		confidence_threshold : float, optional
+			Predictions less confident than this are dropped.
+		latency_window : int, optional
+			Number of most recent request latencies the percentiles of stats are computed over, so a long running
+			server holds a fixed amount of them.
+		"""
+		self.model = tc.load_model(model_path)
+		self.max_batch = max_batch
+		self.max_wait = max_wait
+		self.confidence_threshold = confidence_threshold
+
+		self.requests = queue.Queue()
+		self.lock = threading.Lock()
+		self.latencies = collections.deque(maxlen=latency_window)
+		self.batches = 0
+		self.images = 0
+		self.started = time.time()
+
+		self.worker = threading.Thread(target=self.serve)
+		self.worker.daemon = True
+		self.worker.start()
+
+	@staticmethod
+	def load_image(image):
+		"""
+		Turns a request into a tc.Image.
+
+		Parameters
+		----------
+		image : str or bytes
+			The path of an image, or the encoded bytes of one. JPEG bytes are used as they are, other formats are
+			decoded and encoded again as a JPEG.
+		"""
+		# Encoded images hold NUL bytes, which no path does
+		if isinstance(image, (bytes, bytearray)) and (b'\0' in image or not os.path.isfile(image)):
+			frame = imageCache.jpeg_frame(io.BytesIO(image))
+			if frame is not None:
+				# A JPEG is passed on still encoded, only its header is read
+				data = bytearray(image)
+				width, height, channels = frame
+				return tc.Image(_image_data=data, _image_data_size=len(data), _height=height, _width=width,
+								_channels=channels, _format_enum=TCHandler.JPG_FORMAT)
+			array = cv2.imdecode(np.frombuffer(bytes(image), dtype=np.uint8), cv2.IMREAD_COLOR)
+			if array is None:
+				raise InferenceError("Could not decode the image bytes")
+			return TCHandler.image_from_array(array)
+		if not os.path.isfile(image):
+			raise InferenceError("No image at {0}".format(image))
+		return tc.Image(image)
+
+	def submit(self, image):
+		"""
+		Queues an image and returns its PredictionRequest right away. Call wait on it for the predictions.
+		"""
+		request = PredictionRequest(image)
+		self.requests.put(request)
+		return request
+
+	def predict(self, images, timeout=None):
+		"""
+		Predicts on a list of image paths or bytes, blocking until all of them are done.
+
+		Returns
+		-------
+		list of list of dict
+			The predictions of each image, in Turi Create annotation format.
+		"""
+		requests = [self.submit(image) for image in images]
+		return [request.wait(timeout) for request in requests]
+
+	def nextBatch(self):
+		"""
+		Blocks for the first request, then collects more until the batch is full or max_wait has passed.
+		"""
+		batch = [self.requests.get()]
+		deadline = time.time() + self.max_wait
+		while len(batch) < self.max_batch:
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				break
+			try:
+				batch.append(self.requests.get(timeout=remaining))
+			except queue.Empty:
+				break
+		return batch
+
+	def serve(self):
+		"""
+		Loop of the worker thread.
+		"""
+		while True:
+			batch = self.nextBatch()
+			ready = []
+			images = []
+			for request in batch:
+				try:
+					images.append(self.load_image(request.image))
+					ready.append(request)
+				except Exception as e:
+					request.error = str(e)
+					request.done.set()
+
+			if ready:
+				try:
+					predictions = self.model.predict(tc.SArray(images, dtype=tc.Image),
+													 confidence_threshold=self.confidence_threshold, verbose=False)
+					for request, prediction in zip(ready, predictions):
+						request.predictions = prediction
+				except Exception as e:
+					for request in ready:
+						request.error = str(e)
+
+			now = time.time()
+			with self.lock:
+				self.batches += 1
+				self.images += len(ready)
+				self.latencies.extend(now - request.created for request in batch)
+			for request in ready:
+				request.done.set()
+
+	def stats(self):
+		"""
+		Returns the number of images and batches served, the images per second since start and the latency percentiles
+		of the last latency_window requests.
+		"""
+		with self.lock:
+			latencies = np.asarray(self.latencies)
+			elapsed = time.time() - self.started
+			stats = {
+				'images': self.images,
+				'batches': self.batches,
+				'mean_batch': self.images / float(self.batches) if self.batches else 0.0,
+				'images_per_s': self.images / elapsed if elapsed else 0.0,
+			}
+		for percentile in (50, 95, 99):
+			stats['latency_p{0}_ms'.format(percentile)] = \
+				float(np.percentile(latencies, percentile)) * 1000 if len(latencies) else 0.0
+		return stats
+
+
+def make_http_handler(inference, timeout=30.0):
+	"""
+	Builds the HTTP request handler class serving an InferenceHandler. A request still waiting for its predictions
+	after timeout seconds is answered with a 504.
+	"""
+	class PredictionHTTPHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path.rstrip('/') != '/stats':
+				return self.reply(404, {'error': 'Unknown path {0}'.format(self.path)})
+			self.reply(200, inference.stats())
+
+		def do_POST(self):
+			if self.path.rstrip('/') != '/predict':
+				return self.reply(404, {'error': 'Unknown path {0}'.format(self.path)})
+			body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+			start = time.time()
+			try:
+				if self.headers.get('Content-Type', '').startswith('application/json'):
+					paths = json.loads(body.decode('utf-8'))['paths']
+					predictions = inference.predict(paths, timeout)
+				else:
+					paths = None
+					predictions = inference.predict([body], timeout)
+			except InferenceTimeout as e:
+				return self.reply(504, {'error': str(e)})
+			except (InferenceError, KeyError, ValueError) as e:
+				return self.reply(400, {'error': str(e)})
+			self.reply(200, {
+				'predictions': predictions if paths is not None else predictions[0],
+				'latency_ms': (time.time() - start) * 1000,
+			})
+
+		def reply(self, status, data):
+			body = json.dumps(data, default=float).encode('utf-8')
+			self.send_response(status)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	return PredictionHTTPHandler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+def serve_http(inference, port=8080, host='127.0.0.1', timeout=30.0):
+	"""
+	Serves POST /predict and GET /stats until interrupted. Every connection has its own thread, so concurrent
+	requests are batched together. A prediction taking longer than timeout seconds fails with a 504.
+	"""
+	server = ThreadingHTTPServer((host, port), make_http_handler(inference, timeout))
+	print("Serving predictions on http://{0}:{1}".format(host, port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+def serve_lines(inference, lines=None, output=None, window=None):
+	"""
+	Predicts on every image path read from lines, and writes one json line per image in the same order.
+
+	Up to window paths are submitted before waiting for the first of them, so the lines are batched as well.
+	"""
+	lines = sys.stdin if lines is None else lines
+	output = sys.stdout if output is None else output
+	window = window or inference.max_batch * 2
+
+	pending = []
+
+	def flush(count):
+		while len(pending) > count:
+			path, request = pending.pop(0)
+			try:
+				result = {'path': path, 'predictions': request.wait()}
+			except InferenceError as e:
+				result = {'path': path, 'error': str(e)}
+			output.write(json.dumps(result, default=float) + '\n')
+			output.flush()
+
+	for line in lines:
+		path = line.strip()
+		if path:
+			pending.append((path, inference.submit(path)))
+			flush(window)
+	flush(0)
+
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description="Serves the predictions of a trained object detector.")
+	parser.add_argument('model', help="The .model folder to serve.")
+	parser.add_argument('--http', type=int, default=None, metavar='PORT', help="Serve over HTTP instead of stdin.")
+	parser.add_argument('--host', default='127.0.0.1', help="Address the HTTP server listens on.")
+	parser.add_argument('--max-batch', type=int, default=32, help="Most images predicted at once.")
+	parser.add_argument('--max-wait', type=float, default=0.01, help="Seconds an image waits for a batch to fill.")
+	parser.add_argument('--confidence', type=float, default=0.25, help="Confidence threshold of the predictions.")
+	parser.add_argument('--timeout', type=float, default=30.0, help="Seconds an HTTP request waits for predictions.")
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+	args = parse_args(argv)
+	inference = InferenceHandler(args.model, args.max_batch, args.max_wait, args.confidence)
+	if args.http is not None:
+		serve_http(inference, args.http, args.host, args.timeout)
+	else:
+		serve_lines(inference)
+		sys.stderr.write(json.dumps(inference.stats()) + '\n')
+
+
+if __name__ == '__main__':
+	main()
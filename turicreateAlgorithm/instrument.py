@@ -0,0 +1,169 @@
+import os
+import csv
+import json
+import time
+import functools
+
+# Columns of the csv report, in order
+FIELDS = ('stage', 'parent', 'start', 'seconds', 'items', 'unit', 'items_per_s', 'bytes', 'mb_per_s')
+
+
+class StageTimer(object):
+	def __init__(self, recorder, name, unit='files'):
+		"""
+		Times one run of a stage and counts the items it processed. Created by Recorder.stage, used as a context
+		manager.
+
+		Parameters
+		----------
+		recorder : Recorder
+			The recorder the result is added to.
+		name : str
+			The name of the stage, for e.g. 'convert'.
+		unit : str, optional
+			What the items counted are, for e.g. 'files' or 'images'.
+		"""
+		self.recorder = recorder
+		self.name = name
+		self.unit = unit
+		self.parent = None
+		self.items = 0
+		self.bytes = 0
+		self.start = None
+		self.seconds = None
+
+	def __enter__(self):
+		self.parent = self.recorder.active[-1].name if self.recorder.active else None
+		self.recorder.active.append(self)
+		self.start = time.time()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.seconds = time.time() - self.start
+		self.recorder.active.remove(self)
+		self.recorder.records.append(self.record())
+		return False
+
+	def add(self, items=0, nbytes=0):
+		"""
+		Counts items (and their bytes) processed by the stage.
+		"""
+		self.items += items
+		self.bytes += nbytes
+
+	def record(self):
+		"""
+		Returns the result of the stage as a dict with the FIELDS keys.
+		"""
+		seconds = self.seconds or 0.0
+		return {
+			'stage': self.name,
+			'parent': self.parent,
+			'start': self.start,
+			'seconds': seconds,
+			'items': self.items,
+			'unit': self.unit,
+			'items_per_s': self.items / seconds if seconds else 0.0,
+			'bytes': self.bytes,
+			'mb_per_s': self.bytes / seconds / (1 << 20) if seconds else 0.0,
+		}
+
+
+class Recorder(object):
+	def __init__(self):
+		"""
+		Collects the timings and counters of the stages of a run.
+
+		Stages can be nested, the result of each records the stage it ran in. Counters always go to the innermost
+		stage running.
+		"""
+		self.active = []
+		self.records = []
+
+	def stage(self, name, unit='files'):
+		"""
+		Returns a context manager timing a stage.
+
+		Examples
+		--------
+		>>> with recorder.stage('convert') as stage:
+		...     stage.add(items=1, nbytes=1024)
+		"""
+		return StageTimer(self, name, unit)
+
+	def timed(self, name, unit='files'):
+		"""
+		Decorator timing every call of a function as a stage.
+		"""
+		def decorator(func):
+			@functools.wraps(func)
+			def wrapper(*args, **kwargs):
+				with self.stage(name, unit):
+					return func(*args, **kwargs)
+			return wrapper
+		return decorator
+
+	def count(self, items=0, nbytes=0):
+		"""
+		Counts items for the innermost stage running. Does nothing outside of a stage.
+		"""
+		if self.active:
+			self.active[-1].add(items, nbytes)
+
+	def reset(self):
+		self.records = []
+
+	def summary(self):
+		"""
+		Prints one line per stage recorded, with its time and rates.
+		"""
+		for record in self.records:
+			line = "\t{stage}: {seconds:.2f}s, {items} {unit} ({items_per_s:.1f}/s)".format(**record)
+			if record['bytes']:
+				line += ", {0:.1f} MB/s".format(record['mb_per_s'])
+			print(line)
+
+	def write(self, output_dir, name=None):
+		"""
+		Writes the records as <name>.json and <name>.csv.
+
+		Parameters
+		----------
+		output_dir : str
+			The directory to write the files in.
+		name : str, optional
+			File name without extension, defaults to run_<timestamp>_<pid>, with a counter appended if this process
+			already wrote a run in the same second.
+
+		Returns
+		-------
+		str
+			The path of the json file.
+		"""
+		if not os.path.isdir(output_dir):
+			os.makedirs(output_dir)
+		if name is None:
+			base = '{0}_{1}'.format(time.strftime('run_%Y%m%d_%H%M%S'), os.getpid())
+			name = base
+			runs = 0
+			while os.path.exists(os.path.join(output_dir, '{0}.json'.format(name))):
+				runs += 1
+				name = '{0}_{1}'.format(base, runs)
+
+		json_path = os.path.join(output_dir, '{0}.json'.format(name))
+		with open(json_path, 'w') as f:
+			json.dump({'stages': self.records}, f, indent=2)
+
+		with open(os.path.join(output_dir, '{0}.csv'.format(name)), 'w') as f:
+			writer = csv.DictWriter(f, fieldnames=FIELDS)
+			writer.writeheader()
+			for record in self.records:
+				writer.writerow(record)
+		return json_path
+
+
+# The recorder of the process, every instrumented function of the pipeline reports to it
+recorder = Recorder()
+stage = recorder.stage
+timed = recorder.timed
+count = recorder.count
@@ -1,4 +1,48 @@
+import argparse
+
 import runner
+import config as cfg
+
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description="Runs the stages of the stack, from ImageNet data to the finalized model. "
+									 "An interrupted augment stage resumes from its last completed shard, the other "
+									 "stages run again.")
+	parser.add_argument('stage', nargs='?', default='all', choices=runner.STAGES + ('all', 'sweep'),
+						help="The stage to run, 'all' runs every stage in order. 'sweep' runs the hyperparameter sweep "
+							 "of the config on the final dataset.")
+	parser.add_argument('--playground', default=cfg.playground_dir, help="Folder the intermediaries are written in.")
+	parser.add_argument('--annotations', default=cfg.annotatations_dir, help="Folder of xml files per label.")
+	parser.add_argument('--images', default=cfg.image_dir, help="Folder of images per label.")
+	parser.add_argument('--sframe-dir', default='sframe', help="Name of the SFrame folder in the playground.")
+	parser.add_argument('--model-dir', default='model', help="Name of the model folder in the playground.")
+	parser.add_argument('--workers', type=int, default=None, help="Processes used to parse and augment.")
+	parser.add_argument('--explore', action='store_true', help="Open the final SFrame once done.")
+	parser.add_argument('--dry-run', action='store_true',
+						help="Only report what the clean stage would remove, without touching any file. No other stage "
+							 "runs.")
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+	args = parse_args(argv)
+	if args.workers is not None:
+		cfg.num_workers = args.workers
+		cfg.aug_workers = args.workers
+	if args.dry_run:
+		cfg.cleanup_dry_run = True
+
+	pipeline = runner.Pipeline(args.playground, args.annotations, args.images, args.sframe_dir, args.model_dir)
+	if cfg.cleanup_dry_run:
+		pipeline.run(('clean',))
+	elif args.stage == 'sweep':
+		pipeline.sweep()
+	else:
+		pipeline.run(runner.STAGES if args.stage == 'all' else (args.stage,))
+
+	if args.explore:
+		pipeline.explore()
+
 
 if __name__ == '__main__':
-	runner.run()
\ No newline at end of file
+	main()
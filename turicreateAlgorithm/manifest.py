@@ -0,0 +1,168 @@
+import os
+import json
+import hashlib
+
+
+class ManifestHandler(object):
+	def __init__(self, manifest_path):
+		"""
+		Keeps track of the input files each pipeline stage has already processed.
+
+		The manifest is a json file mapping a stage name to a snapshot of its inputs, where a snapshot maps every file
+		path to its modification time, size and content hash. The settings a stage ran with, if it records any, are
+		kept under '<stage>.params'.
+
+		Parameters
+		----------
+		manifest_path : str
+			Path to the json file the manifest is stored in.
+		"""
+		self.manifest_path = manifest_path
+		self.stages = self.load()
+
+	def load(self):
+		"""
+		Reads the manifest from disk.
+
+		Returns
+		-------
+		dict
+			Stage name to snapshot, empty if no manifest has been written yet.
+		"""
+		if not os.path.isfile(self.manifest_path):
+			return {}
+		with open(self.manifest_path, 'r') as f:
+			return json.load(f)
+
+	def save(self):
+		"""
+		Writes the manifest to disk, replacing the previous one atomically.
+		"""
+		tmp_path = self.manifest_path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(self.stages, f)
+		os.rename(tmp_path, self.manifest_path)
+
+	def get(self, stage):
+		"""
+		Returns the snapshot recorded for a stage, or None if the stage has never completed.
+		"""
+		return self.stages.get(stage)
+
+	def update(self, stage, snapshot, params=None):
+		"""
+		Records the snapshot a stage has just finished processing, and the settings it ran with, and saves the manifest.
+		"""
+		self.stages[stage] = snapshot
+		if params is None:
+			self.stages.pop(self.params_key(stage), None)
+		else:
+			self.stages[self.params_key(stage)] = params
+		self.save()
+
+	def params_changed(self, stage, params):
+		"""
+		Whether a stage last completed with other settings than params, or without recording any.
+		"""
+		# Compared the way they are read back, tuples becoming lists
+		return self.stages.get(self.params_key(stage)) != json.loads(json.dumps(params))
+
+	@staticmethod
+	def params_key(stage):
+		return '{0}.params'.format(stage)
+
+	def scan_index(self, index, kinds):
+		"""
+		Builds a snapshot from a FileIndex instead of walking the directories again.
+
+		Parameters
+		----------
+		index : FileIndex
+			The index of the run.
+		kinds : tuple of str
+			The kinds of file to include, 'xml' and/or 'image'.
+
+		Returns
+		-------
+		dict
+			File path to [mtime, size, sha1].
+		"""
+		return self.snapshot(index.stats(kinds))
+
+	def snapshot(self, stats):
+		"""
+		Turns (path, size, mtime) triples into a snapshot, only hashing files that aren't already known.
+		"""
+		known = {}
+		for stage, snapshot in self.stages.items():
+			# The settings of a stage are no file entries
+			if not stage.endswith(self.params_key('')):
+				known.update(snapshot)
+
+		snapshot = {}
+		for path, size, mtime in stats:
+			entry = known.get(path)
+			if entry and entry[0] == mtime and entry[1] == size:
+				snapshot[path] = entry
+			else:
+				snapshot[path] = [mtime, size, ManifestHandler.hash_file(path)]
+		return snapshot
+
+	@staticmethod
+	def hash_file(path, block_size=1 << 20):
+		"""
+		Calculates the sha1 of a file, reading it in blocks.
+
+		Parameters
+		----------
+		path : str
+			The file to hash.
+		block_size : int, optional
+			Number of bytes read at a time.
+
+		Returns
+		-------
+		str
+			Hex digest of the file contents.
+		"""
+		sha1 = hashlib.sha1()
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(block_size), b''):
+				sha1.update(block)
+		return sha1.hexdigest()
+
+	@staticmethod
+	def diff(old, new):
+		"""
+		Compares two snapshots by content hash.
+
+		Parameters
+		----------
+		old : dict
+			The snapshot the stage processed last time.
+		new : dict
+			The current snapshot.
+
+		Returns
+		-------
+		dict
+			Sorted lists of 'added', 'changed' and 'removed' file paths.
+		"""
+		return {
+			'added': sorted(path for path in new if path not in old),
+			'changed': sorted(path for path in new if path in old and old[path][2] != new[path][2]),
+			'removed': sorted(path for path in old if path not in new),
+		}
+
+	@staticmethod
+	def changed_stems(diff):
+		"""
+		Collects the file names without extension of every added, changed or removed file.
+
+		Annotation and image files share the same stem, so this is the set of samples that need to be rebuilt.
+		"""
+		stems = set()
+		for paths in diff.values():
+			for path in paths:
+				stems.add(os.path.splitext(os.path.basename(path))[0])
+		return stems
@@ -1,7 +1,12 @@
 import turicreate as tc
 import os as os
 
-from tc_runner.utils import Utils
+from utils import Utils
+from xmlToSFrame import TCHandler
+from annotationStore import AnnotationStore
+import split
+import evaluation
+import instrument
 
 class SFrameException(Exception):
 	pass
@@ -12,38 +17,60 @@ class ModelHandler(object):
 		pass
 
 	@staticmethod
-	def train(sframe_dir, model_dir, train_test_split=0.8, max_iterations=5000, model_name='mymodel'):
+	@instrument.timed('train', unit='images')
+	def train(sframe_dir, model_dir, train_test_split=0.8, max_iterations=5000, model_name='mymodel', seed=0,
+			  store_dir=None):
 		"""
 		Trains a model using the SFrame.
 
 		Parameters
 		----------
 		sframe_dir: str
-			The folder path containing the SFrame.
+			The path of the SFrame, or of a sharded dataset, see TCHandler.load_dataset.
 		model_dir: str
 			The folder path to write the model files in.
 		train_test_split: float, optional
-			The ratio of training data to testing data.			
+			The ratio of training data to testing data. The split is seeded, stratified by label and keeps augmented
+			copies on the side of their source image, see split.py. The stems of each side are saved as split.json.
 		max_iterations: int, optional
 			Number of iterations to train the model.
 		model_name: str, optional
 			The name of the model file (to be written).
+		seed: int, optional
+			Seed of the train/test split.
+		store_dir: str, optional
+			The AnnotationStore the split is computed from. Defaults to original.annotations next to the SFrame, or
+			to the annotations of the SFrame itself if there is none.
 		"""
 		# for file in os.listdir(sframe_dir):
 		# 	if file.endswith('.sframe'):
 		# 		data = tc.SFrame(os.path.join(sframe_dir, file))
 
-		data = tc.SFrame(os.path.join(sframe_dir))
+		data = TCHandler.load_dataset(sframe_dir)
 
-		train_data, test_data = data.random_split(train_test_split)
+		if store_dir is None:
+			store_dir = os.path.join(os.path.dirname(os.path.normpath(sframe_dir)), 'original.annotations')
+		store = AnnotationStore.load(store_dir) if os.path.isdir(store_dir) else None
+
+		if store is not None:
+			# Counted from the columnar store, the annotation lists of the SFrame aren't read
+			stats = store.stats()
+			print("Source images: {images}, boxes: {boxes}, without boxes: {empty_images}".format(**stats))
+		train_data, test_data, assignment = split.train_test_split(data, store, train_test_split, seed)
+		split.write_split(assignment, model_dir)
+		instrument.count(len(train_data))
 		model = tc.object_detector.create(train_data, feature='image', annotations='annotations', max_iterations=max_iterations)
-		# Save predictions to an SArray
-		predictions = model.predict(test_data)
+		# Save predictions to an SArray, down to a low confidence so the precision-recall curves are complete
+		predictions = model.predict(test_data, confidence_threshold=evaluation.MIN_CONFIDENCE)
 
-		# Evaluate the model and save the results into a dictionary
-		metrics = model.evaluate(test_data)
+		# Evaluate the predictions above and save the results into a dictionary, without predicting again
+		metrics = evaluation.evaluate(test_data['annotations'], predictions)
+		print("mAP@50 {0:.4f}, mAP@[.5:.95] {1:.4f}".format(metrics['mean_average_precision_50'],
+															metrics['mean_average_precision']))
 
 		#Save performance metrics
+		if store is not None:
+			metrics['dataset'] = stats
 		Utils.write_as_pckl(metrics, "metrics", model_dir)
 
 		# Save the model for later use in Turi Create
@@ -52,6 +79,37 @@ class ModelHandler(object):
 		# Export for use in Core ML
 		model.export_coreml(os.path.join(model_dir, '{0}.mlmodel'.format(model_name)))
 
+	@staticmethod
+	def score(model_dir, images_dir, output_path, model_name='mymodel', chunk_size=256, num_threads=8,
+			  confidence_threshold=0.25, max_side=None):
+		"""
+		Scores every image of a directory tree chunk by chunk, with constant memory, and resumes an interrupted job.
+
+		Parameters
+		----------
+		model_dir: str
+			The folder path containing the model files.
+		images_dir: str
+			The directory tree of images to score.
+		output_path: str
+			A .jsonl file, or the <name>.shards folder of a sharded dataset, see scoring.scoreDirectory.
+		model_name: str, optional
+			The filename of the written model.
+		chunk_size: int, optional
+			Number of images decoded and predicted at a time.
+		num_threads: int, optional
+			Number of threads decoding the images.
+		confidence_threshold: float, optional
+			Predictions less confident than this are dropped.
+		max_side: int, optional
+			Decode images downscaled to this longest side.
+		"""
+		import scoring
+
+		model = tc.load_model(os.path.join(model_dir, '{0}.model'.format(model_name)))
+		return scoring.scoreDirectory(model, images_dir, output_path, chunk_size, num_threads, confidence_threshold,
+									  max_side)
+
 	@staticmethod
 	def visualize_results(model_dir, test_images_dir, model_name='mymodel'):
 		"""
@@ -68,9 +126,9 @@ class ModelHandler(object):
 		"""
 		model = tc.load_model(os.path.join(model_dir, '{0}.model'.format(model_name)))
 
-		sf_images = tc.image_analysis.load_images(test_images_dir, recursive=True, random_order=True)
-		sf_test = tc.SFrame({'image': [tc.Image(path) for path in sf_images['path']]})
-		sf_test['predictions'] = model.predict(test, confidence_threshold=0.2)
+		# For scoring outside of a quick look, see inference.py
+		sf_test = tc.image_analysis.load_images(test_images_dir, recursive=True)
+		sf_test['predictions'] = model.predict(sf_test, confidence_threshold=0.2)
 
 		sf_test['image_with_predictions'] = tc.object_detector.util.draw_bounding_boxes(sf_test['image'], sf_test['predictions'])
 		sf_test[['image', 'predictions', 'image_with_predictions']].explore()
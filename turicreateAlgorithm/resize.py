@@ -0,0 +1,146 @@
+import os
+import multiprocessing
+import numpy as np
+import cv2
+
+import boxes
+import instrument
+from imageCache import jpeg_size, reduced_flag
+
+
+def resize_image(img, width, height, letterbox=True, pad_value=0):
+	"""
+	Resizes an image to width x height.
+
+	Parameters
+	----------
+	img : numpy.ndarray
+		The BGR uint8 image.
+	width : int
+		Target width.
+	height : int
+		Target height.
+	letterbox : bool, optional
+		If true, the aspect ratio is kept and the image is centered on a pad_value canvas. Otherwise it is stretched.
+	pad_value : int, optional
+		Value of the letterbox borders.
+
+	Returns
+	-------
+	tuple
+		The resized image and the (sx, sy, dx, dy) transform applied to its pixel coordinates: x' = x * sx + dx.
+	"""
+	img_height, img_width = img.shape[:2]
+	if not letterbox:
+		sx, sy = width / float(img_width), height / float(img_height)
+		interpolation = cv2.INTER_AREA if sx < 1 and sy < 1 else cv2.INTER_LINEAR
+		return cv2.resize(img, (width, height), interpolation=interpolation), (sx, sy, 0, 0)
+
+	ratio = min(width / float(img_width), height / float(img_height))
+	new_width = max(int(round(img_width * ratio)), 1)
+	new_height = max(int(round(img_height * ratio)), 1)
+	interpolation = cv2.INTER_AREA if ratio < 1 else cv2.INTER_LINEAR
+	resized = cv2.resize(img, (new_width, new_height), interpolation=interpolation)
+
+	dx = (width - new_width) // 2
+	dy = (height - new_height) // 2
+	canvas = np.full((height, width) + img.shape[2:], pad_value, dtype=img.dtype)
+	canvas[dy:dy + new_height, dx:dx + new_width] = resized
+	return canvas, (new_width / float(img_width), new_height / float(img_height), dx, dy)
+
+
+def transform_annotations(annotations, sx, sy, dx=0, dy=0):
+	"""
+	Applies the transform returned by resize_image to Turi Create annotations.
+	"""
+	cxcywh, labels = boxes.from_annotations(annotations)
+	cxcywh = boxes.scale(cxcywh, sx, sy)
+	cxcywh[:, 0] += dx
+	cxcywh[:, 1] += dy
+	return boxes.to_annotations(cxcywh, labels)
+
+
+def resize_sample(job):
+	"""
+	Resizes one image and its annotations. Used as the process pool entry point, so it has to live at module level.
+
+	Parameters
+	----------
+	job : tuple
+		(image path, annotations, output_dir, width, height, letterbox).
+
+	Returns
+	-------
+	tuple
+		The path of the resized image and its annotations. The source is returned unchanged if it can't be read.
+	"""
+	path, annotations, output_dir, width, height, letterbox = job
+
+	# Decode at the largest JPEG reduction that still covers the target, the resize does the rest
+	size = jpeg_size(path) if os.path.isfile(path) else None
+	if size is not None:
+		ratio = min(width / float(size[0]), height / float(size[1])) if letterbox else None
+		min_width = int(size[0] * ratio) if letterbox else width
+		min_height = int(size[1] * ratio) if letterbox else height
+		img = cv2.imread(path, reduced_flag(size, min_width, min_height))
+	else:
+		img = cv2.imread(path)
+	if img is None:
+		return path, annotations
+	if size is None:
+		size = (img.shape[1], img.shape[0])
+
+	resized, (sx, sy, dx, dy) = resize_image(img, width, height, letterbox)
+	# The transform is relative to the decoded image, the annotations are relative to the file
+	sx *= img.shape[1] / float(size[0])
+	sy *= img.shape[0] / float(size[1])
+
+	resized_path = os.path.join(output_dir, os.path.basename(path))
+	cv2.imwrite(resized_path, resized)
+	return resized_path, transform_annotations(annotations, sx, sy, dx, dy)
+
+
+@instrument.timed('resize', unit='images')
+def resizeData(data, output_dir, size, letterbox=True, num_workers=1, chunk_size=64, pool=None):
+	"""
+	Resizes the images of buffered SFrame rows and rescales their annotations, in place.
+
+	Parameters
+	----------
+	data : dict
+		Rows with the lists 'path' and 'annotations'. Both lists are replaced by the resized paths and annotations.
+	output_dir : str
+		The directory the resized images are written in, named like their source.
+	size : tuple
+		(width, height) of the resized images.
+	letterbox : bool, optional
+		Keep the aspect ratio and pad, see resize_image.
+	num_workers : int, optional
+		Number of processes resizing. A value of 1 resizes everything in the current process.
+	chunk_size : int, optional
+		Number of images handed to a worker at a time.
+	pool : multiprocessing.Pool, optional
+		A pool to resize in, for e.g. the one createSFrame parses with, so a caller flushing rows in batches doesn't
+		start a pool per batch. If not given, one is started for this call when num_workers > 1.
+	"""
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	width, height = size
+	jobs = [(path, annotations, output_dir, width, height, letterbox)
+			for path, annotations in zip(data['path'], data['annotations'])]
+
+	if pool is not None:
+		results = pool.map(resize_sample, jobs, chunksize=chunk_size)
+	elif num_workers > 1 and len(jobs) > chunk_size:
+		pool = multiprocessing.Pool(num_workers)
+		try:
+			results = pool.map(resize_sample, jobs, chunksize=chunk_size)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		results = [resize_sample(job) for job in jobs]
+
+	data['path'][:] = [path for path, _ in results]
+	data['annotations'][:] = [annotations for _, annotations in results]
+	instrument.count(len(results))
@@ -1,84 +1,414 @@
 import os
+import json
+import shutil
 from utils import Utils
-from validateData import cleanData
+from validateData import cleanData, sync_files
 from dataaug import augmentData
+from manifest import ManifestHandler
+from fileIndex import FileIndex
+from checkpoint import CheckpointHandler
 import config as cfg
+import instrument
+import imageCache
 import xmlToSFrame as converter
+import annotationQuality
 
-def run(sframe_dir='sframe', config=True):
+STAGES = ('clean', 'scan', 'convert', 'augment', 'train')
+
+
+def prepare_stage(manifest, stage, stage_dir, checkpoint=None, params=None):
+	"""
+	Creates the output directory of a stage and looks up what the stage processed last time.
+
+	A directory that already exists but has no manifest entry was left behind by an older or interrupted run, so it
+	is emptied instead of being reused, unless the checkpoint of the stage shows it can be resumed. So is one written
+	with other settings than params.
+
+	Parameters
+	----------
+	manifest: ManifestHandler
+		The manifest of the playground directory.
+	stage: str
+		The name of the stage, for e.g. 'convert'.
+	stage_dir: str
+		The output directory of the stage.
+	checkpoint: CheckpointHandler, optional
+		The checkpoint of the stage. If it was interrupted, the directory is kept so the stage picks up where it
+		stopped.
+	params: dict, optional
+		The settings the output of the stage depends on, recorded with ManifestHandler.update.
+
+	Returns
+	-------
+	dict or None
+		The snapshot of the inputs the stage last completed with, or None if the stage has to run from scratch.
+	"""
+	if Utils.make_dir(stage_dir):
+		return None
+
+	previous = manifest.get(stage)
+	if params is not None and manifest.params_changed(stage, params):
+		if previous is not None and checkpoint is not None:
+			# An interrupted run with other settings can't be resumed over the output of the last one
+			checkpoint.clear()
+		previous = None
+	if checkpoint is not None and checkpoint.is_running():
+		print("\nRESUMING INTERRUPTED {0} STAGE...\n".format(stage.upper()))
+	elif previous is None:
+		print("\nSTALE {0} FOUND, REBUILDING...\n".format(stage_dir))
+		shutil.rmtree(stage_dir)
+		os.makedirs(stage_dir)
+	return previous
+
+
+def load_exclusions(path):
+	"""
+	Returns the exclusions a stage recorded at path, or None if it never recorded any.
+	"""
+	if not os.path.isfile(path):
+		return None
+	with open(path, 'r') as f:
+		return json.load(f)
+
+
+def changed_exclusions(previous, current):
+	"""
+	Returns the stems whose exclusion differs between two exclusion records, see Pipeline.exclusions.
+	"""
+	return set(stem for stem in set(previous) | set(current) if previous.get(stem) != current.get(stem))
+
+
+def get_dirs(config=True):
+	"""
+	Returns the playground, annotations and image directories, from the config file or prompted for.
+	"""
+	if config:
+		return cfg.playground_dir, cfg.annotatations_dir, cfg.image_dir
+
+	playground_dir = input("Playground Directory: ").strip()
+	annotatations_dir = input("Annotations Directory (this can be unclean): ").strip()
+	image_dir = input("Images Directory (this can be unclean): ").strip()
+	return playground_dir, annotatations_dir, image_dir
+
+
+class Pipeline(object):
+	def __init__(self, playground_dir, annotatations_dir, image_dir, sframe_dir='sframe', model_dir='model'):
+		"""
+		The stages of the stack, from ImageNet data to the finalized model, run one at a time.
+
+		Every stage writes into its own folder of the playground directory. A manifest of the input files keeps track
+		of what each stage completed with, so a rerun only processes the files that were added, changed or removed.
+		A checkpoint per stage, in playground/checkpoints, records a stage that is under way, so an interrupted stage
+		isn't mistaken for complete. Only augment resumes from its last completed shard, the other stages swap their
+		output in once it is complete and simply run again.
+
+		Parameters
+		----------
+		playground_dir: str
+			The folder the intermediaries and the model are written in.
+		annotatations_dir: str
+			Directory holding a folder of xml files per label, can be unclean.
+		image_dir: str
+			Directory holding a folder of images per label, can be unclean.
+		sframe_dir: str, optional
+			The name of the auto-generated folder that contains the SFrame files.
+		model_dir: str, optional
+			The name of the auto-generated folder that contains the model files.
+		"""
+		self.playground_dir = playground_dir
+		self.annotatations_dir = annotatations_dir
+		self.image_dir = image_dir
+		self.allImages_dir = os.path.join(playground_dir, "allImages")
+		self.sframe_dir = os.path.join(playground_dir, sframe_dir)
+		self.allAugmentedImages_dir = os.path.join(playground_dir, "allAugmentedImages")
+		self.allResizedImages_dir = os.path.join(playground_dir, "allResizedImages")
+		self.model_dir = os.path.join(playground_dir, model_dir)
+		self.checkpoint_dir = os.path.join(playground_dir, "checkpoints")
+		self.metrics_dir = os.path.join(playground_dir, "metrics")
+		self.quality_report = os.path.join(playground_dir, "quality_report.json")
+		self.cleanup_report = os.path.join(playground_dir, "cleanup_report.json")
+		self.image_store_dir = os.path.join(self.sframe_dir, "original.images") if cfg.image_store else None
+
+		Utils.make_dir(playground_dir)
+		# Configured before any worker is forked, so the workers share the settings
+		imageCache.configure(cfg.decode_cache_bytes, cfg.decode_cache_dir, cfg.decode_max_side, self.image_store_dir,
+							 cfg.decode_cache_disk_bytes)
+		self.manifest = ManifestHandler(os.path.join(playground_dir, 'manifest.json'))
+		# Listed once, every stage below queries this index instead of walking the directories again
+		self.index = FileIndex(annotatations_dir, image_dir)
+		self._samples = None
+
+	def samples(self):
+		"""
+		Snapshot of the cleaned annotation/image pairs, which the conversion, augmentation and training work on.
+
+		allImages_dir mirrors image_dir (and holds no files at all with the 'manifest' copy strategy), so the source
+		images are scanned.
+		"""
+		if self._samples is None:
+			self._samples = self.manifest.scan_index(self.index, ('xml', 'image'))
+		return self._samples
+
+	def checkpoint(self, stage):
+		return CheckpointHandler(self.checkpoint_dir, stage)
+
+	def run(self, stages=STAGES):
+		"""
+		Runs the given stages in pipeline order.
+
+		The time spent in each stage and its throughput are written to playground/metrics as run_<timestamp>_<pid>.json
+		and .csv, also when a stage fails.
+
+		Returns
+		-------
+		str
+			The path of the json metrics file.
+		"""
+		instrument.recorder.reset()
+		try:
+			for stage in STAGES:
+				if stage in stages:
+					getattr(self, stage)()
+		finally:
+			print("\nSTAGE TIMINGS\n")
+			instrument.recorder.summary()
+			metrics_path = instrument.recorder.write(self.metrics_dir)
+		return metrics_path
+
+	def clean(self):
+		"""
+		Drops the unpaired annotations and images, and mirrors the images into allImages.
+
+		With cleanup_dry_run set in the config, only the cleanup plan is reported and no file is touched.
+		"""
+		if cfg.cleanup_dry_run:
+			print("\nPLANNING CLEANUP (DRY RUN)...\n")
+			cleanData(self.annotatations_dir, self.image_dir, self.allImages_dir, index=self.index, dry_run=True,
+					  report_path=self.cleanup_report)
+			return
+
+		checkpoint = self.checkpoint('clean')
+		previous = prepare_stage(self.manifest, 'clean', self.allImages_dir)
+		checkpoint.start({})
+		if previous is None:
+			print("\nCLEANING DATA...\n")
+			cleanData(self.annotatations_dir, self.image_dir, self.allImages_dir, strategy=cfg.copy_strategy,
+					  num_threads=cfg.copy_threads, index=self.index, quarantine_dir=cfg.quarantine_dir,
+					  report_path=self.cleanup_report)
+			snapshot = self.manifest.scan_index(self.index, ('image',))
+		else:
+			print("\nUPDATING CLEANED DATA FROM PREV RUN...\n")
+			cleanData(self.annotatations_dir, self.image_dir, self.allImages_dir, copy=False,
+					  num_threads=cfg.copy_threads, index=self.index, quarantine_dir=cfg.quarantine_dir,
+					  report_path=self.cleanup_report)
+			snapshot = self.manifest.scan_index(self.index, ('image',))
+			sync_files(ManifestHandler.diff(previous, snapshot), self.allImages_dir, cfg.copy_strategy,
+					   cfg.copy_threads)
+		self.manifest.update('clean', snapshot)
+		checkpoint.finish()
+
+	def scan(self):
+		"""
+		Checks the boxes of the cleaned samples against their images and finds near-duplicate images, see
+		annotationQuality.py. Writes playground/quality_report.json, which the conversion filters with.
+		"""
+		# The report depends on the scan settings as much as on the samples
+		params = {'tolerance': cfg.quality_tolerance, 'max_distance': cfg.quality_max_distance}
+		up_to_date = self.manifest.get('scan') == self.samples() and not self.manifest.params_changed('scan', params)
+		if up_to_date and os.path.isfile(self.quality_report):
+			print("\nQUALITY REPORT FOUND...\n")
+			return
+
+		print("\nSCANNING ANNOTATIONS...\n")
+		annotationQuality.scanAnnotations(index=self.index, num_workers=cfg.num_workers, chunk_size=cfg.chunk_size,
+										  tolerance=cfg.quality_tolerance, max_distance=cfg.quality_max_distance,
+										  report_path=self.quality_report)
+		self.manifest.update('scan', self.samples(), params)
+
+	def exclusions(self):
+		"""
+		The samples and boxes the quality report leaves out of the SFrame, None unless quality_filter is set.
+		"""
+		if not cfg.quality_filter or not os.path.isfile(self.quality_report):
+			return None
+		return annotationQuality.exclusions(annotationQuality.load_report(self.quality_report),
+										   cfg.quality_drop_duplicates)
+
+	def convert(self):
+		"""
+		Converts the xml annotations into the original SFrame, or updates it with the samples that changed.
+		"""
+		checkpoint = self.checkpoint('convert')
+		params = self.convert_params()
+		previous = prepare_stage(self.manifest, 'convert', self.sframe_dir, params=params)
+		stems = None if previous is None else ManifestHandler.changed_stems(ManifestHandler.diff(previous, self.samples()))
+
+		if self.image_store_dir and not os.path.isdir(self.image_store_dir):
+			# The store is built along with the SFrame, so an SFrame converted without one is converted again
+			stems = None
+
+		exclude = self.exclusions()
+		exclude_path = os.path.join(self.sframe_dir, 'exclusions.json')
+		previous_exclude = load_exclusions(exclude_path)
+		if stems is not None and previous_exclude is not None:
+			# Samples whose exclusion changed are converted again, even though their files didn't
+			stems = set(stems) | changed_exclusions(previous_exclude, exclude or {})
+
+		# The SFrame is only swapped in once it is complete, so an interrupted conversion simply runs again
+		checkpoint.start({})
+		if stems is None:
+			print("\nCONVERTING XML ANNOTATIONS TO SFRAME...\n")
+			converter.createSFrame(self.annotatations_dir, self.allImages_dir, self.sframe_dir,
+								   num_workers=cfg.num_workers, chunk_size=cfg.chunk_size, streaming=cfg.streaming,
+								   batch_size=cfg.batch_size, index=self.index, resize=cfg.resize_to,
+								   letterbox=cfg.letterbox, resize_dir=self.allResizedImages_dir, exclude=exclude,
+								   image_store=self.image_store_dir, store_max_side=cfg.decode_max_side)
+			print()
+		elif stems:
+			print("\nUPDATING {0} SAMPLES IN SFRAME...\n".format(len(stems)))
+			converter.createSFrame(self.annotatations_dir, self.allImages_dir, self.sframe_dir,
+								   num_workers=cfg.num_workers, chunk_size=cfg.chunk_size, streaming=cfg.streaming,
+								   batch_size=cfg.batch_size, stems=stems, index=self.index, resize=cfg.resize_to,
+								   letterbox=cfg.letterbox, resize_dir=self.allResizedImages_dir, exclude=exclude,
+								   image_store=self.image_store_dir, store_max_side=cfg.decode_max_side)
+			print()
+		else:
+			print("\nSFRAME FOUND...\n")
+		with open(exclude_path, 'w') as f:
+			json.dump(exclude or {}, f)
+		# The store may have been rebuilt, the next read maps the new one
+		imageCache.cache.closeStore()
+		self.manifest.update('convert', self.samples(), params)
+		checkpoint.finish()
+
+	def convert_params(self):
+		"""
+		The settings the original SFrame depends on, and so every stage after the conversion.
+		"""
+		return {'resize_to': cfg.resize_to, 'letterbox': cfg.letterbox, 'decode_max_side': cfg.decode_max_side}
+
+	def augment_params(self):
+		"""
+		The settings the augmented dataset depends on.
+
+		Other settings change every augmentation, and fewer per_image would leave the extra ones behind. The images are
+		augmented as the conversion resized them, so its settings count too.
+		"""
+		return dict(self.convert_params(), per_image=cfg.aug_per_image, seed=cfg.aug_seed,
+					in_memory=cfg.aug_in_memory, batch_size=cfg.aug_batch_size)
+
+	def augment(self):
+		"""
+		Augments the original SFrame and writes the augmented and final SFrames. Resumes from the last completed shard.
+		"""
+		checkpoint = self.checkpoint('augment')
+		params = self.augment_params()
+		previous = prepare_stage(self.manifest, 'augment', self.allAugmentedImages_dir, checkpoint, params)
+		stems = None if previous is None else ManifestHandler.changed_stems(ManifestHandler.diff(previous, self.samples()))
+
+		# The exclusions the original SFrame was converted with, against the ones the augmentations were made from
+		exclude = load_exclusions(os.path.join(self.sframe_dir, 'exclusions.json')) or {}
+		exclude_path = os.path.join(self.allAugmentedImages_dir, 'exclusions.json')
+		previous_exclude = load_exclusions(exclude_path)
+		if stems is not None:
+			# Samples whose exclusion changed are augmented again, without a record all of them are
+			stems = None if previous_exclude is None else set(stems) | changed_exclusions(previous_exclude, exclude)
+
+		# Shards of an interrupted run are only reused if the original SFrame wasn't converted again since
+		identity = CheckpointHandler.digest([json.dumps([self.manifest.get('convert'), params, exclude],
+														 sort_keys=True)])
+		if stems is None:
+			print("\nGENERATING AUGMENTATIONS\n")
+			augmentData(self.sframe_dir, self.allAugmentedImages_dir, num_workers=cfg.aug_workers,
+						shard_size=cfg.aug_shard_size, seed=cfg.aug_seed, batch_size=cfg.aug_batch_size,
+						per_image=cfg.aug_per_image, in_memory=cfg.aug_in_memory, checkpoint=checkpoint,
+						identity=identity)
+			print()
+		elif stems:
+			print("\nUPDATING AUGMENTATIONS FOR {0} SAMPLES\n".format(len(stems)))
+			augmentData(self.sframe_dir, self.allAugmentedImages_dir, stems, cfg.aug_workers, cfg.aug_shard_size,
+						cfg.aug_seed, cfg.aug_batch_size, cfg.aug_per_image, cfg.aug_in_memory, checkpoint, identity)
+			print()
+		else:
+			print("\nUSING AUGMENTED DATA FROM PREV RUN...\n")
+		with open(exclude_path, 'w') as f:
+			json.dump(exclude, f)
+		self.manifest.update('augment', self.samples(), params)
+
+	def train(self, training_sFrame=None):
+		"""
+		Trains the model on the final SFrame, unless it was already trained on the current samples with the same
+		settings.
+
+		Parameters
+		----------
+		training_sFrame: str, optional
+			The SFrame to train on, defaults to the final SFrame of the playground.
+		"""
+		# Imported here so the data stages don't pay for setting up the model
+		from model import ModelHandler
+
+		training_sFrame = training_sFrame or os.path.join(self.sframe_dir, 'final.shards')
+		model_path = os.path.join(self.model_dir, '{0}.model'.format(cfg.model_name))
+		checkpoint = self.checkpoint('train')
+		Utils.make_dir(self.model_dir)
+
+		# The model depends on the training settings and on the data it was trained on as much as on the samples
+		params = {'model_name': cfg.model_name, 'max_iterations': cfg.max_iterations, 'split_seed': cfg.split_seed,
+				  'train_test_split': cfg.train_test_split, 'dataset': training_sFrame,
+				  'augment': self.augment_params()}
+		up_to_date = self.manifest.get('train') == self.samples() and not self.manifest.params_changed('train', params)
+		if up_to_date and os.path.exists(model_path) and not checkpoint.is_running():
+			print("\nMODEL FOUND...\n")
+			return
+
+		print("\nTRAINING...\n")
+		checkpoint.start({'model_name': cfg.model_name, 'max_iterations': cfg.max_iterations, 'seed': cfg.split_seed})
+		ModelHandler()
+		ModelHandler.train(training_sFrame, self.model_dir, cfg.train_test_split, cfg.max_iterations, cfg.model_name,
+						   cfg.split_seed)
+		self.manifest.update('train', self.samples(), params)
+		checkpoint.finish()
+
+	def sweep(self, dataset=None):
+		"""
+		Runs the hyperparameter sweep of the config on the final dataset, into playground/sweep.
+		"""
+		from sweep import SweepHandler
+
+		print("\nSWEEPING...\n")
+		handler = SweepHandler(os.path.join(self.playground_dir, 'sweep'), cfg.sweep_workers, cfg.sweep_threads,
+							   cfg.sweep_rungs, cfg.sweep_eta, cfg.split_seed, cfg.train_test_split)
+		return handler.run(dataset or os.path.join(self.sframe_dir, 'final.shards'), cfg.sweep_grid,
+						   cfg.max_iterations)
+
+	def explore(self, dataset='final.shards'):
+		converter.explore(os.path.join(self.sframe_dir, dataset))
+
+
+def run(sframe_dir='sframe', config=True, stages=('clean', 'scan', 'convert', 'augment'), explore=False):
 	"""
 	Runs the full stack starting with ImageNet data to the finalized model.
 
-	This function will ask the user to input a playground directory, annotations directory, image directory, and a testing images directory. It will generate several folders in the playground directory containing intermediaries of the results: pickled versions of annotation data, the SFrame, and the finalized model.
+	This function will ask the user to input a playground directory, annotations directory, and image directory unless they are read from the config file. It will generate several folders in the playground directory containing intermediaries of the results: the cleaned images, the SFrames, the augmented images, and the finalized model.
+
+	A manifest of every input file is kept in the playground directory, so a rerun only processes the files that were added, changed or removed since the stage last completed. An interrupted augmentation resumes from its last completed shard, the other stages run again.
 
 	Parameters
 	----------
-	pickle_dir: str, optional
-		The name of the auto-generated folder that contains the pickle files.
 	sframe_dir: str
 		The name of the auto-generated folder that contains the SFrame file.
-	model_dir: float, optional
-		The name of the auto-generated folder that contains the model files.
 	config: bool, optional
 		If true, then will grab directory data from a config file. Otherwise, will prompt the user during runtime.
+	stages: tuple of str, optional
+		The stages to run, out of 'clean', 'scan', 'convert', 'augment' and 'train'.
+	explore: bool, optional
+		If true, opens the final SFrame in the Turi Create explorer once done.
 	"""
-
-	if config:
-		playground_dir = cfg.playground_dir 
-		annotatations_dir = cfg.annotatations_dir 
-		image_dir = cfg.image_dir if config else None
-	else:
-		playground_dir = input("Playground Directory: ").strip()
-		annotatations_dir = input("Annotations Directory (this can be unclean): ").strip()
-		image_dir = input("Images Directory (this can be unclean): ").strip()
-
-	#Clean the Data
-	allImages_dir = os.path.join(playground_dir, "allImages")
-	allImages_created = Utils.make_dir(allImages_dir)
-	if allImages_created:
-		print("\nCLEANING DATA...\n")
-		cleanData(annotatations_dir, image_dir, allImages_dir)
-	else:
-		print("\nUSING CLEANED DATA FROM PREV RUN...\n")
-
-	sframe_dir = os.path.join(playground_dir, sframe_dir)
-	sframe_created = Utils.make_dir(sframe_dir)
-
-	if sframe_created:
-		print("\nCONVERTING XML ANNOTATIONS TO SFRAME...\n")
-		converter.createSFrame(annotatations_dir, allImages_dir, sframe_dir)
-		print()
-	else:
-		print("\nSFRAME FOUND...\n")
-
-	# Augmenting the data
-	allAugmentedImages_dir = os.path.join(playground_dir, "allAugmentedImages")
-	allAugmentedImages_created = Utils.make_dir(allAugmentedImages_dir)
-	if allAugmentedImages_created:
-		print("\nGENERATING AUGMENTATIONS\n")
-		augmentData(sframe_dir, allAugmentedImages_dir)
-		print()
-	else:
-		print("\nUSING AUGMENTED DATA FROM PREV RUN...\n")
+	playground_dir, annotatations_dir, image_dir = get_dirs(config)
+	pipeline = Pipeline(playground_dir, annotatations_dir, image_dir, sframe_dir)
+	pipeline.run(stages)
 
 	#explore the dataset if requested
-	if True:
-		explore_req = raw_input("Explore a sFrame? (y/n)")
-		if explore_req == 'y':
-			converter.explore(config.training_sFrame)
-
-	# print("\nLET'S BEGIN TRAINING...\n")
-	# #Begin training
-	# training_sFrame = cfg.training_sFrame if CONFIG else input("Which sFrame directory would you like to train on?: ").strip()
-	# model_dir = os.path.join(playground_dir, model_dir)
-	# Utils.make_dir(model_dir) #Will always write into the same folder, even if it exists...
-
-	# train_test_split = cfg.train_test_split if CONFIG else float(input("Train test split (from 0-1): ").strip())
-	# max_iterations = cfg.max_iterations if CONFIG else int(input("Maximum Iterations: ").strip())
-	# model_name = cfg.model_name if CONFIG else input("Model Name: ").strip()
-	# # test_images_dir = input("Test Images Directory: ").strip()
-
-	# print("\nTRAINING...\n")
-	# mh.train(training_sFrame, model_dir, train_test_split, max_iterations, model_name)
-	# mh.visualize_results(model_dir, test_images_dir, model_name)
-
+	if explore:
+		pipeline.explore()
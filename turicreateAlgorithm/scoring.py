@@ -0,0 +1,266 @@
+"""
+Scores every image of a directory tree with a trained object detector, in chunks.
+
+Images are listed lazily, decoded by a thread pool and predicted chunk by chunk, and the predictions are appended to
+the output as each chunk completes, so memory stays the same whatever the size of the directory. The output is either
+a .jsonl file, one line per image, or a sharded dataset (see TCHandler.append_shards) with the columns path and
+predictions. Progress is checkpointed after every chunk and an interrupted job resumes after its last chunk:
+
+	python scoring.py Playground/model/heavy_aug.model new_images/ predictions.jsonl
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import itertools
+from multiprocessing.pool import ThreadPool
+import turicreate as tc
+
+import boxes
+import imageCache
+import instrument
+from checkpoint import CheckpointHandler
+from fileIndex import IMAGE_EXTS
+from xmlToSFrame import TCHandler
+
+
+def iter_images(images_dir, exts=IMAGE_EXTS, after=None):
+	"""
+	Yields the image paths of a directory tree in a stable order: folders and files sorted by name, the files of a
+	folder before its subfolders.
+
+	Only one folder listing is held at a time. If after is given, only the paths coming after it in that order are
+	yielded, and the folders that come entirely before it aren't listed.
+	"""
+	last = image_order(images_dir, after) if after is not None else None
+	for dir_path, dir_names, file_names in os.walk(images_dir):
+		dir_names.sort()
+		if last is not None:
+			rel_dir = os.path.relpath(dir_path, images_dir)
+			prefix = [] if rel_dir == os.curdir else [(1, name) for name in rel_dir.split(os.sep)]
+			dir_names[:] = [name for name in dir_names if prefix + [(1, name)] >= last[:len(prefix) + 1]]
+		for file_name in sorted(file_names):
+			if os.path.splitext(file_name)[1].lower() in exts:
+				path = os.path.join(dir_path, file_name)
+				if last is None or image_order(images_dir, path) > last:
+					yield path
+
+
+def image_order(images_dir, path):
+	"""
+	Sort key of an image path in the order of iter_images, files coming before the folders next to them.
+	"""
+	parts = os.path.relpath(path, images_dir).split(os.sep)
+	return [(1, name) for name in parts[:-1]] + [(0, parts[-1])]
+
+
+def iter_chunks(iterable, chunk_size):
+	iterator = iter(iterable)
+	while True:
+		chunk = list(itertools.islice(iterator, chunk_size))
+		if not chunk:
+			return
+		yield chunk
+
+
+def load_image(path, max_side=None):
+	"""
+	Loads an image for prediction. Run in the thread pool, cv2 releases the GIL while decoding.
+
+	A JPEG that needs no downscaling is read as is, still encoded. Anything else is decoded, downscaled and encoded
+	again as a JPEG.
+
+	Returns
+	-------
+	tuple
+		The tc.Image (None if unreadable) and its (x, y) scale relative to the file.
+	"""
+	size = imageCache.jpeg_size(path)
+	if size is not None and (not max_side or max(size) <= max_side):
+		return tc.Image(path), (1.0, 1.0)
+
+	img, scale = imageCache.decode(path, max_side)
+	if img is None:
+		return None, scale
+	return TCHandler.image_from_array(img), scale
+
+
+def unscale_predictions(predictions, sx, sy):
+	"""
+	Maps predictions made on a downscaled image back to the coordinates of the file.
+	"""
+	if sx == 1.0 and sy == 1.0:
+		return predictions
+	scaled = boxes.scale_annotations(predictions, 1.0 / sx, 1.0 / sy)
+	for prediction, original in zip(scaled, predictions):
+		for key, value in original.items():
+			if key != 'coordinates':
+				prediction[key] = value
+	return scaled
+
+
+class JSONLWriter(object):
+	def __init__(self, output_path, offset=None):
+		"""
+		Appends predictions to a .jsonl file. On resume, whatever was written after the last checkpoint is cut off.
+		"""
+		self.output_path = output_path
+		mode = 'r+' if offset is not None and os.path.isfile(output_path) else 'w'
+		self.file = open(output_path, mode)
+		if mode == 'r+':
+			self.file.seek(offset)
+			self.file.truncate()
+
+	def write(self, rows):
+		for row in rows:
+			self.file.write(json.dumps(row, default=float) + '\n')
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		return {'offset': self.file.tell()}
+
+	def close(self):
+		self.file.close()
+
+
+class ShardWriter(object):
+	def __init__(self, output_path, progress=None):
+		"""
+		Appends predictions to a sharded dataset, one shard per chunk. On resume, shards written after the last
+		checkpoint are dropped from the index and deleted.
+		"""
+		self.output_dir = os.path.dirname(os.path.abspath(output_path))
+		self.name = os.path.basename(os.path.normpath(output_path))
+		if self.name.endswith('.shards'):
+			self.name = self.name[:-len('.shards')]
+
+		if progress is None:
+			TCHandler.clear_shards(self.output_dir, self.name)
+		else:
+			index = TCHandler.read_index(self.output_dir, self.name)
+			index['shards'] = index['shards'][:progress['shards']]
+			TCHandler.write_index(self.output_dir, self.name, index)
+			# Including a shard the interrupted run was still saving, which never made it into the index
+			kept = set(os.path.basename(shard['path']) for shard in index['shards'])
+			shards_dir = TCHandler.shards_dir(self.output_dir, self.name)
+			for file in os.listdir(shards_dir):
+				if file.endswith('.sframe') and file not in kept:
+					shutil.rmtree(os.path.join(shards_dir, file))
+
+	def write(self, rows):
+		sf = tc.SFrame({
+			'path': [row['path'] for row in rows],
+			'predictions': tc.SArray([row.get('predictions') for row in rows], dtype=list),
+		})
+		TCHandler.append_shards(sf, self.output_dir, self.name, shard_rows=len(rows))
+		return {'shards': len(TCHandler.read_index(self.output_dir, self.name)['shards'])}
+
+	def close(self):
+		pass
+
+
+@instrument.timed('score', unit='images')
+def scoreDirectory(model, images_dir, output_path, chunk_size=256, num_threads=8, confidence_threshold=0.25,
+				   max_side=None, checkpoint_dir=None):
+	"""
+	Scores every image under images_dir and appends the predictions to output_path.
+
+	Parameters
+	----------
+	model : ObjectDetector
+		The loaded model.
+	images_dir : str
+		The directory tree of images to score.
+	output_path : str
+		A .jsonl file, or the <name>.shards folder of a sharded dataset.
+	chunk_size : int, optional
+		Number of images decoded and predicted at a time, which bounds the memory used.
+	num_threads : int, optional
+		Number of threads decoding the images.
+	confidence_threshold : float, optional
+		Predictions less confident than this are dropped.
+	max_side : int, optional
+		If given, images are decoded downscaled to this longest side, see imageCache.decode. Predictions are mapped back
+		to the coordinates of the files.
+	checkpoint_dir : str, optional
+		Where the progress is checkpointed, defaults to the folder of output_path. A job started again with the same
+		arguments resumes after the last image of its last completed chunk, so images added to the directory meanwhile
+		don't shift what is skipped.
+
+	Returns
+	-------
+	int
+		The number of images scored, including those of an interrupted run.
+	"""
+	checkpoint_dir = checkpoint_dir or os.path.dirname(os.path.abspath(output_path))
+	checkpoint = CheckpointHandler(checkpoint_dir, 'score_{0}'.format(os.path.basename(os.path.normpath(output_path))))
+	jsonl = output_path.endswith('.jsonl')
+	checkpoint.start({
+		'images_dir': os.path.abspath(images_dir),
+		'output_format': 'jsonl' if jsonl else 'shards',
+		'chunk_size': chunk_size,
+		'confidence_threshold': confidence_threshold,
+		'max_side': max_side,
+	})
+	progress = checkpoint.progress()
+
+	writer = JSONLWriter(output_path, progress and progress['offset']) if jsonl else ShardWriter(output_path, progress)
+	done = progress['images'] if progress else 0
+	last_path = progress['last_path'] if progress else None
+	if last_path:
+		print("Resuming after {0} images, from {1}".format(done, last_path))
+
+	pool = ThreadPool(num_threads)
+	try:
+		# Resuming only skips paths, nothing is decoded again
+		paths = iter_images(images_dir, after=last_path)
+		for chunk in iter_chunks(paths, chunk_size):
+			loaded = pool.map(lambda path: load_image(path, max_side), chunk)
+			readable = [i for i, (image, _) in enumerate(loaded) if image is not None]
+
+			rows = [{'path': path, 'predictions': None, 'error': 'unreadable'} for path in chunk]
+			if readable:
+				predictions = model.predict(tc.SArray([loaded[i][0] for i in readable], dtype=tc.Image),
+											confidence_threshold=confidence_threshold, verbose=False)
+				for i, prediction in zip(readable, predictions):
+					rows[i] = {'path': chunk[i], 'predictions': unscale_predictions(prediction, *loaded[i][1])}
+
+			state = writer.write(rows)
+			done += len(chunk)
+			state['images'] = done
+			state['last_path'] = chunk[-1]
+			checkpoint.save_progress(state)
+			instrument.count(len(chunk))
+			print("\t{0} images scored".format(done))
+	finally:
+		pool.close()
+		pool.join()
+		writer.close()
+
+	checkpoint.finish()
+	return done
+
+
+def parse_args(argv=None):
+	parser = argparse.ArgumentParser(description="Scores a directory of images with a trained object detector.")
+	parser.add_argument('model', help="The .model folder to score with.")
+	parser.add_argument('images', help="The directory tree of images.")
+	parser.add_argument('output', help="A .jsonl file, or a <name>.shards folder.")
+	parser.add_argument('--chunk-size', type=int, default=256, help="Images decoded and predicted at a time.")
+	parser.add_argument('--threads', type=int, default=8, help="Threads decoding the images.")
+	parser.add_argument('--confidence', type=float, default=0.25, help="Confidence threshold of the predictions.")
+	parser.add_argument('--max-side', type=int, default=None, help="Decode images downscaled to this longest side.")
+	parser.add_argument('--checkpoint-dir', default=None, help="Where the progress is checkpointed.")
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+	args = parse_args(argv)
+	model = tc.load_model(args.model)
+	scoreDirectory(model, args.images, args.output, args.chunk_size, args.threads, args.confidence, args.max_side,
+				   args.checkpoint_dir)
+	instrument.recorder.summary()
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Seeded train/test split, stratified by label and grouped by source image.
+
+Augmentations are named after their source image (<stem>.JPEG, or <stem>_<i>.JPEG for in-memory ones), so every row
+is assigned the side of its source and an augmented copy never lands on the other side of its original. Augmented
+copies of test images are left out of both sides, so the test side only holds original images. The split is computed
+from an AnnotationStore, the images are never read.
+"""
+import os
+import json
+import numpy as np
+import turicreate as tc
+
+from annotationStore import AnnotationStore
+
+
+def primary_labels(store):
+	"""
+	Returns the most frequent label id of each image of a store, -1 for images without boxes.
+
+	Ties go to the smallest label id, so the result doesn't depend on the order of the boxes.
+	"""
+	counts = np.zeros((len(store), max(len(store.label_names), 1)), dtype=np.int64)
+	np.add.at(counts, (store.image_index(), np.asarray(store.label_ids)), 1)
+	labels = counts.argmax(axis=1)
+	labels[counts.sum(axis=1) == 0] = -1
+	return labels
+
+
+def stem_of(path):
+	return os.path.splitext(os.path.basename(path))[0]
+
+
+def source_stem(path, stems):
+	"""
+	Returns the stem of the source image of a row, or None if it isn't one of stems.
+	"""
+	stem = stem_of(path)
+	if stem in stems:
+		return stem
+	# In-memory augmentations are named <stem>_<i>
+	base = stem.rsplit('_', 1)[0]
+	return base if base in stems else None
+
+
+def split_groups(store, fraction=0.8, seed=0):
+	"""
+	Assigns every source image of a store to train or test.
+
+	Images sharing a stem form one group, which takes the primary label of its first image. Within each label the
+	groups are shuffled with the seed and the first round(fraction * n) go to train, so every label keeps the same
+	ratio.
+
+	Parameters
+	----------
+	store : AnnotationStore
+		The annotations of the source images, for e.g. original.annotations.
+	fraction : float, optional
+		Ratio of groups in the training set.
+	seed : int, optional
+		Seed of the shuffle. The same store, fraction and seed always give the same split.
+
+	Returns
+	-------
+	dict
+		Stem to True for train, False for test.
+	"""
+	group_labels = {}
+	for path, label in zip(store.paths, primary_labels(store).tolist()):
+		group_labels.setdefault(stem_of(path), label)
+
+	rng = np.random.RandomState(seed)
+	assignment = {}
+	for label in sorted(set(group_labels.values())):
+		# Sorted first, so the shuffle only depends on the seed and not on the order of the rows
+		groups = sorted(stem for stem, group_label in group_labels.items() if group_label == label)
+		groups = [groups[i] for i in rng.permutation(len(groups))]
+		num_train = int(round(fraction * len(groups)))
+		for i, stem in enumerate(groups):
+			assignment[stem] = i < num_train
+	return assignment
+
+
+def split_mask(paths, assignment, originals=None):
+	"""
+	Returns 1 for the rows going to train, 0 for test and -1 for the augmented copies of test images, which go nowhere.
+
+	Rows with no known source go nowhere either, since either side could leak them, and their count is printed.
+
+	Parameters
+	----------
+	paths : iterable of str
+		The path of each row.
+	assignment : dict
+		Stem to True for train, False for test, see split_groups.
+	originals : set of str, optional
+		The paths of the source images. Rows of a test stem whose path isn't one of them are augmented copies. If not
+		given, every row of a test stem goes to test.
+	"""
+	mask = []
+	unknown = 0
+	for path in paths:
+		stem = source_stem(path, assignment)
+		if stem is None:
+			unknown += 1
+			mask.append(-1)
+		elif assignment[stem]:
+			mask.append(1)
+		else:
+			mask.append(0 if originals is None or path in originals else -1)
+	if unknown:
+		print("Warning: {0} rows have no source image in the split and are dropped".format(unknown))
+	return mask
+
+
+def train_test_split(sf, store=None, fraction=0.8, seed=0):
+	"""
+	Splits a dataset so augmentations follow their source image, stratified by label.
+
+	Parameters
+	----------
+	sf : SFrame
+		The dataset, only its path column is read to split it.
+	store : AnnotationStore, optional
+		The annotations of the source images, the groups and labels are taken from them. Built from the path and
+		annotations columns of sf if not given, in which case augmented rows can't be told from their source and go
+		to the side of their source.
+	fraction : float, optional
+		Ratio of groups in the training set.
+	seed : int, optional
+		Seed of the split.
+
+	Returns
+	-------
+	tuple
+		The train SFrame, the test SFrame and the assignment of each source stem, see split_groups.
+	"""
+	originals = None
+	if store is None:
+		store = AnnotationStore.from_sframe(sf[['path', 'annotations']])
+	else:
+		originals = set(store.paths)
+	assignment = split_groups(store, fraction, seed)
+	mask = tc.SArray(split_mask(sf['path'], assignment, originals), dtype=int)
+	return sf[mask == 1], sf[mask == 0], assignment
+
+
+def write_split(assignment, output_dir, name='split'):
+	"""
+	Writes the train and test stems as <name>.json, so a split can be inspected and reproduced.
+	"""
+	with open(os.path.join(output_dir, '{0}.json'.format(name)), 'w') as f:
+		json.dump({
+			'train': sorted(stem for stem, train in assignment.items() if train),
+			'test': sorted(stem for stem, train in assignment.items() if not train),
+		}, f, indent=2)
@@ -0,0 +1,268 @@
+import os
+import csv
+import json
+import time
+import itertools
+import multiprocessing
+import turicreate as tc
+
+from xmlToSFrame import TCHandler
+from annotationStore import AnnotationStore
+import split
+import evaluation
+import instrument
+
+# Environment variables bounding the threads of the numeric libraries of a trial. They are only read when the
+# libraries start, so they are set in the environment the workers are started with, see SweepHandler.startPool.
+THREAD_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MXNET_CPU_WORKER_NTHREADS')
+
+# Columns of the comparison table, the trial parameters come after them
+FIELDS = ('trial', 'rung', 'iterations', 'seconds', 'training_loss', 'mean_average_precision_50', 'stopped')
+
+
+def expand_grid(grid):
+	"""
+	Expands a parameter grid into the list of its trials.
+
+	Parameters
+	----------
+	grid : dict
+		Parameter name to the list of values to try, for e.g. {'batch_size': [16, 32], 'max_iterations': [5000]}.
+
+	Returns
+	-------
+	list of dict
+		One parameter dict per combination, in a stable order.
+	"""
+	names = sorted(grid)
+	return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def rung_iterations(max_iterations, rungs, eta):
+	"""
+	Returns the iteration budget of each rung, growing by eta up to max_iterations.
+	"""
+	return [max(int(max_iterations / float(eta ** (rungs - 1 - rung))), 1) for rung in range(rungs)]
+
+
+def trial_score(result):
+	"""
+	Sort key of a trial result, best first. A trial without a mean average precision, for e.g. one whose test side
+	has no boxes, comes last.
+	"""
+	value = result['mean_average_precision_50']
+	return -value if value == value else float('inf')
+
+
+def _limit_threads(num_threads):
+	"""
+	Pool initializer bounding the threads Turi Create uses in a trial. The numeric libraries are bounded by THREAD_VARS.
+	"""
+	tc.config.set_num_gpus(0)
+	tc.config.set_runtime_config('TURI_DEFAULT_NUM_PYLAMBDA_WORKERS', num_threads)
+
+
+def _run_trial(job):
+	"""
+	Trains and evaluates one trial. Used as the process pool entry point, so it has to live at module level.
+
+	Parameters
+	----------
+	job : tuple
+		(trial id, parameters, iterations, train SFrame path, test SFrame path, model path or None).
+
+	Returns
+	-------
+	dict
+		The FIELDS of the trial, without the rung and stopped columns.
+	"""
+	trial, params, iterations, train_path, test_path, model_path = job
+	create_params = dict((name, value) for name, value in params.items() if name not in ('dataset', 'max_iterations'))
+
+	start = time.time()
+	train_data = tc.SFrame(train_path)
+	model = tc.object_detector.create(train_data, feature='image', annotations='annotations',
+									  max_iterations=iterations, verbose=False, **create_params)
+	test_data = tc.SFrame(test_path)
+	predictions = model.predict(test_data, confidence_threshold=evaluation.MIN_CONFIDENCE, verbose=False)
+	metrics = evaluation.evaluate(test_data['annotations'], predictions, iou_thresholds=(0.5,))
+	if model_path:
+		model.save(model_path)
+
+	return {
+		'trial': trial,
+		'iterations': iterations,
+		'seconds': time.time() - start,
+		'training_loss': float(model.training_loss),
+		'mean_average_precision_50': float(metrics['mean_average_precision_50']),
+	}
+
+
+class SweepHandler(object):
+	def __init__(self, sweep_dir, num_workers=2, threads_per_trial=None, rungs=3, eta=2, seed=0,
+				 train_test_split=0.8):
+		"""
+		Runs a grid of object detector trainings in parallel and compares them.
+
+		Each dataset is loaded and split once, and the train and test sides are saved in sweep_dir for every trial to
+		read. Trials run in a process pool, each bounded to threads_per_trial threads.
+
+		Poor trials are stopped early by successive halving: every trial first trains with a fraction of its
+		max_iterations, and only the best 1/eta of them, by mean average precision on the test side, go on to the next
+		rung with eta times more iterations.
+
+		Turi Create can't resume a training, so this is successive halving by repeated shortened training: each rung
+		trains the trial again from scratch with the larger budget, and a trial reaching the last rung costs the sum of
+		its rung budgets rather than just the last one.
+
+		Parameters
+		----------
+		sweep_dir : str
+			The folder the splits, the comparison table and the best model are written in.
+		num_workers : int, optional
+			Number of trials running at once.
+		threads_per_trial : int, optional
+			Threads each trial may use, defaults to the CPUs divided by num_workers.
+		rungs : int, optional
+			Number of successive halving rungs, 1 trains every trial to the end.
+		eta : int, optional
+			Ratio of iterations between rungs and of trials stopped at each rung.
+		seed : int, optional
+			Seed of the train/test split, see split.py.
+		train_test_split : float, optional
+			The ratio of training data to testing data.
+		"""
+		self.sweep_dir = sweep_dir
+		self.num_workers = num_workers
+		self.threads_per_trial = threads_per_trial or max(multiprocessing.cpu_count() // num_workers, 1)
+		self.rungs = rungs
+		self.eta = eta
+		self.seed = seed
+		self.train_test_split = train_test_split
+		if not os.path.isdir(sweep_dir):
+			os.makedirs(sweep_dir)
+
+	def prepareData(self, dataset):
+		"""
+		Splits a dataset and saves both sides in the sweep folder, once per dataset.
+
+		Returns
+		-------
+		tuple
+			The paths of the train and test SFrames.
+		"""
+		name = os.path.splitext(os.path.basename(os.path.normpath(dataset)))[0]
+		train_path = os.path.join(self.sweep_dir, '{0}_train.sframe'.format(name))
+		test_path = os.path.join(self.sweep_dir, '{0}_test.sframe'.format(name))
+
+		store_dir = os.path.join(os.path.dirname(os.path.normpath(dataset)), 'original.annotations')
+		store = AnnotationStore.load(store_dir) if os.path.isdir(store_dir) else None
+		train_data, test_data, assignment = split.train_test_split(TCHandler.load_dataset(dataset), store,
+																   self.train_test_split, self.seed)
+		train_data.save(train_path)
+		test_data.save(test_path)
+		split.write_split(assignment, self.sweep_dir, '{0}_split'.format(name))
+		return train_path, test_path
+
+	def startPool(self):
+		"""
+		Starts the trial workers, bounded to threads_per_trial threads each.
+
+		THREAD_VARS are set in this process's environment, which the workers start with, and are left set until the
+		sweep is done since a worker is started again for every trial. Workers are spawned rather than forked where
+		possible, so they don't inherit a Turi Create runtime this process already started.
+		"""
+		for var in THREAD_VARS:
+			os.environ[var] = str(self.threads_per_trial)
+		context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+		return context.Pool(self.num_workers, initializer=_limit_threads, initargs=(self.threads_per_trial,),
+							maxtasksperchild=1)
+
+	@instrument.timed('sweep', unit='trials')
+	def run(self, dataset, grid, max_iterations=5000):
+		"""
+		Runs every trial of the grid.
+
+		Parameters
+		----------
+		dataset : str
+			The dataset to train on, see TCHandler.load_dataset. A 'dataset' entry of the grid overrides it, for e.g.
+			to compare the original SFrame with differently augmented ones.
+		grid : dict
+			Parameter name to the list of values to try. 'max_iterations' and 'dataset' are handled by the sweep, every
+			other parameter is passed to tc.object_detector.create, for e.g. 'batch_size'.
+		max_iterations : int, optional
+			Iterations of the last rung for trials that don't set max_iterations.
+
+		Returns
+		-------
+		list of dict
+			One row per trial and rung, see FIELDS, best trials first. Also written as results.csv and results.json.
+		"""
+		# The caller's parameter dicts are left as they are
+		trials = [dict(params, dataset=params.get('dataset', dataset)) for params in expand_grid(grid)]
+
+		# Started before this process does any Turi Create work of its own
+		saved = dict((var, os.environ.get(var)) for var in THREAD_VARS)
+		pool = self.startPool()
+		try:
+			datasets = {}
+			for params in trials:
+				if params['dataset'] not in datasets:
+					datasets[params['dataset']] = self.prepareData(params['dataset'])
+
+			results = []
+			alive = list(range(len(trials)))
+			for rung in range(self.rungs):
+				if len(alive) == 1:
+					# A single trial left has nothing to be compared with, so it goes straight to the last rung
+					rung = self.rungs - 1
+				last = rung == self.rungs - 1
+				print("\nRUNG {0}: {1} TRIALS\n".format(rung, len(alive)))
+				jobs = []
+				for trial in alive:
+					params = trials[trial]
+					budget = rung_iterations(params.get('max_iterations', max_iterations), self.rungs, self.eta)[rung]
+					model_path = os.path.join(self.sweep_dir, 'trial_{0}.model'.format(trial)) if last else None
+					jobs.append((trial, params, budget) + datasets[params['dataset']] + (model_path,))
+
+				rung_results = pool.map(_run_trial, jobs, chunksize=1)
+				instrument.count(len(rung_results))
+				rung_results.sort(key=trial_score)
+				keep = len(rung_results) if last else max(len(rung_results) // self.eta, 1)
+				for i, result in enumerate(rung_results):
+					result['rung'] = rung
+					result['stopped'] = i >= keep
+					result.update(trials[result['trial']])
+					print("\ttrial {trial}: mAP@50 {mean_average_precision_50:.4f}, loss {training_loss:.4f}, "
+						  "{seconds:.1f}s".format(**result))
+				results.extend(rung_results)
+				alive = [result['trial'] for result in rung_results[:keep]]
+				if last:
+					break
+		finally:
+			pool.close()
+			pool.join()
+			for var, value in saved.items():
+				if value is None:
+					os.environ.pop(var, None)
+				else:
+					os.environ[var] = value
+
+		results.sort(key=lambda result: (-result['rung'], trial_score(result)))
+		self.writeResults(results, sorted(grid))
+		return results
+
+	def writeResults(self, results, param_names):
+		"""
+		Writes the comparison table as results.csv and results.json in the sweep folder.
+		"""
+		with open(os.path.join(self.sweep_dir, 'results.json'), 'w') as f:
+			json.dump(results, f, indent=2)
+
+		fields = list(FIELDS) + [name for name in sorted(set(param_names) | set(['dataset'])) if name not in FIELDS]
+		with open(os.path.join(self.sweep_dir, 'results.csv'), 'w') as f:
+			writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+			writer.writeheader()
+			for result in results:
+				writer.writerow(result)
@@ -0,0 +1,195 @@
+"""
+Tests of the numeric helpers: box conversions, detection metrics, the train/test split and the near-duplicate index.
+
+	python -m pytest turicreateAlgorithm/tests
+"""
+import os
+import sys
+import random
+import unittest
+import numpy as np
+
+# The modules import each other by name, as when run from their folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boxes
+import evaluation
+import split
+from annotationStore import AnnotationStore
+from annotationQuality import HashIndex, find_duplicates, hamming
+
+
+def annotation(x, y, width, height, label, confidence=None):
+	a = {'coordinates': {'x': x, 'y': y, 'width': width, 'height': height}, 'label': label}
+	if confidence is not None:
+		a['confidence'] = confidence
+	return a
+
+
+class BoxesTest(unittest.TestCase):
+	def test_layout_round_trip(self):
+		xyxy = [[0, 0, 10, 20], [1, 1, 4, 4]]
+		cxcywh = boxes.xyxy_to_cxcywh(xyxy)
+		np.testing.assert_allclose(cxcywh, [[5, 10, 10, 20], [2.5, 2.5, 3, 3]])
+		np.testing.assert_allclose(boxes.cxcywh_to_xyxy(cxcywh), xyxy)
+		self.assertEqual(cxcywh.dtype, boxes.DTYPE)
+
+	def test_empty_boxes(self):
+		self.assertEqual(boxes.xyxy_to_cxcywh([]).shape, (0, 4))
+		self.assertEqual(boxes.iou([], [[0, 0, 1, 1]]).shape, (0, 1))
+
+	def test_scale_annotations(self):
+		annotations = [annotation(10, 20, 4, 8, 'cat')]
+		scaled = boxes.scale_annotations(annotations, 0.5, 0.25)
+		self.assertEqual(scaled, [annotation(5.0, 5.0, 2.0, 2.0, 'cat')])
+		self.assertIs(boxes.scale_annotations(annotations, 1.0, 1.0), annotations)
+
+	def test_to_annotations_labels(self):
+		self.assertEqual(boxes.to_annotations([[1, 2, 3, 4]], 'cat'), [annotation(1.0, 2.0, 3.0, 4.0, 'cat')])
+		labels = [a['label'] for a in boxes.to_annotations([[1, 2, 3, 4], [5, 6, 7, 8]], ['cat', 'dog'])]
+		self.assertEqual(labels, ['cat', 'dog'])
+
+	def test_arrays_round_trip(self):
+		annotation_lists = [[annotation(1, 2, 3, 4, 'cat'), annotation(5, 6, 7, 8, 'dog')], [], None]
+		box_array, offsets, labels = boxes.annotations_to_arrays(annotation_lists)
+		self.assertEqual(box_array.shape, (2, 4))
+		self.assertEqual(offsets.tolist(), [0, 2, 2, 2])
+		self.assertEqual(labels, ['cat', 'dog'])
+		self.assertEqual(boxes.arrays_to_annotations(box_array, offsets, labels), [annotation_lists[0], [], []])
+
+	def test_iou(self):
+		ious = boxes.iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30], [3, 3, 3, 3]])
+		np.testing.assert_allclose(ious, [[1.0, 50.0 / 150.0, 0.0, 0.0]])
+
+	def test_valid_mask(self):
+		xyxy = [[0, 0, 2, 2], [0, 0, 0, 5], [3, 3, 1, 1]]
+		self.assertEqual(boxes.valid_mask(xyxy).tolist(), [True, False, False])
+		self.assertEqual(boxes.valid_mask(xyxy, min_size=2).tolist(), [False, False, False])
+
+
+class EvaluationTest(unittest.TestCase):
+	def test_match_image_most_confident_first(self):
+		iou = np.array([[0.9, 0.6], [0.8, 0.1]])
+		matched = evaluation.match_image(iou, np.array([0.5, 0.9]), (0.5, 0.85))
+		# The second prediction is more confident and takes the first box at 0.5, but is below 0.85 on it
+		self.assertEqual(matched.tolist(), [[1, 0], [0, -1]])
+
+	def test_match_image_excluded_pairs(self):
+		self.assertEqual(evaluation.match_image(np.array([[-1.0]]), np.array([0.9]), (0.5,)).tolist(), [[-1]])
+		self.assertEqual(evaluation.match_image(np.zeros((0, 3)), np.zeros(0), (0.5,)).shape, (0, 1))
+
+	def test_average_precision(self):
+		ap, precision, recall = evaluation.average_precision(np.array([True, False, True]),
+															 np.array([0.9, 0.8, 0.7]), 2)
+		self.assertAlmostEqual(ap, 0.5 + 0.5 * 2.0 / 3.0)
+		np.testing.assert_allclose(recall, [0.5, 0.5, 1.0])
+		np.testing.assert_allclose(precision, [1.0, 0.5, 2.0 / 3.0])
+
+		ap, _, _ = evaluation.average_precision(np.array([True, True]), np.array([0.2, 0.9]), 2)
+		self.assertAlmostEqual(ap, 1.0)
+		self.assertTrue(np.isnan(evaluation.average_precision(np.zeros(0, dtype=bool), np.zeros(0), 0)[0]))
+
+	def test_evaluate(self):
+		ground_truth = [[annotation(50, 50, 20, 20, 'cat')], [annotation(30, 30, 10, 10, 'dog')]]
+		predictions = [[annotation(50, 50, 20, 20, 'cat', 0.9), annotation(200, 200, 10, 10, 'dog', 0.3)], []]
+		results = evaluation.evaluate(ground_truth, predictions)
+
+		self.assertAlmostEqual(results['average_precision_50']['cat'], 1.0)
+		self.assertAlmostEqual(results['average_precision_50']['dog'], 0.0)
+		self.assertAlmostEqual(results['mean_average_precision_50'], 0.5)
+		self.assertEqual(results['confusion']['labels'], ['cat', 'dog', evaluation.BACKGROUND])
+		# The missed dog in the background column, the stray dog prediction in the background row
+		self.assertEqual(results['confusion']['counts'], [[1, 0, 0], [0, 0, 1], [0, 1, 0]])
+
+	def test_evaluate_image_count_mismatch(self):
+		with self.assertRaises(ValueError):
+			evaluation.evaluate([[]], [[], []])
+
+
+def make_store(labels_by_image):
+	paths = ['images/{0}.JPEG'.format(stem) for stem in sorted(labels_by_image)]
+	annotation_lists = [[annotation(10, 10, 4, 4, label) for label in labels_by_image[stem]]
+						for stem in sorted(labels_by_image)]
+	return AnnotationStore.from_annotations(paths, annotation_lists)
+
+
+class SplitTest(unittest.TestCase):
+	def test_primary_labels(self):
+		store = make_store({'a': ['dog', 'cat', 'dog'], 'b': ['cat', 'dog'], 'c': ['cat']})
+		names = store.label_names
+		self.assertEqual([names[i] for i in split.primary_labels(store).tolist()], ['dog', 'cat', 'cat'])
+
+	def test_split_groups_stratified(self):
+		labels = dict(('cat{0:02d}'.format(i), ['cat']) for i in range(10))
+		labels.update(('dog{0:02d}'.format(i), ['dog']) for i in range(5))
+		assignment = split.split_groups(make_store(labels), fraction=0.8, seed=3)
+
+		self.assertEqual(sorted(assignment), sorted(labels))
+		self.assertEqual(sum(assignment[stem] for stem in labels if stem.startswith('cat')), 8)
+		self.assertEqual(sum(assignment[stem] for stem in labels if stem.startswith('dog')), 4)
+		self.assertEqual(split.split_groups(make_store(labels), fraction=0.8, seed=3), assignment)
+
+	def test_split_groups_by_stem(self):
+		store = AnnotationStore.from_annotations(['a/img.JPEG', 'b/img.JPEG', 'a/other.JPEG'],
+												 [[annotation(1, 1, 1, 1, 'cat')]] * 3)
+		self.assertEqual(sorted(split.split_groups(store)), ['img', 'other'])
+
+	def test_source_stem(self):
+		stems = {'img': True, 'img_1': False}
+		self.assertEqual(split.source_stem('aug/img.JPEG', stems), 'img')
+		self.assertEqual(split.source_stem('aug/img_3.JPEG', stems), 'img')
+		self.assertEqual(split.source_stem('aug/img_1.JPEG', stems), 'img_1')
+		self.assertIsNone(split.source_stem('aug/other_0.JPEG', stems))
+
+	def test_split_mask_leakage(self):
+		assignment = {'a': True, 'b': False}
+		paths = ['o/a.JPEG', 'o/b.JPEG', 'aug/b.JPEG', 'aug/b_0.JPEG', 'aug/a_1.JPEG', 'x/c.JPEG']
+		# Augmented copies of the test image and rows of no known source go nowhere
+		self.assertEqual(split.split_mask(paths, assignment, set(['o/a.JPEG', 'o/b.JPEG'])), [1, 0, -1, -1, 1, -1])
+		self.assertEqual(split.split_mask(paths, assignment), [1, 0, 0, 0, 1, -1])
+
+
+class HashIndexTest(unittest.TestCase):
+	def test_hamming(self):
+		self.assertEqual(hamming(0b1011, 0b0001), 2)
+		self.assertEqual(hamming(0, (1 << 64) - 1), 64)
+
+	def test_query_within_distance(self):
+		index = HashIndex(max_distance=4)
+		near = (1 << 63) | 0b111
+		index.add(0)
+		index.add(near)
+		self.assertEqual(index.query(0), [(0, 0), (1, 4)])
+		# Five bits apart, one in each band, shares no band with either hash
+		self.assertEqual(index.query((1 << 0) | (1 << 12) | (1 << 25) | (1 << 38) | (1 << 51)), [])
+
+	def test_query_matches_brute_force(self):
+		rng = random.Random(0)
+		values = []
+		for _ in range(100):
+			value = rng.getrandbits(64)
+			values.append(value)
+			# Near copies, flipping up to 5 bits
+			for _ in range(2):
+				flipped = value
+				for bit in rng.sample(range(64), rng.randint(0, 5)):
+					flipped ^= 1 << bit
+				values.append(flipped)
+
+		index = HashIndex(max_distance=4)
+		for value in values:
+			index.add(value)
+		for value in values[::7]:
+			expected = [(i, hamming(value, other)) for i, other in enumerate(values) if hamming(value, other) <= 4]
+			self.assertEqual(index.query(value), expected)
+
+	def test_find_duplicates(self):
+		keys = ['a', 'b', 'c', 'd', 'e']
+		hashes = [0, 0b11, None, 0b111 << 40, 0b1111]
+		# e is 4 bits from a but 2 from b, so the group is transitive
+		self.assertEqual(find_duplicates(keys, hashes, max_distance=2), [['a', 'b', 'e']])
+		self.assertEqual(find_duplicates(['a', 'b'], [None, None]), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
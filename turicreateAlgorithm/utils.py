@@ -1,5 +1,6 @@
 import sys
 import os
+import time
 import pickle
 
 __author__ = "Matt Zhou"
@@ -12,6 +13,10 @@ __email__ = "mattzh1314@berkeley.edu"
 __status__ = "Production"
 
 class Utils(object):
+	# Seconds between two redraws of the progress bar
+	progress_interval = 0.1
+	_last_progress = 0.0
+
 	def __init__(self):
 		pass
 
@@ -20,6 +25,9 @@ class Utils(object):
 		"""
 		Prints a progress bar.
 
+		Redraws are rate-limited to one per Utils.progress_interval seconds, so calling this on every item of a tight
+		loop is cheap. The first and last iterations are always drawn.
+
 		Parameters
 		----------
 		iteration : int
@@ -37,6 +45,11 @@ class Utils(object):
 		fill : str, optional
 			Bar fill character.
 		"""
+		now = time.time()
+		if 0 < iteration < total and now - Utils._last_progress < Utils.progress_interval:
+			return
+		Utils._last_progress = now
+
 		percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
 		filledLength = int(length * iteration // total)
 		bar = fill * filledLength + '-' * (length - filledLength)
@@ -46,47 +59,6 @@ class Utils(object):
 		if iteration == total: 
 			print()
 
-	@staticmethod	
-	def calc_center(c_min, c_max):
-		"""
-		Calculates the center point between two coordinate points.
-
-		Parameters
-		----------
-		c_min : int
-			The minimum coordinate.
-
-		c_max : int
-			The maximum coordinate.
-
-		Returns
-		-------
-		int
-			Center point between two coordinates.
-		"""
-		return c_min + (c_max - c_min) / 2
-
-	@staticmethod
-	def calc_dist(c_min, c_max):
-		"""
-		Calculates the distance between two coordinate points.
-
-		Parameters
-		----------
-		c_min : int
-			The minimum coordinate.
-
-		c_max : int
-			The maximum coordinate.
-
-		Returns
-		-------
-		int
-			Distance between two coordinates.
-		"""
-
-		return c_max - c_min
-
 	@staticmethod
 	def write_as_pckl(data, name, output_dir):
 		"""
@@ -1,8 +1,27 @@
 import os
+import json
+import errno
 import shutil
+from multiprocessing.pool import ThreadPool
+from fileIndex import FileIndex
+from utils import Utils
+import instrument
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+# ioctl request cloning a file's extents on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+COPY_STRATEGIES = ('copy', 'hardlink', 'reflink', 'symlink', 'manifest')
+
+# File written in place of the images by the 'manifest' copy strategy
+SOURCES_FILE = 'sources.json'
 
 class DataCleanerHandler(object):
-	def __init__(self, annotatations_dir=None, image_dir=None):
+	def __init__(self, annotatations_dir=None, image_dir=None, index=None):
 		"""
 		Sets up the handler by getting the directories and counting the associated files in each one.
 
@@ -13,31 +32,37 @@ class DataCleanerHandler(object):
 
 		image_dir : string, optional
 			 Directory to image folder.
+
+		index : FileIndex, optional
+			Index shared by the whole run. If not given, both folders are scanned once here.
 		"""
 		if not annotatations_dir or not image_dir:
 			annotatations_dir = input("Annotations Directory: ").strip()
 			image_dir = input("Images Directory: ").strip()
 		self.annotatations_dir = annotatations_dir
 		self.image_dir = image_dir
+		self.label = os.path.basename(os.path.normpath(annotatations_dir))
+
+		if index is None:
+			index = FileIndex()
+			index.add_label(self.label, annotatations_dir, 'xml')
+			index.add_label(self.label, image_dir, 'image')
+		self.index = index
 
-		self.annotationFileNames = self.getFileSet(annotatations_dir, ".xml")
-		self.imageFileNames = self.getFileSet(image_dir, ".JPEG")
+		self.annotationFileNames = self.getFileSet('xml')
+		self.imageFileNames = self.getFileSet('image')
 
-		print("Cleaning data for " + os.path.basename(self.annotatations_dir))
+		print("Cleaning data for " + self.label)
 
 		print("\tAnnotation Files Count: " + str(len(self.annotationFileNames)))
 		print("\tImage Files Count: " + str(len(self.imageFileNames)))
 
-	def getFileSet(self, dir, file_ext):
-		fileSet = set();
-		for file in os.listdir(dir):
-			if file.endswith(file_ext):
-				fileSet.add(file.split(".")[0]);
-		return fileSet
+	def getFileSet(self, kind):
+		return self.index.stems(self.label, kind)
 
 	def isDataValid(self):
-		self.newAnnotationFileNames = self.getFileSet(self.annotatations_dir, ".xml")
-		self.newImageFileNames = self.getFileSet(self.image_dir, ".JPEG")
+		self.newAnnotationFileNames = self.getFileSet('xml')
+		self.newImageFileNames = self.getFileSet('image')
 
 		if (self.newAnnotationFileNames.issubset(self.newImageFileNames) and self.newImageFileNames.issubset(
 				self.newAnnotationFileNames)):
@@ -47,26 +72,121 @@ class DataCleanerHandler(object):
 
 			raise Exception("\tData is still not valid, something went wrong!")
 
-	def deleteFiles(self):
-		# Delete Images
+	def planDeletion(self):
+		"""
+		Works out which files have no counterpart, without touching the disk.
 
+		Returns
+		-------
+		dict
+			The number of 'common' stems, and the stem -> path of each orphan 'xml' and 'image' file.
+		"""
 		commonFiles = self.annotationFileNames.intersection(self.imageFileNames)
 		imageFilesToDelete = self.imageFileNames.difference(commonFiles)
 		annotationFilesToDelete = self.annotationFileNames.difference(commonFiles)
 
 		print("\tnumber of common files: " + str(len(commonFiles)))
 
-		# Delete ImageFiles
+		return {
+			'common': len(commonFiles),
+			'xml': dict((stem, self.index.path(self.label, stem, 'xml')) for stem in annotationFilesToDelete),
+			'image': dict((stem, self.index.path(self.label, stem, 'image')) for stem in imageFilesToDelete),
+		}
+
+	def deleteFiles(self, quarantine_dir=None, num_threads=8):
+		"""
+		Deletes the files of this label that have no counterpart.
+
+		Parameters
+		----------
+		quarantine_dir : str, optional
+			If given, the files are moved there instead of being deleted.
+		num_threads : int, optional
+			Number of threads doing the file operations.
+		"""
+		applyCleanup({'labels': {self.label: self.planDeletion()}}, self.index, quarantine_dir, num_threads)
+
+def planCleanup(cleaners, report_path=None):
+	"""
+	Computes the full set of orphan files across all labels without deleting anything.
+
+	Parameters
+	----------
+	cleaners : list of DataCleanerHandler
+		One handler per label.
+	report_path : str, optional
+		If given, the plan is also written there as json for review.
+
+	Returns
+	-------
+	dict
+		The 'total' number of orphans and the per label plans of DataCleanerHandler.planDeletion under 'labels'.
+	"""
+	plan = {
+		'total': 0,
+		'labels': {},
+	}
+	for cleaner in cleaners:
+		label_plan = cleaner.planDeletion()
+		plan['labels'][cleaner.label] = label_plan
+		plan['total'] += len(label_plan['xml']) + len(label_plan['image'])
+
+	if report_path:
+		with open(report_path, 'w') as f:
+			json.dump(plan, f, indent=1, sort_keys=True)
+		print("\tCleanup plan written to " + report_path)
+
+	return plan
+
+def applyCleanup(plan, index=None, quarantine_dir=None, num_threads=8):
+	"""
+	Deletes every file of a cleanup plan, or moves it into a quarantine folder, using a bounded thread pool.
+
+	Parameters
+	----------
+	plan : dict
+		A plan built by planCleanup, possibly loaded back from its json report.
+	index : FileIndex, optional
+		The index to remove the files from once they are gone.
+	quarantine_dir : str, optional
+		If given, files are moved to quarantine_dir/<label>/ instead of being deleted.
+	num_threads : int, optional
+		Maximum number of file operations in flight.
+	"""
+	jobs = []
+	for label, label_plan in plan['labels'].items():
+		for kind in ('xml', 'image'):
+			for stem, path in label_plan[kind].items():
+				jobs.append((label, stem, kind, path))
+		if quarantine_dir and (label_plan['xml'] or label_plan['image']):
+			Utils.make_dir(os.path.join(quarantine_dir, label))
+
+	if not jobs:
+		return
+
+	def remove(job):
+		label, _, _, path = job
+		if quarantine_dir:
+			shutil.move(path, os.path.join(quarantine_dir, label, os.path.basename(path)))
+		else:
+			os.remove(path)
 
-		for delFile in annotationFilesToDelete:
-			os.remove(self.annotatations_dir + "/" + delFile + ".xml")
+	pool = ThreadPool(num_threads)
+	try:
+		pool.map(remove, jobs, chunksize=16)
+	finally:
+		pool.close()
+		pool.join()
 
-		# Delete AnnotationFiles
+	if index is not None:
+		for label, stem, kind, _ in jobs:
+			index.remove(label, stem, kind)
 
-		for delFile in imageFilesToDelete:
-			os.remove(self.image_dir + "/" + delFile + ".JPEG")
+	print("\t{0} {1} files".format("Quarantined" if quarantine_dir else "Deleted", len(jobs)))
 
-def cleanData(annotatations_dir, image_dir, allImages_dir):
+@instrument.timed('clean')
+def cleanData(annotatations_dir, image_dir, allImages_dir, copy=True, strategy='copy', num_threads=8, index=None,
+			  dry_run=False, quarantine_dir=None, report_path=None):
 	"""
 	This method will call upon the methods of DataCleanerHandler in order to clean the data downloaded from ImageNet.
 	It will read through the annoation folder and image folder and find a common set of file names that are shared. It
@@ -78,32 +198,226 @@ def cleanData(annotatations_dir, image_dir, allImages_dir):
 		The directory where the annotations are stored.
 	image_dir : str, optional
 		The directory where the images are stored.
+	allImages_dir : str
+		The directory the cleaned images are copied into.
+	copy : bool, optional
+		If false, only cleans the source folders and leaves copying to the caller (see sync_files).
+	strategy : str, optional
+		How the images are placed in allImages_dir, see recursive_copy.
+	num_threads : int, optional
+		Number of threads doing the file operations.
+	index : FileIndex, optional
+		Index of both directories. It is built here if not given and kept up to date as files are deleted.
+	dry_run : bool, optional
+		If true, only computes (and reports) what would be deleted, and returns without touching any file.
+	quarantine_dir : str, optional
+		If given, orphan files are moved there instead of being deleted.
+	report_path : str, optional
+		Where to write the json report of the cleanup plan.
+
+	Returns
+	-------
+	dict
+		The cleanup plan, see planCleanup.
 	"""
+	if index is None:
+		index = FileIndex(annotatations_dir, image_dir)
 
-	for obj_label in os.listdir(image_dir):
-		img_path = os.path.join(image_dir, obj_label)
-		ann_path = os.path.join(annotatations_dir, obj_label)
-		if os.path.isdir(img_path) and os.path.isdir(ann_path):
-			cleaner = DataCleanerHandler(ann_path, img_path)
-			cleaner.deleteFiles()
-			cleaner.isDataValid()
-			recursive_copy(img_path, allImages_dir)
-		else:
-			pass
+	cleaners = [DataCleanerHandler(index.label_dir(obj_label, 'xml'), index.label_dir(obj_label, 'image'), index)
+				for obj_label in index.labels()]
+	plan = planCleanup(cleaners, report_path)
+
+	if dry_run:
+		print("\tDry run, {0} files would be removed".format(plan['total']))
+		return plan
+
+	applyCleanup(plan, index, quarantine_dir, num_threads)
+	kept = list(index.stats())
+	instrument.count(len(kept), sum(size for _, size, _ in kept))
+
+	for cleaner in cleaners:
+		cleaner.isDataValid()
+		if copy:
+			jobs = [(path, os.path.join(allImages_dir, os.path.basename(path))) for path in index.files(cleaner.label, 'image')]
+			copy_files(jobs, allImages_dir, strategy, num_threads)
 
-def recursive_copy(src, dest):
+	return plan
+
+def recursive_copy(src, dest, strategy='copy', num_threads=8):
 	"""
 	Copy each file from src dir to dest dir, including sub-directories.
+
+	Parameters
+	----------
+	src : str
+		The directory to copy from.
+	dest : str
+		The directory to copy into.
+	strategy : str, optional
+		One of COPY_STRATEGIES. 'hardlink', 'reflink' and 'symlink' avoid duplicating the image bytes and fall back to
+		a plain copy when the filesystem refuses, for e.g. a hard link across devices. 'manifest' doesn't create any
+		file and instead records where each image lives in dest/sources.json.
+	num_threads : int, optional
+		Number of threads doing the file operations.
+	"""
+	jobs = []
+	collect_files(src, dest, jobs)
+	copy_files(jobs, dest, strategy, num_threads)
+
+def copy_files(jobs, dest, strategy='copy', num_threads=8):
+	"""
+	Places a list of (source path, destination path) pairs under dest, see recursive_copy for the strategies.
+	"""
+	if strategy == 'manifest':
+		record_sources(dest, dict((os.path.relpath(dest_path, dest), os.path.abspath(file_path))
+								  for file_path, dest_path in jobs))
+		return
+
+	place_files(jobs, strategy, num_threads)
+
+def collect_files(src, dest, jobs):
+	"""
+	Walks src and appends a (source path, destination path) pair for each file, creating the sub-directories in dest.
 	"""
 	for item in os.listdir(src):
 		file_path = os.path.join(src, item)
 
 		# if item is a file, copy it
 		if os.path.isfile(file_path):
-			shutil.copy(file_path, dest)
+			jobs.append((file_path, os.path.join(dest, item)))
 
 		# else if item is a folder, recurse
 		elif os.path.isdir(file_path):
 			new_dest = os.path.join(dest, item)
-			os.mkdir(new_dest)
-			recursive_copy(file_path, new_dest)
\ No newline at end of file
+			if not os.path.isdir(new_dest):
+				os.mkdir(new_dest)
+			collect_files(file_path, new_dest, jobs)
+
+def place_files(jobs, strategy='copy', num_threads=8):
+	"""
+	Places every (source path, destination path) pair using a thread pool and reports the strategies used.
+	"""
+	if strategy not in COPY_STRATEGIES:
+		raise ValueError("Unknown copy strategy '{0}', expected one of {1}".format(strategy, COPY_STRATEGIES))
+	if not jobs:
+		return
+
+	pool = ThreadPool(num_threads)
+	try:
+		used = pool.map(lambda job: place_file(job[0], job[1], strategy), jobs, chunksize=64)
+	finally:
+		pool.close()
+		pool.join()
+
+	counts = dict((name, used.count(name)) for name in set(used))
+	print("\tPlaced " + ", ".join("{0} files by {1}".format(counts[name], name) for name in sorted(counts)))
+
+def place_file(src, dest, strategy='copy'):
+	"""
+	Places a single file at dest, falling back to a plain copy if the requested strategy isn't possible.
+
+	Returns
+	-------
+	str
+		The strategy that was actually used.
+	"""
+	if os.path.lexists(dest):
+		os.remove(dest)
+
+	try:
+		if strategy == 'hardlink':
+			os.link(src, dest)
+			return strategy
+		if strategy == 'symlink':
+			os.symlink(os.path.abspath(src), dest)
+			return strategy
+		if strategy == 'reflink':
+			reflink(src, dest)
+			return strategy
+	except (OSError, IOError) as e:
+		if e.errno not in (errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK, errno.EINVAL, errno.ENOTTY,
+						   errno.EOPNOTSUPP, errno.ENOSYS):
+			raise
+		if os.path.lexists(dest):
+			os.remove(dest)
+
+	shutil.copy(src, dest)
+	return 'copy'
+
+def reflink(src, dest):
+	"""
+	Clones src into dest sharing the same extents, which only works on copy-on-write filesystems.
+	"""
+	if fcntl is None:
+		raise OSError(errno.ENOSYS, "reflinks are not supported on this platform")
+
+	with open(src, 'rb') as src_file:
+		with open(dest, 'wb') as dest_file:
+			fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+	shutil.copystat(src, dest)
+
+def record_sources(dest, sources, removed=()):
+	"""
+	Updates the sources.json index written by the 'manifest' copy strategy.
+
+	Parameters
+	----------
+	dest : str
+		The directory the images would have been copied into.
+	sources : dict
+		File path relative to dest -> absolute path of the source image.
+	removed : iterable of str, optional
+		Relative file paths to drop from the index.
+	"""
+	index = load_sources(dest) or {}
+	index.update(sources)
+	for name in removed:
+		index.pop(name, None)
+
+	with open(os.path.join(dest, SOURCES_FILE), 'w') as f:
+		json.dump(index, f, indent=0, sort_keys=True)
+
+def load_sources(dest):
+	"""
+	Reads the sources.json index of a directory filled with the 'manifest' copy strategy.
+
+	Returns
+	-------
+	dict or None
+		File path relative to dest -> absolute path of the source image, None if the directory holds real files.
+	"""
+	sources_path = os.path.join(dest, SOURCES_FILE)
+	if not os.path.isfile(sources_path):
+		return None
+	with open(sources_path, 'r') as f:
+		return json.load(f)
+
+def sync_files(diff, dest, strategy='copy', num_threads=8):
+	"""
+	Brings a flat copy of the cleaned images up to date without copying everything again.
+
+	Parameters
+	----------
+	diff : dict
+		Output of ManifestHandler.diff, with lists of 'added', 'changed' and 'removed' source file paths.
+	dest : str
+		The directory holding the copies.
+	strategy : str, optional
+		How the images are placed in dest, see recursive_copy.
+	num_threads : int, optional
+		Number of threads doing the file operations.
+	"""
+	updated = diff['added'] + diff['changed']
+
+	if strategy == 'manifest':
+		record_sources(dest, dict((os.path.basename(file_path), os.path.abspath(file_path)) for file_path in updated),
+					   [os.path.basename(file_path) for file_path in diff['removed']])
+		return
+
+	for file_path in diff['removed']:
+		dest_path = os.path.join(dest, os.path.basename(file_path))
+		if os.path.lexists(dest_path):
+			os.remove(dest_path)
+
+	place_files([(file_path, os.path.join(dest, os.path.basename(file_path))) for file_path in updated], strategy,
+				num_threads)
@@ -1,7 +1,17 @@
 import os
+import json
+import shutil
+import multiprocessing
+import cv2
 import turicreate as tc
 
 from utils import Utils
+import boxes
+import instrument
+from annotationStore import AnnotationStore
+from validateData import load_sources
+from resize import resizeData
+from imageStore import ImageStore
 
 try:
 	import xml.etree.cElementTree as et
@@ -13,6 +23,15 @@ class AnnotationError(Exception):
 	pass
 
 
+# xml tag -> key in the bounding dict consumed by ImageHandler.transform_bounding
+BOUNDING_TAGS = {
+	'xmin': 'xMin',
+	'ymin': 'yMin',
+	'xmax': 'xMax',
+	'ymax': 'yMax',
+}
+
+
 class ImageHandler(object):
 	def __init__(self):
 		self.root_dir = os.path.dirname(os.path.realpath(__file__))
@@ -67,12 +86,58 @@ class ImageHandler(object):
 
 		return data
 
+	def iterparse_xml(self, label, xml_file, image_dir, img_type='JPEG'):
+		"""
+		Streaming counterpart of parse_xml.
+
+		Reads the file with iterparse instead of building the full tree, only keeps the filename and bounding box tags
+		and clears every element once it has been read.
+
+		Parameters
+		----------
+		label : str
+			The label of the annotated object, for e.g. 'barbell'.
+		xml_file: str
+			Path to the xml annotation file.
+		image_dir: str
+			The folder path containing the annotated image files.
+		img_type: str, optional
+			The image extension, for e.g. 'JPEG'.
+
+		Returns
+		-------
+		dict
+			Data points of interest stored as key value pairs, identical to parse_xml.
+		"""
+		data = {}
+		bounding = {
+			'label': label,
+			'xMin': [],
+			'xMax': [],
+			'yMin': [],
+			'yMax': [],
+		}
+
+		for _, elem in et.iterparse(xml_file):
+			tag = elem.tag
+
+			if tag == 'filename':
+				data['path'] = os.path.join(image_dir, "{0}.{1}".format(elem.text, img_type))
+			elif tag in BOUNDING_TAGS:
+				bounding[BOUNDING_TAGS[tag]].append(int(elem.text))
+			elem.clear()
+
+		data['annotations'] = ImageHandler.transform_bounding(bounding)
+
+		return data
+
 	@staticmethod
 	def transform_bounding(bounding):
 		"""
 		Mutates the bounding box data to better fit TuriCreate's standards.
 
-		Changes data of min/max coordinates to height, width, center points.
+		Changes data of min/max coordinates to height, width, center points. Coordinates come out as floats, see the
+		float policy in boxes.py.
 
 		Parameters
 		----------
@@ -87,51 +152,124 @@ class ImageHandler(object):
 		if not len(bounding['xMin']) == len(bounding['yMin']) == len(bounding['xMax']) == len(bounding['yMax']):
 			raise AnnotationError()
 
-		coordinates = []
-
-		for k in range(len(bounding['xMin'])):
-			coordinates.append(
-				{
-					'coordinates':
-						{
-							'x': Utils.calc_center(bounding['xMin'][k], bounding['xMax'][k]),
-							'width': Utils.calc_dist(bounding['xMin'][k], bounding['xMax'][k]),
-							'y': Utils.calc_center(bounding['yMin'][k], bounding['yMax'][k]),
-							'height': Utils.calc_dist(bounding['yMin'][k], bounding['yMax'][k])
-						},
-					'label': bounding['label']
-				})
-
-		return coordinates
+		xyxy = boxes.as_boxes(list(zip(bounding['xMin'], bounding['yMin'], bounding['xMax'], bounding['yMax'])))
+		return boxes.to_annotations(boxes.xyxy_to_cxcywh(xyxy), bounding['label'])
 
 
 class TCHandler(object):
+	# tc.Image format of JPEG encoded image data
+	JPG_FORMAT = 0
+	# A sharded dataset is a <name>.shards folder with this index, listing its SFrame shards
+	SHARDS_INDEX = 'index.json'
+	SHARD_ROWS = 10000
+
 	def __init__(self):
 		pass
 
 	@staticmethod
-	def attach_images(sf, image_dir):
+	def image_from_array(array):
 		"""
-		Joins an SFrame of images with SFrame of annotation data.
+		Wraps an image decoded by cv2 into a JPEG encoded tc.Image, without going through a file.
 
-		Both SFrames share the column 'path', and are joined in a SQL-like manner by that column.
+		Parameters
+		----------
+		array: numpy.ndarray
+			The image as a BGR (or grayscale) uint8 array.
+
+		Returns
+		-------
+		Image
+			A JPEG Turi Create image, as tc.Image would read it from a file.
+		"""
+		height, width = array.shape[:2]
+		channels = array.shape[2] if array.ndim == 3 else 1
+		ok, encoded = cv2.imencode('.jpg', array)
+		if not ok:
+			raise ValueError("Could not encode an image of shape {0}".format(array.shape))
+		data = bytearray(encoded.tobytes())
+		return tc.Image(_image_data=data, _image_data_size=len(data), _height=height, _width=width,
+						_channels=channels, _format_enum=TCHandler.JPG_FORMAT)
+
+	@staticmethod
+	@instrument.timed('attach_images', unit='images')
+	def attach_images(sf, batch_size=1000):
+		"""
+		Adds the images of an SFrame of annotation data as a column.
+
+		The images are read straight from the 'path' column in row order, so only annotated images are loaded, the
+		image folder isn't listed and no join on the path is needed. Missing images are left as None.
 
 		Parameters
 		----------
 		sf: SFrame
 			An SFrame representation of the data. Includes two columns: path, annotations.
-		image_dir: str
-			The folder path containing the images in JPEG format. Includes two columns: path, images.
+		batch_size: int, optional
+			Number of images held in memory before they are flushed into the image column.
+
+		Returns
+		-------
+		SFrame
+			An SFrame representation of the data with the images. Includes three columns: path, annotations, image.
+		"""
+		images = None
+		batch = []
+		for path in sf['path']:
+			batch.append(tc.Image(path) if os.path.isfile(path) else None)
+			if len(batch) >= batch_size:
+				images = TCHandler.append_images(images, batch)
+				batch = []
+		images = TCHandler.append_images(images, batch)
+		instrument.count(len(sf))
+
+		sf['image'] = images
+		return sf
+
+	@staticmethod
+	def append_images(images, batch):
+		"""
+		Appends a list of images to an image SArray, which is created if images is None.
+		"""
+		batch = tc.SArray(batch, dtype=tc.Image)
+		return batch if images is None else images.append(batch)
+
+	@staticmethod
+	def append_rows(sf, data):
+		"""
+		Flushes the buffered rows into an SFrame and empties the buffer.
+
+		Parameters
+		----------
+		sf: SFrame
+			The SFrame built so far, or None if nothing has been flushed yet.
+		data: dict
+			Column name to list of values. The lists are cleared once they have been written.
 
 		Returns
 		-------
 		SFrame
-			An SFrame representation of the data with the images. Includes three columns: path, images, annotations.
+			The SFrame with the buffered rows appended.
 		"""
-		sf_images = tc.image_analysis.load_images(image_dir)
-		return sf.join(sf_images, on='path', how='left')
+		if sf is not None and not len(data['path']):
+			return sf
+		batch = tc.SFrame(data)
+		for column in data.values():
+			del column[:]
+		# SFrame.append is not in place, it returns the combined SFrame
+		return batch if sf is None else sf.append(batch)
 
 	@staticmethod
+	def write_store(output_dir, filename):
+		"""
+		Writes the columnar AnnotationStore of a dataset already in the output directory, next to it.
+
+		Only the path and annotations columns are read, so the images aren't loaded.
+		"""
+		sf = TCHandler.load_dataset(TCHandler.dataset_path(output_dir, filename))
+		AnnotationStore.from_sframe(sf[['path', 'annotations']]).save(
+			os.path.join(output_dir, '{0}.annotations'.format(filename)))
+
+	@staticmethod
+	@instrument.timed('sframe_write', unit='rows')
 	def write(sf, output_dir, filename='ig02'):
 		"""
 		Writes the SFrame to an output directory with filename.
@@ -146,9 +284,236 @@ class TCHandler(object):
 			The name of the SFrame file.
 		"""
 		sf.save(os.path.join(output_dir, '{0}.sframe'.format(filename)))
+		instrument.count(len(sf))
 
+	@staticmethod
+	def shards_dir(output_dir, name):
+		return os.path.join(output_dir, '{0}.shards'.format(name))
 
-def createSFrame(annotatations_dir=None, image_dir=None, output_dir=None):
+	@staticmethod
+	def dataset_path(output_dir, name):
+		"""
+		Returns the <name>.shards folder of a dataset, or the <name>.sframe an older run wrote if it isn't sharded.
+		"""
+		shards_dir = TCHandler.shards_dir(output_dir, name)
+		return shards_dir if os.path.isdir(shards_dir) else os.path.join(output_dir, '{0}.sframe'.format(name))
+
+	@staticmethod
+	def read_index(output_dir, name):
+		"""
+		Reads the index of a sharded dataset.
+
+		Returns
+		-------
+		dict
+			'shards', the list of {'path', 'rows'} shards with paths relative to output_dir, and 'next', the number of
+			the next shard written. Empty if the dataset doesn't exist yet.
+		"""
+		index_path = os.path.join(TCHandler.shards_dir(output_dir, name), TCHandler.SHARDS_INDEX)
+		if not os.path.isfile(index_path):
+			return {'shards': [], 'next': 0}
+		with open(index_path, 'r') as f:
+			return json.load(f)
+
+	@staticmethod
+	def write_index(output_dir, name, index):
+		"""
+		Writes the index of a sharded dataset, replacing the previous one atomically.
+		"""
+		shards_dir = TCHandler.shards_dir(output_dir, name)
+		Utils.make_dir(shards_dir)
+		index_path = os.path.join(shards_dir, TCHandler.SHARDS_INDEX)
+		with open(index_path + '.tmp', 'w') as f:
+			json.dump(index, f, indent=2)
+		os.rename(index_path + '.tmp', index_path)
+
+	@staticmethod
+	@instrument.timed('sframe_write', unit='rows')
+	def append_shards(sf, output_dir, name, shard_rows=None):
+		"""
+		Adds rows to a sharded dataset by writing them as new shards. The existing shards aren't touched.
+
+		Parameters
+		----------
+		sf: SFrame
+			The rows to add.
+		output_dir: str
+			The directory holding the dataset.
+		name: str
+			The name of the dataset, for e.g. 'augmented'.
+		shard_rows: int, optional
+			Maximum number of rows per shard, defaults to SHARD_ROWS.
+		"""
+		shard_rows = shard_rows or TCHandler.SHARD_ROWS
+		index = TCHandler.read_index(output_dir, name)
+		for start in range(0, len(sf), shard_rows):
+			shard = sf[start:start + shard_rows]
+			shard_path = os.path.join('{0}.shards'.format(name), 'shard_{0:05d}.sframe'.format(index['next']))
+			shard.save(os.path.join(output_dir, shard_path))
+			index['shards'].append({'path': shard_path, 'rows': len(shard)})
+			index['next'] += 1
+			# Indexed shard by shard, so an interrupted write only loses the shard being written
+			TCHandler.write_index(output_dir, name, index)
+		instrument.count(len(sf))
+
+	@staticmethod
+	def update_shards(sf, output_dir, name, stems=None):
+		"""
+		Writes rows into a sharded dataset, only rewriting the shards that hold changed rows.
+
+		Parameters
+		----------
+		sf: SFrame
+			The new rows.
+		output_dir: str
+			The directory holding the dataset.
+		name: str
+			The name of the dataset, for e.g. 'original'.
+		stems: set of str, optional
+			Image file names (without extension) whose rows are replaced by sf, see remove_rows. If not given, the
+			dataset is made of sf alone.
+		"""
+		sframe_path = os.path.join(output_dir, '{0}.sframe'.format(name))
+		if stems is None:
+			TCHandler.clear_shards(output_dir, name)
+			TCHandler.write_index(output_dir, name, {'shards': [], 'next': 0})
+			# Full copy written by older runs
+			if os.path.isdir(sframe_path):
+				shutil.rmtree(sframe_path)
+		else:
+			if not os.path.isdir(TCHandler.shards_dir(output_dir, name)) and os.path.isdir(sframe_path):
+				# SFrame of an older run, kept as the first shard
+				TCHandler.link_shards(output_dir, name, [name])
+			TCHandler.remove_rows(output_dir, name, stems)
+		TCHandler.append_shards(sf, output_dir, name)
+
+	@staticmethod
+	def clear_shards(output_dir, name):
+		"""
+		Deletes a sharded dataset along with its shards.
+		"""
+		shards_dir = TCHandler.shards_dir(output_dir, name)
+		if os.path.isdir(shards_dir):
+			shutil.rmtree(shards_dir)
+
+	@staticmethod
+	def link_shards(output_dir, name, sources):
+		"""
+		Writes a sharded dataset made of the data of other datasets, without copying any of it.
+
+		Parameters
+		----------
+		output_dir: str
+			The directory holding the datasets.
+		name: str
+			The name of the new dataset, for e.g. 'final'.
+		sources: list of str
+			The names of the datasets to include, either sharded or written as a single <source>.sframe.
+		"""
+		shards = []
+		for source in sources:
+			if os.path.isdir(TCHandler.shards_dir(output_dir, source)):
+				shards.extend(TCHandler.read_index(output_dir, source)['shards'])
+			else:
+				sframe_path = '{0}.sframe'.format(source)
+				shards.append({'path': sframe_path, 'rows': len(tc.SFrame(os.path.join(output_dir, sframe_path)))})
+		TCHandler.clear_shards(output_dir, name)
+		TCHandler.write_index(output_dir, name, {'shards': shards, 'next': 0})
+
+	@staticmethod
+	@instrument.timed('sframe_merge', unit='rows')
+	def remove_rows(output_dir, name, stems):
+		"""
+		Drops the rows whose image file name is in stems from a sharded dataset.
+
+		Only the shards holding such rows are rewritten, the others are left as they are.
+
+		Parameters
+		----------
+		output_dir: str
+			The directory holding the dataset.
+		name: str
+			The name of the dataset.
+		stems: set of str
+			Image file names (without extension) to drop.
+		"""
+		index = TCHandler.read_index(output_dir, name)
+		kept = []
+		for shard in index['shards']:
+			shard_path = os.path.join(output_dir, shard['path'])
+			sf = tc.SFrame(shard_path)
+			keep = sf['path'].apply(lambda path: os.path.splitext(os.path.basename(path))[0] not in stems)
+			if keep.all():
+				kept.append(shard)
+				continue
+
+			sf = sf[keep]
+			if len(sf):
+				sf.save(shard_path + '.tmp')
+				shutil.rmtree(shard_path)
+				os.rename(shard_path + '.tmp', shard_path)
+				shard['rows'] = len(sf)
+				kept.append(shard)
+				instrument.count(len(sf))
+			else:
+				shutil.rmtree(shard_path)
+		index['shards'] = kept
+		TCHandler.write_index(output_dir, name, index)
+
+	@staticmethod
+	def load_dataset(path):
+		"""
+		Loads a dataset for reading, for e.g. training.
+
+		Parameters
+		----------
+		path: str
+			Either a <name>.sframe or a sharded <name>.shards folder.
+
+		Returns
+		-------
+		SFrame
+			The shards of a sharded dataset are appended in index order. Appending loaded SFrames is lazy, so nothing
+			is copied until the data is read.
+		"""
+		index_path = os.path.join(path, TCHandler.SHARDS_INDEX)
+		if not os.path.isfile(index_path):
+			return tc.SFrame(path)
+
+		with open(index_path, 'r') as f:
+			shards = json.load(f)['shards']
+		output_dir = os.path.dirname(os.path.normpath(path))
+		sf = None
+		for shard in shards:
+			shard_sf = tc.SFrame(os.path.join(output_dir, shard['path']))
+			sf = shard_sf if sf is None else sf.append(shard_sf[sf.column_names()])
+		return sf if sf is not None else tc.SFrame()
+
+
+def _parse_annotation_file(job):
+	"""
+	Parses a single annotation file. Used as the process pool entry point, so it has to live at module level.
+
+	Parameters
+	----------
+	job : tuple
+		The (label, xml file path, image directory, streaming) tuple to parse.
+
+	Returns
+	-------
+	dict
+		Data points of interest stored as key value pairs.
+	"""
+	obj_label, xml_file, image_dir, streaming = job
+	if streaming:
+		return ImageHandler().iterparse_xml(obj_label, xml_file, image_dir)
+	return ImageHandler().parse_xml(obj_label, et.parse(xml_file), image_dir)
+
+
+@instrument.timed('convert')
+def createSFrame(annotatations_dir=None, image_dir=None, output_dir=None, num_workers=1, chunk_size=64,
+				 streaming=False, batch_size=10000, stems=None, index=None, resize=None, letterbox=True, resize_dir=None,
+				 exclude=None, image_store=None, store_max_side=None):
 	"""
 	Parses through the annotations, refactors the data, and then creates the SFrame.
 
@@ -163,6 +528,37 @@ def createSFrame(annotatations_dir=None, image_dir=None, output_dir=None):
 		The directory where the images are stored.
 	output_dir : str, optional
 		The directory to write the SFrame files in.
+	num_workers : int, optional
+		Number of processes used to parse the xml files. A value of 1 parses everything in the current process.
+	chunk_size : int, optional
+		Number of files handed to a worker at a time. The progress bar is also only refreshed once per chunk.
+	streaming : bool, optional
+		If true, the files are read with iterparse and rows are flushed into the SFrame every batch_size rows, so
+		memory stays flat no matter how many annotations there are.
+	batch_size : int, optional
+		Number of rows held in memory before they are flushed to the SFrame in streaming mode.
+	stems : set of str, optional
+		If given, only the samples with these file names (without extension) are parsed, and their rows replaced in
+		the 'original' dataset already in output_dir, see TCHandler.update_shards. Stems with no annotation file left
+		are removed from it.
+	index : FileIndex, optional
+		Index of the annotation and image folders built earlier in the run. If given, the label folders aren't listed
+		again and image file names are taken from the index, whatever the case of their extension.
+	resize : tuple, optional
+		If given, the images are resized to this (width, height) before they are stored in the SFrame, and their
+		annotations rescaled to match. Training then reads compact images instead of full size ones.
+	letterbox : bool, optional
+		Keep the aspect ratio of resized images and pad them, instead of stretching them.
+	resize_dir : str, optional
+		The directory the resized images are written in, required with resize.
+	exclude : dict, optional
+		Stem -> None to leave a sample out, or the indices of its boxes to drop, as built by
+		annotationQuality.exclusions. Left out samples aren't parsed at all.
+	image_store : str, optional
+		If given, every image of the 'original' SFrame is also decoded into an ImageStore in this <name>.images folder,
+		see imageStore.py, for the augmentation to read. The SFrame itself keeps the encoded JPEGs.
+	store_max_side : int, optional
+		Longest side the images of the store are decoded at, None for full resolution.
 	"""
 
 	if not annotatations_dir or not image_dir or not output_dir:
@@ -172,36 +568,110 @@ def createSFrame(annotatations_dir=None, image_dir=None, output_dir=None):
 
 	handler = ImageHandler()
 
+	# Images placed with the 'manifest' copy strategy are read from where they already live
+	sources = load_sources(image_dir)
+
 	finalData = {
 		'path': [],
 		'annotations': []
 	}
-
-	for obj_label in os.listdir(annotatations_dir):
-		obj_path = os.path.join(annotatations_dir, obj_label)
-		prefix = '({0}) {1}/{2} files:'
-		if os.path.isdir(obj_path):
-			num_files = len([x for x in os.listdir(obj_path) if x.endswith('.xml')])
-			i = 0
+	sf = None
+
+	def flush(sf):
+		if resize:
+			# Resized in the parsing pool, instead of starting a pool per flush
+			resizeData(finalData, resize_dir, resize, letterbox, num_workers, chunk_size, pool)
+		return TCHandler.append_rows(sf, finalData)
+
+	if resize and stems is not None and os.path.isdir(resize_dir):
+		# Changed samples are overwritten, the resized images of removed ones have to go
+		for file in os.listdir(resize_dir):
+			if os.path.splitext(file)[0] in stems:
+				os.remove(os.path.join(resize_dir, file))
+
+	pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+
+	try:
+		if index is not None:
+			labels = index.labels(('xml',))
+		else:
+			labels = sorted(x for x in os.listdir(annotatations_dir) if os.path.isdir(os.path.join(annotatations_dir, x)))
+
+		for obj_label in labels:
+			prefix = '({0}) {1}/{2} files:'
+			if index is not None:
+				xml_files = index.files(obj_label, 'xml')
+			else:
+				obj_path = os.path.join(annotatations_dir, obj_label)
+				xml_files = sorted(os.path.join(obj_path, x) for x in os.listdir(obj_path) if x.lower().endswith('.xml'))
+			if stems is not None:
+				xml_files = [x for x in xml_files if os.path.splitext(os.path.basename(x))[0] in stems]
+				if not xml_files:
+					continue
+			if exclude:
+				xml_files = [x for x in xml_files if exclude.get(os.path.splitext(os.path.basename(x))[0], ()) is not None]
+				if not xml_files:
+					continue
+			num_files = len(xml_files)
+			if index is not None:
+				# Sizes were recorded by the scan that built the index, so no file is stat'ed again
+				nbytes = sum(index.size(obj_label, os.path.splitext(os.path.basename(xml_file))[0], 'xml') or 0
+							 for xml_file in xml_files)
+			else:
+				nbytes = sum(os.path.getsize(xml_file) for xml_file in xml_files)
+			instrument.count(num_files, nbytes)
 			Utils.showProgress(0, num_files, prefix=prefix.format(obj_label, 0, num_files), length=50)
 
-			for file in os.listdir(obj_path):
-				if file.endswith('.xml'):
-					xml_file = os.path.join(obj_path, file)
-					xml_tree = et.parse(xml_file)
-					data = handler.parse_xml(obj_label, xml_tree, image_dir)
-
-					finalData['path'].append(data['path'])
-					finalData['annotations'].append(data['annotations'])
-
-					# Update the progress bar
-					i += 1
+			if pool:
+				# imap hands back results in submission order, so the SFrame rows match the serial path
+				jobs = [(obj_label, xml_file, image_dir, streaming) for xml_file in xml_files]
+				results = pool.imap(_parse_annotation_file, jobs, chunksize=chunk_size)
+			elif streaming:
+				results = (handler.iterparse_xml(obj_label, xml_file, image_dir) for xml_file in xml_files)
+			else:
+				results = (handler.parse_xml(obj_label, et.parse(xml_file), image_dir) for xml_file in xml_files)
+
+			for i, (xml_file, data) in enumerate(zip(xml_files, results), 1):
+				stem = os.path.splitext(os.path.basename(xml_file))[0]
+				if exclude and exclude.get(stem):
+					dropped = set(exclude[stem])
+					data['annotations'] = [a for j, a in enumerate(data['annotations']) if j not in dropped]
+				if index is not None:
+					indexed_path = index.path(obj_label, stem, 'image')
+					if indexed_path:
+						data['path'] = os.path.join(image_dir, os.path.basename(indexed_path))
+				if sources:
+					data['path'] = sources.get(os.path.basename(data['path']), data['path'])
+				finalData['path'].append(data['path'])
+				finalData['annotations'].append(data['annotations'])
+
+				if streaming and len(finalData['path']) >= batch_size:
+					sf = flush(sf)
+
+				# Update the progress bar
+				if not pool or i % chunk_size == 0 or i == num_files:
 					Utils.showProgress(i, num_files, prefix=prefix.format(obj_label, i, num_files), length=50)
+		sf = flush(sf)
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
 
 	tcHandler = TCHandler()
-	sf = tc.SFrame(finalData)
-	sf = tcHandler.attach_images(sf, image_dir)
-	tcHandler.write(sf, output_dir, 'original')
+	if image_store:
+		# Built before the images are attached, from every row the 'original' SFrame will hold
+		rows = sf[['path', 'annotations']]
+		original_path = tcHandler.dataset_path(output_dir, 'original')
+		if stems is not None and os.path.isdir(original_path):
+			existing = tcHandler.load_dataset(original_path)[['path', 'annotations']]
+			kept = existing['path'].apply(lambda path: os.path.splitext(os.path.basename(path))[0] not in stems)
+			rows = existing[kept].append(rows)
+		ImageStore.build(rows['path'], rows['annotations'], image_store, store_max_side, num_workers * 2, chunk_size)
+	if len(sf):
+		sf = tcHandler.attach_images(sf)
+	# Written as shards, so an update only rewrites the shards holding changed samples
+	tcHandler.update_shards(sf, output_dir, 'original', stems)
+	tcHandler.write_store(output_dir, 'original')
 
 
 def explore(sframe_dir=None, draw_bounding_boxes=True, limit=10):
@@ -221,7 +691,7 @@ def explore(sframe_dir=None, draw_bounding_boxes=True, limit=10):
 		sframe_dir = raw_input("Sframe Directory: ")
 	sframe_dir = sframe_dir.strip()
 
-	sf = tc.SFrame(sframe_dir)
+	sf = TCHandler.load_dataset(sframe_dir)
 	if draw_bounding_boxes:
 		sf['image_with_ground_truth'] = tc.object_detector.util.draw_bounding_boxes(sf['image'], sf['annotations'])
 		sf['image_with_ground_truth'].apply(lambda x: x)